@@ -0,0 +1,117 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+
+from airtable_connector import AirtableConnector
+
+logger = logging.getLogger("airtable-batch")
+
+# How long a partial batch waits for more records before it is sent
+LINGER_SECONDS = float(os.environ.get("AIRTABLE_BATCH_LINGER", "0.5"))
+
+# (fields, tracking ID, future resolved with the created record)
+_Pending = Tuple[Dict[str, Any], Optional[str], asyncio.Future]
+
+
+class AirtableBatchWriter:
+    """
+    Coalesces single-record creates into bulk Airtable requests
+
+    Records are buffered per table and sent as one request once
+    `batch_size` of them are waiting or the oldest has waited `linger`
+    seconds, whichever comes first. Each caller gets back its own record.
+    """
+    def __init__(self, connector: AirtableConnector, batch_size: int = AirtableConnector.MAX_BATCH_SIZE,
+                 linger: float = LINGER_SECONDS):
+        self.connector = connector
+        self.batch_size = min(batch_size, AirtableConnector.MAX_BATCH_SIZE)
+        self.linger = linger
+        self._buffers: Dict[str, List[_Pending]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._flushes: set = set()
+
+    async def submit(self, table_name: str, fields: Dict[str, Any], tracking_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue one record for creation and wait for Airtable to create it
+        """
+        future = asyncio.get_running_loop().create_future()
+        buffer = self._buffers.setdefault(table_name, [])
+        buffer.append((fields, tracking_id, future))
+
+        if len(buffer) >= self.batch_size:
+            self._start_flush(table_name)
+        elif table_name not in self._timers:
+            self._timers[table_name] = asyncio.create_task(self._flush_after_linger(table_name))
+
+        return await future
+
+    def pending(self) -> int:
+        """
+        Records buffered and not yet sent
+        """
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    async def close(self) -> None:
+        """
+        Send everything still buffered and wait for in-flight batches
+        """
+        for table_name in list(self._buffers):
+            while self._buffers.get(table_name):
+                self._start_flush(table_name)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _flush_after_linger(self, table_name: str) -> None:
+        await asyncio.sleep(self.linger)
+        self._timers.pop(table_name, None)
+        while self._buffers.get(table_name):
+            self._start_flush(table_name)
+
+    def _start_flush(self, table_name: str) -> None:
+        buffer = self._buffers.get(table_name, [])
+        batch, self._buffers[table_name] = buffer[:self.batch_size], buffer[self.batch_size:]
+
+        if not self._buffers[table_name]:
+            timer = self._timers.pop(table_name, None)
+            if timer is not None and timer is not asyncio.current_task():
+                timer.cancel()
+
+        task = asyncio.create_task(self._flush(table_name, batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, table_name: str, batch: List[_Pending]) -> None:
+        try:
+            records = await asyncio.to_thread(
+                self.connector.create_records, table_name, [fields for fields, _, _ in batch]
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 422 and len(batch) > 1:
+                # One invalid record rejects the whole request, so send the
+                # batch one by one to fail only the bad record
+                await asyncio.gather(*(self._flush(table_name, [item]) for item in batch))
+                return
+            self._fail(batch, e)
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        # Airtable returns created records in request order
+        for (fields, tracking_id, future), record in zip(batch, records):
+            if not future.done():
+                future.set_result(record)
+            logger.info("Airtable record created: table=%s, id=%s", table_name, record.get("id"),
+                        extra={"tracking_id": tracking_id})
+
+        if len(records) < len(batch):
+            self._fail(batch[len(records):], RuntimeError("Airtable returned fewer records than were sent"))
+
+    @staticmethod
+    def _fail(batch: List[_Pending], error: Exception) -> None:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
@@ -1,8 +1,18 @@
 import os
+import time
+import tempfile
 import requests
 import logging
 import json
-from typing import Dict, Any, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional
+from rate_limit import get_bucket
+from cache import TTLCache, MISSING
+from airtable_mapping import build_mappers
+import http_clients
+import metrics
+import tracing
 
 logger = logging.getLogger("airtable-connector")
 
@@ -10,6 +20,16 @@ class AirtableConnector:
     """
     Connector class for Airtable API integration
     """
+    # Most records Airtable accepts in a single create/update request
+    MAX_BATCH_SIZE = 10
+    
+    # Most records Airtable returns in one page of a list request
+    MAX_PAGE_SIZE = 100
+    
+    # Airtable allows 5 requests per second per base and asks clients that
+    # exceed it to wait 30 seconds before trying again
+    RATE_LIMIT_BACKOFF = 30
+    
     def __init__(self, api_key: str = None, base_id: str = None):
         # Get API key from parameter or environment variable, explicitly cast to string
         api_key_env = os.environ.get("AIRTABLE_API_KEY")
@@ -25,7 +45,9 @@ class AirtableConnector:
         if not self.base_id:
             raise ValueError("Missing Airtable Base ID. Please provide it or set AIRTABLE_BASE_ID environment variable.")
             
-        self.api_url = f"https://api.airtable.com/v0/{self.base_id}"
+        # Overridable so the API can be pointed at a stand-in, e.g. for benchmarks
+        self.api_root = os.environ.get("AIRTABLE_API_URL", "https://api.airtable.com").rstrip("/")
+        self.api_url = f"{self.api_root}/v0/{self.base_id}"
         
         # Set up headers for API requests
         self.headers = {
@@ -33,8 +55,83 @@ class AirtableConnector:
             "Content-Type": "application/json"
         }
         
-        # Ensure required tables exist
-        self._ensure_tables_exist()
+        # Keep-alive session so calls reuse the TLS connection to api.airtable.com
+        self.session = http_clients.new_session()
+        self.session.headers.update(self.headers)
+        self.timeout = (http_clients.CONNECT_TIMEOUT, http_clients.READ_TIMEOUT)
+        
+        # Requests per second per base, shared by every connector for the base
+        self.rate_limiter = get_bucket(
+            f"airtable:{self.base_id}",
+            float(os.environ.get("AIRTABLE_RATE_LIMIT", "5"))
+        )
+        self.max_retries = int(os.environ.get("AIRTABLE_MAX_RETRIES", "3"))
+        self.rate_limited_responses = 0
+        
+        # Read-through cache for find_record lookups
+        self._find_cache = TTLCache(
+            maxsize=int(os.environ.get("AIRTABLE_FIND_CACHE_SIZE", "1024")),
+            ttl=float(os.environ.get("AIRTABLE_FIND_CACHE_TTL", "60"))
+        )
+        # Bumped per table on every write, so a lookup that was in flight
+        # during a write does not cache its now stale result
+        self._find_generations: Dict[str, int] = {}
+        self._find_lock = threading.Lock()
+        
+        # Table schema cache, see get_table_metadata
+        self.metadata_cache_dir = os.environ.get(
+            "AIRTABLE_METADATA_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "cabo-webhook-api")
+        )
+        self.metadata_ttl = float(os.environ.get("AIRTABLE_METADATA_TTL", "3600"))
+        
+        # Event payload -> Airtable field mappers, checked against the schema by verify_tables
+        self.mappers = build_mappers()
+    
+    def _request(self, method: str, url: str, table: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the per-base rate limiter
+        
+        Waits for a token before each call instead of failing, and on a 429
+        pauses the whole base for RATE_LIMIT_BACKOFF seconds and tries again
+        up to `max_retries` times. `table` only labels the request metrics.
+        """
+        for attempt in range(self.max_retries + 1):
+            metrics.AIRTABLE_THROTTLE_SECONDS.observe(self.rate_limiter.acquire())
+            started = time.perf_counter()
+            with tracing.span(f"airtable {method}", {"airtable.table": table, "retry.attempt": attempt}) as span:
+                try:
+                    response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                except requests.exceptions.RequestException:
+                    metrics.AIRTABLE_SECONDS.labels(table, method, "error").observe(time.perf_counter() - started)
+                    raise
+                span.set_attribute("http.status_code", response.status_code)
+            metrics.AIRTABLE_SECONDS.labels(table, method, str(response.status_code)).observe(time.perf_counter() - started)
+            
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+            
+            self.rate_limited_responses += 1
+            metrics.AIRTABLE_RATE_LIMITED.inc()
+            logger.warning(f"Airtable rate limit hit, backing off {self.RATE_LIMIT_BACKOFF}s (attempt {attempt + 1})")
+            self.rate_limiter.pause(self.RATE_LIMIT_BACKOFF)
+            time.sleep(self.RATE_LIMIT_BACKOFF)
+        
+        return response
+    
+    def close(self) -> None:
+        """
+        Close the pooled HTTP connections
+        """
+        self.session.close()
+    
+    def rate_limit_stats(self) -> Dict[str, Any]:
+        """
+        Queue depth and time spent throttled for this base
+        """
+        stats = self.rate_limiter.stats()
+        stats["rate_limited_responses"] = self.rate_limited_responses
+        return stats
     
     def create_record(self, table_name: str, fields: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -51,7 +148,8 @@ class AirtableConnector:
         payload = {"fields": fields}
         
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = self._request("POST", url, table_name, json=payload)
+            self._invalidate_find_cache(table_name)
             response.raise_for_status()  # Raise exception for HTTP errors
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -60,20 +158,84 @@ class AirtableConnector:
                 logger.error(f"Response: {e.response.text}")
             raise
     
+    def create_records(self, table_name: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Create up to MAX_BATCH_SIZE records in the specified Airtable table with one request
+        
+        Args:
+            table_name: Name of the table to add records to
+            records: List of field dictionaries, one per record
+            
+        Returns:
+            The created records, in the same order as `records`
+        """
+        if len(records) > self.MAX_BATCH_SIZE:
+            raise ValueError(f"Airtable accepts at most {self.MAX_BATCH_SIZE} records per request")
+        
+        url = f"{self.api_url}/{table_name}"
+        payload = {"records": [{"fields": fields} for fields in records]}
+        
+        try:
+            response = self._request("POST", url, table_name, json=payload)
+            self._invalidate_find_cache(table_name)
+            response.raise_for_status()
+            return response.json().get("records", [])
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error creating Airtable records: {e}")
+            if hasattr(e, 'response') and e.response:
+                logger.error(f"Response: {e.response.text}")
+            raise
+    
     def get_records(self, table_name: str, formula: Optional[str] = None, 
-                   max_records: Optional[int] = None, view: Optional[str] = None) -> List[Dict[str, Any]]:
+                   max_records: Optional[int] = None, view: Optional[str] = None,
+                   fields: Optional[List[str]] = None, sort: Optional[List[Dict[str, str]]] = None,
+                   page_size: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Get records from the specified Airtable table with optional filtering
         
+        Follows every result page. Use iter_records to stream large tables.
+        
         Args:
             table_name: Name of the table to retrieve records from
             formula: Optional formula to filter records (Airtable formula syntax)
             max_records: Optional maximum number of records to return
             view: Optional view name to use
+            fields: Optional list of field names to return
+            sort: Optional list of {"field": ..., "direction": "asc"|"desc"}
+            page_size: Optional number of records per page (max 100)
             
         Returns:
             List of records
         """
+        return list(self.iter_records(
+            table_name, formula=formula, max_records=max_records, view=view,
+            fields=fields, sort=sort, page_size=page_size
+        ))
+    
+    def iter_records(self, table_name: str, formula: Optional[str] = None,
+                     max_records: Optional[int] = None, view: Optional[str] = None,
+                     fields: Optional[List[str]] = None, sort: Optional[List[Dict[str, str]]] = None,
+                     page_size: Optional[int] = None, prefetch: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily yield records from the specified Airtable table, page by page
+        
+        Only one page is held in memory at a time, so this runs in constant
+        memory however large the table is.
+        
+        Args:
+            table_name: Name of the table to retrieve records from
+            formula: Optional formula to filter records (Airtable formula syntax)
+            max_records: Optional maximum number of records to return
+            view: Optional view name to use
+            fields: Optional list of field names to return
+            sort: Optional list of {"field": ..., "direction": "asc"|"desc"}
+            page_size: Optional number of records per page (max 100)
+            prefetch: Fetch the next page in the background while the
+                current one is being consumed
+            
+        Yields:
+            Records, in Airtable's order
+        """
         url = f"{self.api_url}/{table_name}"
         params = {}
         
@@ -83,12 +245,37 @@ class AirtableConnector:
             params["maxRecords"] = max_records
         if view:
             params["view"] = view
+        if fields:
+            params["fields[]"] = list(fields)
+        if page_size:
+            params["pageSize"] = min(page_size, self.MAX_PAGE_SIZE)
+        for index, spec in enumerate(sort or []):
+            params[f"sort[{index}][field]"] = spec["field"]
+            params[f"sort[{index}][direction]"] = spec.get("direction", "asc")
         
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = self._get_page(url, table_name, params)
+            while True:
+                offset = page.get("offset")
+                next_page = None
+                if offset and executor:
+                    next_page = executor.submit(self._get_page, url, table_name, {**params, "offset": offset})
+                
+                yield from page.get("records", [])
+                
+                if not offset:
+                    return
+                page = next_page.result() if next_page else self._get_page(url, table_name, {**params, "offset": offset})
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _get_page(self, url: str, table_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self._request("GET", url, table_name, params=params)
             response.raise_for_status()
-            data = response.json()
-            return data.get("records", [])
+            return response.json()
         except requests.exceptions.RequestException as e:
             logger.error(f"Error getting Airtable records: {e}")
             if hasattr(e, 'response') and e.response:
@@ -111,7 +298,8 @@ class AirtableConnector:
         payload = {"fields": fields}
         
         try:
-            response = requests.patch(url, headers=self.headers, json=payload)
+            response = self._request("PATCH", url, table_name, json=payload)
+            self._invalidate_find_cache(table_name)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -120,6 +308,75 @@ class AirtableConnector:
                 logger.error(f"Response: {e.response.text}")
             raise
     
+    def upsert_records(self, table_name: str, records: List[Dict[str, Any]],
+                       merge_on: List[str], typecast: bool = False) -> Dict[str, Any]:
+        """
+        Create or update records in bulk, matching existing rows on `merge_on`
+        
+        Sends batches of up to MAX_BATCH_SIZE records using Airtable's
+        performUpsert. A batch that Airtable rejects as invalid is retried
+        record by record, so one bad row does not fail the rest.
+        
+        Args:
+            table_name: Name of the table to upsert into
+            records: List of field dictionaries, one per record
+            merge_on: Field names that identify an existing record, e.g. ["Email"]
+            typecast: Let Airtable convert string values to the field types
+            
+        Returns:
+            Dict with the "created" and "updated" record IDs, the returned
+            "records", and "failed" entries giving the input index and error
+        """
+        result = {"created": [], "updated": [], "records": [], "failed": []}
+        
+        for start in range(0, len(records), self.MAX_BATCH_SIZE):
+            batch = list(enumerate(records[start:start + self.MAX_BATCH_SIZE], start))
+            self._upsert_batch(table_name, batch, merge_on, typecast, result)
+        
+        logger.info(
+            f"Airtable upsert into {table_name}: {len(result['created'])} created, "
+            f"{len(result['updated'])} updated, {len(result['failed'])} failed"
+        )
+        return result
+    
+    def _upsert_batch(self, table_name: str, batch: List[tuple], merge_on: List[str],
+                      typecast: bool, result: Dict[str, Any]) -> None:
+        url = f"{self.api_url}/{table_name}"
+        payload = {
+            "performUpsert": {"fieldsToMergeOn": merge_on},
+            "records": [{"fields": fields} for _, fields in batch],
+            "typecast": typecast
+        }
+        
+        try:
+            response = self._request("PATCH", url, table_name, json=payload)
+            self._invalidate_find_cache(table_name)
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 422 and len(batch) > 1:
+                for item in batch:
+                    self._upsert_batch(table_name, [item], merge_on, typecast, result)
+                return
+            self._record_upsert_failure(batch, e, result)
+            return
+        except requests.exceptions.RequestException as e:
+            self._record_upsert_failure(batch, e, result)
+            return
+        
+        result["created"].extend(data.get("createdRecords", []))
+        result["updated"].extend(data.get("updatedRecords", []))
+        result["records"].extend(data.get("records", []))
+    
+    @staticmethod
+    def _record_upsert_failure(batch: List[tuple], error: Exception, result: Dict[str, Any]) -> None:
+        message = str(error)
+        if getattr(error, "response", None) is not None:
+            message = f"{message}: {error.response.text[:500]}"
+        logger.error(f"Error upserting Airtable records: {message}")
+        for index, _ in batch:
+            result["failed"].append({"index": index, "error": message})
+    
     def delete_record(self, table_name: str, record_id: str) -> Dict[str, Any]:
         """
         Delete a record from the specified Airtable table
@@ -134,7 +391,8 @@ class AirtableConnector:
         url = f"{self.api_url}/{table_name}/{record_id}"
         
         try:
-            response = requests.delete(url, headers=self.headers)
+            response = self._request("DELETE", url, table_name)
+            self._invalidate_find_cache(table_name)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -147,6 +405,11 @@ class AirtableConnector:
         """
         Find a record by a specific field value
         
+        Results, including "not found", are cached per (table, field, value)
+        for AIRTABLE_FIND_CACHE_TTL seconds and dropped whenever this
+        connector writes to the table. A lookup that overlaps such a write
+        is returned but not cached.
+        
         Args:
             table_name: Name of the table to search in
             field_name: Name of the field to search by
@@ -159,112 +422,135 @@ class AirtableConnector:
         if isinstance(field_value, (int, float)):
             formula = f"{{{field_name}}} = {field_value}"
             
+        key = (table_name, field_name, field_value)
+        cached = self._find_cache.get(key)
+        if cached is not MISSING:
+            metrics.AIRTABLE_CACHE_HITS.labels(table_name).inc()
+            return cached
+        metrics.AIRTABLE_CACHE_MISSES.labels(table_name).inc()
+        
+        generation = self._find_generations.get(table_name, 0)
         records = self.get_records(table_name, formula=formula, max_records=1)
-        return records[0] if records else None
+        record = records[0] if records else None
+        with self._find_lock:
+            if self._find_generations.get(table_name, 0) == generation:
+                self._find_cache.set(key, record)
+        return record
+    
+    def _invalidate_find_cache(self, table_name: str) -> None:
+        with self._find_lock:
+            self._find_generations[table_name] = self._find_generations.get(table_name, 0) + 1
+            self._find_cache.invalidate(lambda key: key[0] == table_name)
     
-    def _ensure_tables_exist(self) -> None:
+    def cache_stats(self) -> Dict[str, Any]:
         """
-        Ensure that the required tables exist in Airtable
+        Hit/miss counters and size of the find_record cache
+        
+        Hits and misses are also exported per table as the
+        airtable_cache_hits_total and airtable_cache_misses_total metrics.
+        """
+        return self._find_cache.stats()
+    
+    def get_table_metadata(self, refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        Get the base's table schema, using a copy cached on disk when fresh
+        
+        The schema changes rarely, so it is cached for
+        AIRTABLE_METADATA_TTL seconds in AIRTABLE_METADATA_CACHE_DIR. Every
+        process and restart within that window skips the metadata call.
+        
+        Args:
+            refresh: Ignore the cached copy and fetch from Airtable
+            
+        Returns:
+            List of tables as returned by the Airtable metadata API
+        """
+        cache_path = os.path.join(self.metadata_cache_dir, f"airtable-{self.base_id}-tables.json")
+        
+        if not refresh:
+            try:
+                with open(cache_path) as f:
+                    cached = json.load(f)
+                if time.time() - cached["fetched_at"] < self.metadata_ttl:
+                    return cached["tables"]
+            except (OSError, ValueError, KeyError):
+                pass
+        
+        # Get list of tables (bases) from Airtable
+        url = f"{self.api_root}/v0/meta/bases/{self.base_id}/tables"
+        response = self._request("GET", url, "_meta")
+        response.raise_for_status()
+        tables = response.json().get("tables", [])
+        
+        try:
+            os.makedirs(self.metadata_cache_dir, exist_ok=True)
+            # Write then rename so concurrent readers never see a partial file
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"fetched_at": time.time(), "tables": tables}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not cache Airtable table metadata: {e}")
+        
+        return tables
+    
+    def verify_tables(self) -> None:
+        """
+        Check that the required tables exist in Airtable and that the
+        event mappings only use fields those tables have
         If tables don't exist, this will at least verify API access
+        
+        Not run on construction, so creating a connector never waits on
+        Airtable. Callers run it in the background once they have started.
         """
-        required_tables = ["Leads", "Bookings", "Guide Requests"]
+        required_tables = [mapper.table_name for mapper in self.mappers.values()]
         
         try:
-            # Get list of tables (bases) from Airtable
-            url = f"https://api.airtable.com/v0/meta/bases/{self.base_id}/tables"
-            response = requests.get(url, headers=self.headers)
+            tables = self.get_table_metadata()
+            self.validate_mappings(tables)
+            existing_table_names = [table.get("name") for table in tables]
             
-            if response.status_code == 200:
-                tables = response.json().get("tables", [])
-                existing_table_names = [table.get("name") for table in tables]
-                
-                logger.info(f"Airtable tables found: {existing_table_names}")
-                
-                # Check for missing tables and log a warning
-                for required_table in required_tables:
-                    if required_table not in existing_table_names:
-                        logger.warning(f"Required Airtable table '{required_table}' not found. Make.com integration is recommended.")
-            else:
-                logger.warning(f"Could not verify Airtable tables: {response.status_code} - {response.text}")
-                logger.info("Make.com integration is recommended for more reliable data delivery.")
+            logger.info(f"Airtable tables found: {existing_table_names}")
+            
+            # Check for missing tables and log a warning
+            for required_table in required_tables:
+                if required_table not in existing_table_names:
+                    logger.warning(f"Required Airtable table '{required_table}' not found. Make.com integration is recommended.")
+        except requests.exceptions.HTTPError as e:
+            logger.warning(f"Could not verify Airtable tables: {e.response.status_code} - {e.response.text}")
+            logger.info("Make.com integration is recommended for more reliable data delivery.")
         except Exception as e:
             logger.warning(f"Failed to check Airtable tables: {e}")
             logger.info("Make.com integration is recommended for more reliable data delivery.")
     
     # Helper methods specifically for our webhook events
     
-    def send_lead_to_airtable(self, lead_data: Dict[str, Any], table_name: str = "Leads") -> Dict[str, Any]:
+    def validate_mappings(self, tables: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Check every event mapping against the Airtable table schema
+        """
+        if tables is None:
+            tables = self.get_table_metadata()
+        for mapper in self.mappers.values():
+            mapper.validate(tables)
+    
+    def send_lead_to_airtable(self, lead_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process a lead webhook event and send it to Airtable
         """
-        # Map the lead data to Airtable fields
-        airtable_fields = {
-            "First Name": lead_data.get("first_name"),
-            "Last Name": lead_data.get("last_name"),
-            "Email": lead_data.get("email"),
-            "Phone": lead_data.get("phone"),
-            "Interest Type": lead_data.get("interest_type"),
-            "Source": lead_data.get("source"),
-            "Budget": lead_data.get("budget"),
-            "Timeline": lead_data.get("timeline"),
-            "Tags": ", ".join(lead_data.get("tags", [])) if lead_data.get("tags") else None,
-            "Event Type": lead_data.get("event_type"),
-            "Tracking ID": lead_data.get("tracking_id"),
-            "Notes": json.dumps(lead_data.get("form_data")) if lead_data.get("form_data") else None
-        }
-        
-        # Remove None values
-        airtable_fields = {k: v for k, v in airtable_fields.items() if v is not None}
-        
-        # Send to Airtable
-        return self.create_record(table_name, airtable_fields)
+        mapper = self.mappers["lead.created"]
+        return self.create_record(mapper.table_name, mapper(lead_data))
     
-    def send_booking_to_airtable(self, booking_data: Dict[str, Any], table_name: str = "Bookings") -> Dict[str, Any]:
+    def send_booking_to_airtable(self, booking_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process a booking webhook event and send it to Airtable
         """
-        # Map the booking data to Airtable fields
-        airtable_fields = {
-            "First Name": booking_data.get("first_name"),
-            "Last Name": booking_data.get("last_name"),
-            "Email": booking_data.get("email"),
-            "Phone": booking_data.get("phone"),
-            "Booking Type": booking_data.get("booking_type"),
-            "Start Date": booking_data.get("start_date"),
-            "End Date": booking_data.get("end_date"),
-            "Guests": booking_data.get("guests"),
-            "Total Amount": booking_data.get("total_amount"),
-            "Special Requests": booking_data.get("special_requests"),
-            "Event Type": booking_data.get("event_type"),
-            "Tracking ID": booking_data.get("tracking_id"),
-            "Notes": json.dumps(booking_data.get("form_data")) if booking_data.get("form_data") else None
-        }
-        
-        # Remove None values
-        airtable_fields = {k: v for k, v in airtable_fields.items() if v is not None}
-        
-        # Send to Airtable
-        return self.create_record(table_name, airtable_fields)
+        mapper = self.mappers["booking.created"]
+        return self.create_record(mapper.table_name, mapper(booking_data))
     
-    def send_guide_request_to_airtable(self, guide_data: Dict[str, Any], table_name: str = "Guide Requests") -> Dict[str, Any]:
+    def send_guide_request_to_airtable(self, guide_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process a guide request webhook event and send it to Airtable
         """
-        # Map the guide request data to Airtable fields
-        airtable_fields = {
-            "First Name": guide_data.get("first_name"),
-            "Last Name": guide_data.get("last_name"),
-            "Email": guide_data.get("email"),
-            "Phone": guide_data.get("phone"),
-            "Guide Type": guide_data.get("guide_type"),
-            "Interest Areas": ", ".join(guide_data.get("interest_areas", [])) if guide_data.get("interest_areas") else None,
-            "Event Type": guide_data.get("event_type"),
-            "Tracking ID": guide_data.get("tracking_id"),
-            "Notes": json.dumps(guide_data.get("form_data")) if guide_data.get("form_data") else None
-        }
-        
-        # Remove None values
-        airtable_fields = {k: v for k, v in airtable_fields.items() if v is not None}
-        
-        # Send to Airtable
-        return self.create_record(table_name, airtable_fields)
\ No newline at end of file
+        mapper = self.mappers["guide.requested"]
+        return self.create_record(mapper.table_name, mapper(guide_data))
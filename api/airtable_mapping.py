@@ -0,0 +1,126 @@
+import json
+import logging
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger("airtable-mapping")
+
+
+class MappingError(Exception):
+    """
+    Raised when an event cannot be mapped to a valid Airtable record
+    """
+
+
+def _join(values: List[str]) -> Optional[str]:
+    return ", ".join(values) if values else None
+
+
+def _to_json(value: Any) -> Optional[str]:
+    return json.dumps(value) if value else None
+
+
+# (Airtable field, event key, optional transform) for each event type.
+# Values that are None, or that a transform turns into None, are left out.
+_COMMON_CONTACT = [
+    ("First Name", "first_name", None),
+    ("Last Name", "last_name", None),
+    ("Email", "email", None),
+    ("Phone", "phone", None),
+]
+
+_TRACKING = [
+    ("Event Type", "event_type", None),
+    ("Tracking ID", "tracking_id", None),
+    ("Notes", "form_data", _to_json),
+]
+
+MAPPINGS: Dict[str, Tuple[str, List[tuple]]] = {
+    "lead.created": ("Leads", _COMMON_CONTACT + [
+        ("Interest Type", "interest_type", None),
+        ("Source", "source", None),
+        ("Budget", "budget", None),
+        ("Timeline", "timeline", None),
+        ("Tags", "tags", _join),
+    ] + _TRACKING),
+    "booking.created": ("Bookings", _COMMON_CONTACT + [
+        ("Booking Type", "booking_type", None),
+        ("Start Date", "start_date", None),
+        ("End Date", "end_date", None),
+        ("Guests", "guests", None),
+        ("Total Amount", "total_amount", None),
+        ("Special Requests", "special_requests", None),
+    ] + _TRACKING),
+    "guide.requested": ("Guide Requests", _COMMON_CONTACT + [
+        ("Guide Type", "guide_type", None),
+        ("Interest Areas", "interest_areas", _join),
+    ] + _TRACKING),
+}
+
+
+class FieldMapper:
+    """
+    Maps one event type's payload to Airtable fields in a single pass
+
+    `validate` checks the mapping against the table schema once. If the
+    table or any mapped field is missing, every call raises MappingError
+    rather than sending a record with data silently left out.
+    """
+    def __init__(self, table_name: str, spec: List[Tuple[str, str, Optional[Callable]]]):
+        self.table_name = table_name
+        self.spec = list(spec)
+        self.unknown_fields: List[str] = []
+        self.table_missing = False
+        self._compile(self.spec)
+
+    def _compile(self, spec: List[tuple]) -> None:
+        # Plain fields and transformed fields are split up front so the hot
+        # loop does no per-field branching on the transform
+        self._plain = tuple((name, key) for name, key, transform in spec if transform is None)
+        self._transformed = tuple((name, key, transform) for name, key, transform in spec if transform is not None)
+
+    def __call__(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if self.table_missing:
+            raise MappingError(f"Airtable table '{self.table_name}' does not exist")
+        if self.unknown_fields:
+            raise MappingError(f"Airtable table '{self.table_name}' has no fields {self.unknown_fields}")
+
+        get = data.get
+        fields = {}
+        for name, key in self._plain:
+            value = get(key)
+            if value is not None:
+                fields[name] = value
+        for name, key, transform in self._transformed:
+            value = get(key)
+            if value is not None:
+                value = transform(value)
+                if value is not None:
+                    fields[name] = value
+        return fields
+
+    def validate(self, tables: List[Dict[str, Any]]) -> None:
+        """
+        Check the mapping against Airtable table metadata
+
+        A missing table, or fields missing from it, make every call raise
+        MappingError until the schema is fixed and `validate` runs again.
+        """
+        table = next((t for t in tables if t.get("name") == self.table_name), None)
+        if table is None:
+            self.table_missing = True
+            self.unknown_fields = []
+            logger.error(f"Airtable table '{self.table_name}' not found; its events will not be sent to Airtable")
+            return
+
+        self.table_missing = False
+        known = {field.get("name") for field in table.get("fields", [])}
+        self.unknown_fields = [name for name, _, _ in self.spec if name not in known]
+        if self.unknown_fields:
+            logger.error(
+                f"Airtable table '{self.table_name}' has no fields {self.unknown_fields}; "
+                f"its events will not be sent to Airtable"
+            )
+
+
+def build_mappers() -> Dict[str, FieldMapper]:
+    return {event: FieldMapper(table_name, spec) for event, (table_name, spec) in MAPPINGS.items()}
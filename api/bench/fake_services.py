@@ -0,0 +1,193 @@
+"""
+Local stand-ins for webhook receivers and the Airtable API
+
+Both answer after a configurable latency and fail a configurable share of
+requests with a 500 or a 429, so delivery and retry behaviour can be
+benchmarked without touching real services.
+
+    python bench/fake_services.py --latency 0.05 --error-rate 0.01 --rate-429 0.01
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Dict, Any, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from airtable_mapping import MAPPINGS  # noqa: E402
+from load import WARMUP_PREFIX  # noqa: E402
+
+
+class Behaviour:
+    """
+    Latency and failure settings shared by one fake service
+    """
+    def __init__(self, latency: float, jitter: float, error_rate: float, rate_429: float, retry_after: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+
+    async def respond(self) -> Optional[JSONResponse]:
+        """
+        Wait out the latency, then return a failure response or None for success
+        """
+        delay = self.latency + random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        roll = random.random()
+        if roll < self.rate_429:
+            return JSONResponse({"error": "RATE_LIMITED"}, status_code=429,
+                                headers={"Retry-After": str(self.retry_after)})
+        if roll < self.rate_429 + self.error_rate:
+            return JSONResponse({"error": "SERVER_ERROR"}, status_code=500)
+        return None
+
+
+class Counters:
+    def __init__(self):
+        self.started_at = time.time()
+        self.counts: Dict[str, int] = {}
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+    def record(self, key: str, measured: bool = True) -> None:
+        """
+        Count a request; warmup requests get their own keys and leave the timing alone
+        """
+        if not measured:
+            key = f"{key}:warmup"
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if measured:
+            now = time.time()
+            self.first_at = self.first_at or now
+            self.last_at = now
+
+    def stats(self) -> Dict[str, Any]:
+        return {"counts": self.counts, "first_at": self.first_at, "last_at": self.last_at}
+
+
+def _is_measured(body: bytes) -> bool:
+    try:
+        email = json.loads(body).get("email")
+    except (ValueError, AttributeError):
+        return True
+    return not (isinstance(email, str) and email.startswith(WARMUP_PREFIX))
+
+
+def webhook_app(behaviour: Behaviour) -> FastAPI:
+    app = FastAPI(title="Fake webhook receiver")
+    counters = Counters()
+
+    @app.post("/hook/{name}")
+    async def receive(name: str, request: Request):
+        measured = _is_measured(await request.body())
+        failure = await behaviour.respond()
+        counters.record(f"{name}:{failure.status_code if failure else 200}", measured)
+        return failure or {"ok": True}
+
+    @app.get("/stats")
+    async def stats():
+        return counters.stats()
+
+    return app
+
+
+def airtable_app(behaviour: Behaviour) -> FastAPI:
+    app = FastAPI(title="Fake Airtable API")
+    counters = Counters()
+    ids = itertools.count(1)
+
+    def record(fields: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": f"rec{next(ids):014d}", "createdTime": "2025-01-01T00:00:00.000Z", "fields": fields}
+
+    @app.get("/v0/meta/bases/{base_id}/tables")
+    async def tables(base_id: str):
+        counters.record("meta")
+        return {"tables": [
+            {"id": f"tbl{index}", "name": table_name, "fields": [{"name": name} for name, _, _ in spec]}
+            for index, (table_name, spec) in enumerate(MAPPINGS.values())
+        ]}
+
+    @app.post("/v0/{base_id}/{table_name}")
+    async def create(base_id: str, table_name: str, request: Request):
+        body = await request.json()
+        failure = await behaviour.respond()
+        if failure:
+            counters.record(f"{table_name}:{failure.status_code}")
+            return failure
+        if "records" in body:
+            records: List[Dict[str, Any]] = [record(item.get("fields", {})) for item in body["records"]]
+            for _ in records:
+                counters.record(f"{table_name}:created")
+            return {"records": records}
+        counters.record(f"{table_name}:created")
+        return record(body.get("fields", {}))
+
+    @app.patch("/v0/{base_id}/{table_name}")
+    async def upsert(base_id: str, table_name: str, request: Request):
+        body = await request.json()
+        failure = await behaviour.respond()
+        if failure:
+            counters.record(f"{table_name}:{failure.status_code}")
+            return failure
+        records = [record(item.get("fields", {})) for item in body.get("records", [])]
+        counters.record(f"{table_name}:upserted")
+        return {"records": records, "createdRecords": [r["id"] for r in records], "updatedRecords": []}
+
+    @app.get("/v0/{base_id}/{table_name}")
+    async def list_records(base_id: str, table_name: str):
+        failure = await behaviour.respond()
+        counters.record(f"{table_name}:{failure.status_code if failure else 'listed'}")
+        return failure or {"records": []}
+
+    @app.get("/stats")
+    async def stats():
+        return counters.stats()
+
+    return app
+
+
+async def serve(webhook_port: int, airtable_port: int, webhook: Behaviour, airtable: Behaviour) -> None:
+    servers = [
+        uvicorn.Server(uvicorn.Config(webhook_app(webhook), port=webhook_port, log_level="warning")),
+        uvicorn.Server(uvicorn.Config(airtable_app(airtable), port=airtable_port, log_level="warning")),
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--webhook-port", type=int, default=9101)
+    parser.add_argument("--airtable-port", type=int, default=9102)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean webhook response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Latency varies uniformly by up to this much")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of webhook requests answered with a 500")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of webhook requests answered with a 429")
+    parser.add_argument("--airtable-latency", type=float, default=0.1)
+    parser.add_argument("--airtable-error-rate", type=float, default=0.0)
+    parser.add_argument("--airtable-rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+
+
+def behaviours(args: argparse.Namespace):
+    webhook = Behaviour(args.latency, args.jitter, args.error_rate, args.rate_429, args.retry_after)
+    airtable = Behaviour(args.airtable_latency, args.jitter, args.airtable_error_rate,
+                         args.airtable_rate_429, args.retry_after)
+    return webhook, airtable
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run fake webhook and Airtable services")
+    add_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(serve(args.webhook_port, args.airtable_port, *behaviours(args)))
@@ -0,0 +1,181 @@
+"""
+Open-loop load generator for the event endpoints
+
+Requests are started on a fixed schedule whatever the response times, and
+latency is measured from each request's scheduled start. A slow server
+therefore shows up as growing latency instead of a quietly lower request
+rate (no coordinated omission).
+"""
+import math
+import time
+import random
+import asyncio
+import itertools
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+
+ENDPOINTS = {
+    "lead": "/api/leads/webhook",
+    "booking": "/api/bookings/webhook",
+    "guide": "/api/guides/webhook",
+}
+
+_sequence = itertools.count()
+
+
+def lead_payload(n: int) -> Dict[str, Any]:
+    return {
+        "first_name": "Bench",
+        "last_name": f"Lead {n}",
+        "email": f"bench-lead-{n}@example.com",
+        "phone": "+1 555 0100",
+        "interest_type": "villa",
+        "source": "benchmark",
+        "budget": "$5,000-$10,000",
+        "timeline": "3 months",
+        "form_data": {"adults": 2, "children": 1, "notes": "Benchmark lead"},
+        "tags": ["benchmark", "villa"],
+    }
+
+
+def booking_payload(n: int) -> Dict[str, Any]:
+    return {
+        "first_name": "Bench",
+        "last_name": f"Booking {n}",
+        "email": f"bench-booking-{n}@example.com",
+        "booking_type": "yacht",
+        "start_date": "2026-03-01",
+        "end_date": "2026-03-05",
+        "guests": 4,
+        "total_amount": 2400.0,
+        "special_requests": "None",
+    }
+
+
+def guide_payload(n: int) -> Dict[str, Any]:
+    return {
+        "first_name": "Bench",
+        "last_name": f"Guide {n}",
+        "email": f"bench-guide-{n}@example.com",
+        "guide_type": "cabo-essentials",
+        "interest_areas": ["beaches", "dining"],
+    }
+
+
+PAYLOADS = {"lead": lead_payload, "booking": booking_payload, "guide": guide_payload}
+
+# Warmup events are marked by their email address, so the fake webhook
+# receiver can leave them out of the measured delivery counts
+WARMUP_PREFIX = "warmup-"
+
+
+def payload(kind: str, n: int, measured: bool) -> Dict[str, Any]:
+    data = PAYLOADS[kind](n)
+    if not measured:
+        data["email"] = WARMUP_PREFIX + data["email"]
+    return data
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of already sorted values
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": _ms(percentile(values, 50)),
+        "p95_ms": _ms(percentile(values, 95)),
+        "p99_ms": _ms(percentile(values, 99)),
+        "max_ms": _ms(values[-1] if values else None),
+        "mean_ms": _ms(sum(values) / len(values) if values else None),
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {kind: [] for kind in ENDPOINTS}
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+        self.sent = 0
+        self.started_at = 0.0
+        self.finished_at = 0.0
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = self.finished_at - self.started_at
+        every = [value for values in self.latencies.values() for value in values]
+        return {
+            "sent": self.sent,
+            "achieved_rps": round(self.sent / elapsed, 2) if elapsed else None,
+            "statuses": self.statuses,
+            "errors": self.errors,
+            "latency": summarize(every),
+            "latency_by_event": {kind: summarize(values) for kind, values in self.latencies.items() if values},
+        }
+
+
+async def _send(client: httpx.AsyncClient, kind: str, scheduled: float, result: Optional[LoadResult]) -> None:
+    n = next(_sequence)
+    try:
+        response = await client.post(ENDPOINTS[kind], json=payload(kind, n, measured=result is not None))
+        status = str(response.status_code)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    if result is None:
+        return
+
+    result.latencies[kind].append(time.perf_counter() - scheduled)
+    result.statuses[status] = result.statuses.get(status, 0) + 1
+    if not status.startswith("2"):
+        result.errors += 1
+
+
+async def drive(base_url: str, rps: float, duration: float, mix: List[Tuple[str, float]],
+                warmup: float = 0, max_connections: int = 200) -> LoadResult:
+    """
+    Send events at `rps` for `warmup` + `duration` seconds
+
+    Only requests scheduled after the warmup are measured. `mix` is a list
+    of (event kind, weight) pairs.
+    """
+    kinds, weights = zip(*mix)
+    result = LoadResult()
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    pending = set()
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        measure_from = start + warmup
+        total = int((warmup + duration) * rps)
+        for i in range(total):
+            scheduled = start + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            measured = scheduled >= measure_from
+            if measured:
+                if not result.started_at:
+                    result.started_at = scheduled
+                result.sent += 1
+            kind = random.choices(kinds, weights)[0]
+            task = asyncio.create_task(_send(client, kind, scheduled, result if measured else None))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.gather(*pending)
+        result.finished_at = start + total / rps
+
+    return result
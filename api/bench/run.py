@@ -0,0 +1,375 @@
+"""
+End-to-end benchmark for the webhook API
+
+Starts the fake webhook and Airtable services, the API (uvicorn main:app)
+and the delivery worker against the Postgres in DATABASE_URL, registers
+fake webhook targets, drives event traffic at a fixed rate and reports
+request latency, delivery throughput and database connection use.
+
+    cd api && DATABASE_URL=postgresql://localhost/cabo_bench python bench/run.py --rps 50 --duration 60
+
+Results are written to bench/results/. Pass --save-baseline NAME to keep a
+run as a baseline and --baseline NAME to compare a run against one; the
+exit status is 1 when the comparison finds a regression.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import httpx
+import psycopg2
+
+import fake_services
+import load
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINES_DIR = os.path.join(BENCH_DIR, "baselines")
+
+# (metric path, higher is better) compared against the baseline
+COMPARED_METRICS = [
+    ("requests.latency.p50_ms", False),
+    ("requests.latency.p95_ms", False),
+    ("requests.latency.p99_ms", False),
+    ("deliveries.throughput_per_s", True),
+    ("deliveries.drain_seconds", False),
+    ("database.max_backends", False),
+]
+
+
+def _start(args: List[str], env: Dict[str, str], log_name: str, log_dir: str) -> subprocess.Popen:
+    log = open(os.path.join(log_dir, f"{log_name}.log"), "w")
+    return subprocess.Popen(args, cwd=API_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _stop(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def _wait_until_up(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up within {timeout}s")
+            await asyncio.sleep(0.2)
+
+
+def _parse_metrics(text: str) -> Dict[str, float]:
+    """
+    Unlabelled and labelled samples of a Prometheus text exposition
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            try:
+                samples[name] = float(value)
+            except ValueError:
+                pass
+    return samples
+
+
+async def _scrape(client: httpx.AsyncClient, url: str) -> Dict[str, float]:
+    try:
+        return _parse_metrics((await client.get(url)).text)
+    except httpx.HTTPError:
+        return {}
+
+
+class DatabaseSampler:
+    """
+    Samples backend connections to the benchmark database once a second
+    """
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.samples: List[int] = []
+        self.pool_in_use: List[float] = []
+
+    async def run(self, stop: asyncio.Event, api_metrics_url: str) -> None:
+        conn = await asyncio.to_thread(psycopg2.connect, self.dsn)
+        conn.autocommit = True
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                while not stop.is_set():
+                    self.samples.append(await asyncio.to_thread(self._backends, conn))
+                    api = await _scrape(client, api_metrics_url)
+                    if 'db_pool_connections{state="in_use"}' in api:
+                        self.pool_in_use.append(api['db_pool_connections{state="in_use"}'])
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=1)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _backends(conn) -> int:
+        with conn.cursor() as cur:
+            # Other sessions only; the sampler's own connection is left out
+            cur.execute("""
+                SELECT count(*) FROM pg_stat_activity
+                WHERE datname = current_database() AND pid <> pg_backend_pid()
+            """)
+            return cur.fetchone()[0]
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "max_backends": max(self.samples) if self.samples else None,
+            "mean_backends": round(sum(self.samples) / len(self.samples), 2) if self.samples else None,
+            "api_pool_max_in_use": max(self.pool_in_use) if self.pool_in_use else None,
+        }
+
+
+async def _register_targets(client: httpx.AsyncClient, count: int, receiver_url: str, run_id: str) -> List[Dict[str, Any]]:
+    targets = []
+    for index in range(count):
+        response = await client.post("/api/webhooks/setup", json={
+            "name": f"bench-{run_id}-{index}",
+            "url": f"{receiver_url}/hook/{run_id}-{index}",
+            "service_type": "custom",
+            "events": ["lead.created", "booking.created", "guide.requested"],
+        })
+        response.raise_for_status()
+        targets.append(response.json())
+    return targets
+
+
+async def _deactivate_targets(client: httpx.AsyncClient, targets: List[Dict[str, Any]]) -> None:
+    for target in targets:
+        await client.post("/api/webhooks/setup", json={**target, "is_active": False})
+
+
+def _outstanding(dsn: str, target_ids: List[int]) -> Dict[str, int]:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            # Events not yet processed (or whose Airtable write is still to be
+            # retried) and deliveries in flight, waiting to retry or deferred
+            cur.execute("""
+                SELECT
+                    (SELECT count(*) FROM event_outbox
+                     WHERE status IN ('pending', 'processing') OR airtable_status = 'retrying'),
+                    (SELECT count(*) FROM webhook_deliveries
+                     WHERE webhook_id = ANY(%s) AND status IN ('pending', 'retrying', 'deferred'))
+            """, (target_ids,))
+            events, deliveries = cur.fetchone()
+        return {"events": events, "deliveries": deliveries}
+    finally:
+        conn.close()
+
+
+async def _wait_for_drain(client: httpx.AsyncClient, dsn: str, target_ids: List[int], receiver_url: str,
+                          timeout: float, run_id: str) -> Dict[str, Any]:
+    """
+    Wait until no event or delivery of the run is left to process
+
+    Warmup deliveries are counted separately by the receiver, so `received`
+    covers only measured events.
+    """
+    started = time.monotonic()
+    while True:
+        stats = (await client.get(f"{receiver_url}/stats")).json()
+        outstanding = await asyncio.to_thread(_outstanding, dsn, target_ids)
+        if not any(outstanding.values()) or time.monotonic() - started >= timeout:
+            break
+        await asyncio.sleep(0.5)
+    received = sum(count for key, count in stats["counts"].items()
+                   if key.startswith(f"{run_id}-") and key.endswith(":200"))
+    return {"received": received, "outstanding": outstanding, "stats": stats,
+            "drain_seconds": round(time.monotonic() - started, 2)}
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    dsn = os.environ.get("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL must point at a local Postgres for the benchmark")
+
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+    log_dir = os.path.join(RESULTS_DIR, f"logs-{run_id}")
+    os.makedirs(log_dir, exist_ok=True)
+
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    receiver_url = f"http://127.0.0.1:{args.webhook_port}"
+    airtable_url = f"http://127.0.0.1:{args.airtable_port}"
+    worker_metrics_urls = [f"http://127.0.0.1:{args.worker_metrics_port + i}/metrics" for i in range(args.workers)]
+
+    env = {
+        **os.environ,
+        "AIRTABLE_API_URL": airtable_url,
+        "AIRTABLE_API_KEY": "bench",
+        "AIRTABLE_BASE_ID": f"appBench{run_id}",
+        "AIRTABLE_RATE_LIMIT": str(args.airtable_rate_limit),
+    }
+
+    fakes = [sys.executable, os.path.join(BENCH_DIR, "fake_services.py"),
+             "--webhook-port", str(args.webhook_port), "--airtable-port", str(args.airtable_port),
+             "--latency", str(args.latency), "--jitter", str(args.jitter),
+             "--error-rate", str(args.error_rate), "--rate-429", str(args.rate_429),
+             "--airtable-latency", str(args.airtable_latency),
+             "--airtable-error-rate", str(args.airtable_error_rate),
+             "--airtable-rate-429", str(args.airtable_rate_429)]
+    processes = [_start(fakes, env, "fake_services", log_dir)]
+    try:
+        processes.append(_start(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.api_port),
+             "--workers", str(args.api_workers), "--log-level", "warning"],
+            env, "api", log_dir))
+        await _wait_until_up(f"{receiver_url}/stats")
+        await _wait_until_up(f"{api_url}/")
+
+        # Targets are registered before the worker starts, so its
+        # subscription index already has them
+        async with httpx.AsyncClient(base_url=api_url, timeout=30) as client:
+            targets = await _register_targets(client, args.targets, receiver_url, run_id)
+
+        processes.append(_start(
+            [sys.executable, "worker.py", "--processes", str(args.workers),
+             "--metrics-port", str(args.worker_metrics_port)],
+            env, "worker", log_dir))
+        for url in worker_metrics_urls:
+            await _wait_until_up(url)
+
+        stop_sampling = asyncio.Event()
+        sampler = DatabaseSampler(dsn)
+        sampling = asyncio.create_task(sampler.run(stop_sampling, f"{api_url}/metrics"))
+
+        mix = [(kind, float(weight)) for kind, weight in
+               (part.split("=") for part in args.mix.split(","))]
+        result = await load.drive(api_url, args.rps, args.duration, mix, warmup=args.warmup)
+
+        async with httpx.AsyncClient(timeout=10) as client:
+            drained = await _wait_for_drain(
+                client, dsn, [target["id"] for target in targets], receiver_url,
+                timeout=args.drain_timeout, run_id=run_id,
+            )
+            airtable_stats = (await client.get(f"{airtable_url}/stats")).json()
+
+        stop_sampling.set()
+        await sampling
+
+        async with httpx.AsyncClient(base_url=api_url, timeout=30) as client:
+            await _deactivate_targets(client, targets)
+    finally:
+        _stop(list(reversed(processes)))
+
+    delivery_window = (drained["stats"]["last_at"] or 0) - (drained["stats"]["first_at"] or 0)
+    return {
+        "run_id": run_id,
+        "git_commit": _git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("baseline", "save_baseline")},
+        "requests": result.report(),
+        "deliveries": {
+            "expected": result.sent * args.targets,
+            "received": drained["received"],
+            "outstanding": drained["outstanding"],
+            "throughput_per_s": round(drained["received"] / delivery_window, 2) if delivery_window > 0 else None,
+            "drain_seconds": drained["drain_seconds"],
+            "receiver_counts": drained["stats"]["counts"],
+        },
+        "airtable": airtable_stats["counts"],
+        "database": sampler.report(),
+        "logs": log_dir,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _lookup(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Describe each compared metric that is worse than the baseline by more than `tolerance`
+    """
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS:
+        current, previous = _lookup(result, path), _lookup(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{path}: {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the webhook API end to end")
+    parser.add_argument("--rps", type=float, default=50, help="Events sent per second")
+    parser.add_argument("--duration", type=float, default=60, help="Measured seconds of load")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds of load first")
+    parser.add_argument("--mix", default="lead=6,booking=2,guide=2", help="Event kinds and their weights")
+    parser.add_argument("--targets", type=int, default=3, help="Fake webhook targets subscribed to every event")
+    parser.add_argument("--workers", type=int, default=1, help="Delivery worker processes")
+    parser.add_argument("--api-workers", type=int, default=1, help="uvicorn worker processes for the API")
+    parser.add_argument("--api-port", type=int, default=9100)
+    parser.add_argument("--worker-metrics-port", type=int, default=9110)
+    parser.add_argument("--airtable-rate-limit", type=float, default=5, help="Airtable requests per second")
+    parser.add_argument("--drain-timeout", type=float, default=120,
+                        help="Seconds to wait for outstanding deliveries after the load stops")
+    fake_services.add_arguments(parser)
+    parser.add_argument("--baseline", help="Compare against bench/baselines/NAME.json")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save this run as bench/baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Relative change beyond which a compared metric counts as a regression")
+    args = parser.parse_args()
+
+    result = asyncio.run(benchmark(args))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{result['run_id']}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps({key: result[key] for key in ("requests", "deliveries", "database")}, indent=2))
+    print(f"Results written to {path}")
+
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(os.path.join(BASELINES_DIR, f"{args.save_baseline}.json"), "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved baseline '{args.save_baseline}'")
+
+    if args.baseline:
+        with open(os.path.join(BASELINES_DIR, f"{args.baseline}.json")) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against baseline '{args.baseline}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional, Deque, Tuple
+
+import metrics
+import subscriptions
+
+logger = logging.getLogger("webhook-circuits")
+
+# Rolling window the error and slow-call rates are computed over
+WINDOW_SECONDS = float(os.environ.get("CIRCUIT_WINDOW_SECONDS", "60"))
+# Outcomes needed in the window before a circuit can trip
+MIN_REQUESTS = int(os.environ.get("CIRCUIT_MIN_REQUESTS", "10"))
+ERROR_RATE = float(os.environ.get("CIRCUIT_ERROR_RATE", "0.5"))
+# Calls slower than SLOW_SECONDS count as slow, even when they succeed
+SLOW_SECONDS = float(os.environ.get("CIRCUIT_SLOW_SECONDS", "5"))
+SLOW_RATE = float(os.environ.get("CIRCUIT_SLOW_RATE", "0.8"))
+
+# How long a tripped circuit stays open; doubles every time the probe fails
+OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+MAX_OPEN_SECONDS = float(os.environ.get("CIRCUIT_MAX_OPEN_SECONDS", "1800"))
+# A probe that never reports back (e.g. its worker died) is given up after this long
+PROBE_TIMEOUT = float(os.environ.get("CIRCUIT_PROBE_TIMEOUT", "60"))
+
+# Deactivate a target whose circuit has not closed for this long; 0 never does
+AUTO_DISABLE_SECONDS = float(os.environ.get("CIRCUIT_AUTO_DISABLE_SECONDS", "0"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class Breaker:
+    """
+    Circuit breaker for one webhook target
+
+    Closed: every delivery is attempted and its outcome recorded in a
+    rolling window. The circuit opens when, over at least MIN_REQUESTS
+    outcomes, the error rate reaches ERROR_RATE or the slow-call rate
+    reaches SLOW_RATE. Open: deliveries are deferred until `open_until`.
+    Half-open: one probe delivery is let through; success closes the
+    circuit and failure opens it again for twice as long.
+
+    Only used from the worker's event loop, so it needs no locking.
+    """
+    def __init__(self, webhook_id: int):
+        self.webhook_id = webhook_id
+        self.state = CLOSED
+        self.open_until = 0.0
+        # When the target started failing; kept until the circuit closes again
+        self.failing_since: Optional[float] = None
+        self.trips = 0
+        self.error_rate = 0.0
+        self.slow_rate = 0.0
+        # Row version in webhook_circuit_state this breaker last wrote or read
+        self.version = 0
+        self._probe_started_at: Optional[float] = None
+        # (monotonic time, failed, slow)
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self._failed = 0
+        self._slow = 0
+
+    def allow(self) -> bool:
+        """
+        Whether a delivery may be attempted now; False means defer it
+        """
+        if self.state == CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now < self.open_until:
+                return False
+            self._set_state(HALF_OPEN)
+
+        # Half-open: a single probe at a time
+        if self._probe_started_at is not None and now - self._probe_started_at < PROBE_TIMEOUT:
+            return False
+        self._probe_started_at = now
+        return True
+
+    def retry_delay(self) -> float:
+        """
+        Seconds until a deferred delivery should be offered to the circuit again
+        """
+        remaining = self.open_until - time.monotonic()
+        return remaining if self.state == OPEN and remaining > 0 else OPEN_SECONDS
+
+    def record(self, success: bool, seconds: float) -> bool:
+        """
+        Record a delivery outcome. Returns True if the circuit changed state.
+        """
+        now = time.monotonic()
+        slow = seconds >= SLOW_SECONDS
+
+        if self.state == HALF_OPEN:
+            if self._probe_started_at is None:
+                # A call started before the circuit opened; not the probe
+                return False
+            self._probe_started_at = None
+            if success and not slow:
+                self._close()
+            else:
+                self._open(now)
+            return True
+
+        if self.state == OPEN:
+            return False
+
+        self._outcomes.append((now, not success, slow))
+        self._failed += not success
+        self._slow += slow
+        cutoff = now - WINDOW_SECONDS
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            _, failed, was_slow = self._outcomes.popleft()
+            self._failed -= failed
+            self._slow -= was_slow
+
+        total = len(self._outcomes)
+        if total < MIN_REQUESTS:
+            return False
+        self.error_rate = self._failed / total
+        self.slow_rate = self._slow / total
+        if self.error_rate >= ERROR_RATE or self.slow_rate >= SLOW_RATE:
+            self._open(now)
+            return True
+        return False
+
+    def should_disable(self) -> bool:
+        """
+        Whether the target has been failing long enough to be deactivated
+        """
+        return (
+            AUTO_DISABLE_SECONDS > 0
+            and self.state != CLOSED
+            and self.failing_since is not None
+            and time.monotonic() - self.failing_since >= AUTO_DISABLE_SECONDS
+        )
+
+    def adopt(self, row: Dict[str, Any]) -> None:
+        """
+        Take over state another process saved to webhook_circuit_state
+        """
+        now = time.monotonic()
+        self.trips = row["trips"]
+        self.version = row["version"]
+        self.open_until = now + float(row["open_seconds"] or 0)
+        self.failing_since = now - float(row["failing_seconds"]) if row["failing_seconds"] is not None else None
+        self.error_rate = row["error_rate"] or 0.0
+        self.slow_rate = row["slow_rate"] or 0.0
+        self._probe_started_at = None
+        self._clear_window()
+        self._set_state(row["state"])
+
+    def _open(self, now: float) -> None:
+        self.trips += 1
+        self.open_until = now + min(MAX_OPEN_SECONDS, OPEN_SECONDS * 2 ** (self.trips - 1))
+        if self.failing_since is None:
+            self.failing_since = now
+        self._clear_window()
+        self._set_state(OPEN)
+
+    def _close(self) -> None:
+        self.trips = 0
+        self.open_until = 0.0
+        self.failing_since = None
+        self.error_rate = 0.0
+        self.slow_rate = 0.0
+        self._clear_window()
+        self._set_state(CLOSED)
+
+    def _clear_window(self) -> None:
+        self._outcomes.clear()
+        self._failed = 0
+        self._slow = 0
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        metrics.CIRCUIT_STATE.labels(str(self.webhook_id)).set(_STATE_VALUES[state])
+
+
+# webhook id -> breaker, for this process
+_breakers: Dict[int, Breaker] = {}
+
+
+def get(webhook_id: int) -> Breaker:
+    breaker = _breakers.get(webhook_id)
+    if breaker is None:
+        breaker = _breakers[webhook_id] = Breaker(webhook_id)
+    return breaker
+
+
+def save(cur, breaker: Breaker) -> None:
+    """
+    Persist a state change so other worker processes and the admin API see it
+
+    Times are stored relative to the database clock, since each process
+    measures them on its own monotonic clock.
+    """
+    now = time.monotonic()
+    open_seconds = max(0.0, breaker.open_until - now) if breaker.state == OPEN else None
+    failing_seconds = now - breaker.failing_since if breaker.failing_since is not None else None
+    cur.execute("""
+        INSERT INTO webhook_circuit_state (webhook_id, state, trips, error_rate, slow_rate,
+                                           open_until, failing_since, updated_at)
+        VALUES (%s, %s, %s, %s, %s,
+                CURRENT_TIMESTAMP + make_interval(secs => %s),
+                CURRENT_TIMESTAMP - make_interval(secs => %s),
+                CURRENT_TIMESTAMP)
+        ON CONFLICT (webhook_id) DO UPDATE
+        SET state = EXCLUDED.state, trips = EXCLUDED.trips,
+            error_rate = EXCLUDED.error_rate, slow_rate = EXCLUDED.slow_rate,
+            open_until = EXCLUDED.open_until, failing_since = EXCLUDED.failing_since,
+            disabled_at = CASE WHEN EXCLUDED.state = 'closed' THEN NULL
+                               ELSE webhook_circuit_state.disabled_at END,
+            version = webhook_circuit_state.version + 1,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING version
+    """, (
+        breaker.webhook_id, breaker.state, breaker.trips, breaker.error_rate, breaker.slow_rate,
+        open_seconds, failing_seconds,
+    ))
+    breaker.version = cur.fetchone()["version"]
+
+
+def load(cur) -> List[Dict[str, Any]]:
+    """
+    Saved circuit states, with times as seconds relative to now
+    """
+    cur.execute("""
+        SELECT webhook_id, state, trips, error_rate, slow_rate, version,
+               GREATEST(EXTRACT(EPOCH FROM open_until - CURRENT_TIMESTAMP), 0) AS open_seconds,
+               EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - failing_since) AS failing_seconds
+        FROM webhook_circuit_state
+    """)
+    return cur.fetchall()
+
+
+def apply(rows: List[Dict[str, Any]]) -> None:
+    """
+    Adopt saved states written since this process last saw them
+
+    This is how a circuit tripped by one worker process, or reset through
+    the admin API, takes effect in the others.
+    """
+    for row in rows:
+        breaker = get(row["webhook_id"])
+        if row["version"] > breaker.version:
+            breaker.adopt(row)
+
+
+def disable_target(cur, webhook_id: int) -> bool:
+    """
+    Deactivate a target whose circuit has stayed open too long
+    """
+    cur.execute("""
+        UPDATE webhook_targets
+        SET is_active = FALSE, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND is_active = TRUE
+    """, (webhook_id,))
+    if not cur.rowcount:
+        return False
+    cur.execute("""
+        UPDATE webhook_circuit_state SET disabled_at = CURRENT_TIMESTAMP WHERE webhook_id = %s
+    """, (webhook_id,))
+    subscriptions.notify_changed(cur, webhook_id)
+    return True
+
+
+def reset(cur, webhook_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Close a target's circuit, reactivating the target if the breaker disabled it
+
+    Returns None if the target does not exist.
+    """
+    cur.execute("""
+        SELECT c.disabled_at
+        FROM webhook_targets w
+        LEFT JOIN webhook_circuit_state c ON c.webhook_id = w.id
+        WHERE w.id = %s
+    """, (webhook_id,))
+    target = cur.fetchone()
+    if target is None:
+        return None
+
+    cur.execute("""
+        INSERT INTO webhook_circuit_state (webhook_id, state, trips, updated_at)
+        VALUES (%s, 'closed', 0, CURRENT_TIMESTAMP)
+        ON CONFLICT (webhook_id) DO UPDATE
+        SET state = 'closed', trips = 0, error_rate = NULL, slow_rate = NULL,
+            open_until = NULL, failing_since = NULL, disabled_at = NULL,
+            version = webhook_circuit_state.version + 1,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING webhook_id, state, version, updated_at
+    """, (webhook_id,))
+    result = cur.fetchone()
+
+    reactivated = False
+    if target["disabled_at"] is not None:
+        cur.execute("""
+            UPDATE webhook_targets
+            SET is_active = TRUE, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (webhook_id,))
+        subscriptions.notify_changed(cur, webhook_id)
+        reactivated = True
+
+    return {**result, "reactivated": reactivated}
@@ -0,0 +1,346 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Callable, Sequence
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+import metrics
+import tracing
+
+logger = logging.getLogger("webhook-db")
+
+
+def _statement_label(query) -> str:
+    if isinstance(query, bytes):
+        # execute_values sends fully composed statements, different for every
+        # page, so only the part before the values is labelled (and cached)
+        query = query.split(b"VALUES", 1)[0][:500].decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)
+    return metrics.statement_name(query)
+
+
+class TracedCursor(RealDictCursor):
+    """
+    RealDictCursor that runs every statement in its own tracing span
+
+    A `run` call often issues several statements in one transaction, so
+    each shows up as a child of the call's span.
+    """
+    def execute(self, query, vars=None):
+        if not tracing.enabled():
+            return super().execute(query, vars)
+        label = _statement_label(query)
+        with tracing.span(f"sql {label}", {"db.system": "postgresql", "db.operation": label}) as span:
+            result = super().execute(query, vars)
+            span.set_attribute("db.rowcount", self.rowcount)
+            return result
+
+    def executemany(self, query, vars_list):
+        if not tracing.enabled():
+            return super().executemany(query, vars_list)
+        label = _statement_label(query)
+        with tracing.span(f"sql {label}", {"db.system": "postgresql", "db.operation": label}):
+            return super().executemany(query, vars_list)
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no pooled connection became available within the wait limit
+    """
+
+
+class ConnectionPool:
+    """
+    App-lifetime PostgreSQL connection pool
+
+    Wraps psycopg2's ThreadedConnectionPool with a bounded wait when the pool
+    is exhausted and a liveness check on connections that have been idle.
+    """
+    def __init__(self, dsn: str = None, min_size: int = None, max_size: int = None,
+                 timeout: float = None, health_check_interval: float = None):
+        self.dsn = dsn if dsn is not None else os.environ.get("DATABASE_URL")
+        self.min_size = min_size if min_size is not None else int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+        self.max_size = max_size if max_size is not None else int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+        self.timeout = timeout if timeout is not None else float(os.environ.get("DB_POOL_TIMEOUT", "5"))
+        # Connections idle for longer than this are pinged before being handed out
+        self.health_check_interval = (
+            health_check_interval if health_check_interval is not None
+            else float(os.environ.get("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+        )
+
+        if not self.dsn:
+            raise ValueError("Missing database URL. Please provide it or set DATABASE_URL environment variable.")
+
+        if self.min_size > self.max_size:
+            raise ValueError("DB_POOL_MIN_SIZE cannot be larger than DB_POOL_MAX_SIZE")
+
+        self._pool = ThreadedConnectionPool(
+            self.min_size,
+            self.max_size,
+            self.dsn,
+            cursor_factory=TracedCursor
+        )
+        # psycopg2's pool fails immediately when exhausted, so gate checkouts
+        # on a semaphore to give callers a bounded wait instead
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._last_used: Dict[int, float] = {}
+
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._health_check_failures = 0
+
+    def getconn(self):
+        """
+        Check out a healthy connection, waiting up to `timeout` seconds
+        """
+        with self._lock:
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        if not acquired:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return conn
+
+    def putconn(self, conn, close: bool = False) -> None:
+        """
+        Return a connection to the pool, discarding it if it is broken
+        """
+        try:
+            if not conn.closed and not close:
+                # Never hand a connection with an open transaction to the next caller
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                self._last_used[id(conn)] = time.monotonic()
+            else:
+                close = True
+                self._last_used.pop(id(conn), None)
+        except psycopg2.Error:
+            close = True
+            self._last_used.pop(id(conn), None)
+
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks out a connection and always returns it
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self) -> None:
+        self._pool.closeall()
+        self._last_used.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_use = self._in_use
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "open": len(self._pool._pool) + len(self._pool._used),
+                "in_use": in_use,
+                "idle": len(self._pool._pool),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "health_check_failures": self._health_check_failures,
+            }
+
+    def _checkout_healthy(self):
+        # Try a few times in case several idle connections went stale together
+        for _ in range(self.max_size + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._lock:
+                self._health_check_failures += 1
+            logger.warning("Discarding broken pooled database connection")
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+            finally:
+                cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+# Process-wide pool, opened on app startup and closed on shutdown
+_pool: Optional[ConnectionPool] = None
+
+# Blocking psycopg2 calls run on this executor, sized to the pool so a
+# thread never sits waiting for a connection another thread is holding
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def open_pool(**kwargs) -> ConnectionPool:
+    global _pool, _executor
+    if _pool is None:
+        _pool = ConnectionPool(**kwargs)
+        _executor = ThreadPoolExecutor(max_workers=_pool.max_size, thread_name_prefix="db")
+        logger.info(f"Database pool opened (min={_pool.min_size}, max={_pool.max_size})")
+        # Read from the pool's counters at scrape time, so checkouts pay nothing
+        for state in ("open", "in_use", "idle", "waiting"):
+            metrics.DB_POOL_CONNECTIONS.labels(state).set_function(
+                lambda state=state: _pool.stats()[state] if _pool is not None else 0
+            )
+    return _pool
+
+
+def close_pool() -> None:
+    global _pool, _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+        logger.info("Database pool closed")
+
+
+def get_pool() -> ConnectionPool:
+    if _pool is None:
+        return open_pool()
+    return _pool
+
+
+# Async data access
+#
+# Route handlers and background tasks run on the event loop, so every
+# query is shipped to the database executor together with the work that
+# needs the cursor. Each call runs in its own transaction.
+
+def _run_sync(fn: Callable, args: Sequence[Any], statement: str):
+    pool = get_pool()
+    started = time.perf_counter()
+    conn = pool.getconn()
+    checked_out = time.perf_counter()
+    metrics.DB_POOL_WAIT_SECONDS.observe(checked_out - started)
+    try:
+        cur = conn.cursor()
+        try:
+            with tracing.span(f"db {statement}", {"db.system": "postgresql", "db.operation": statement}):
+                result = fn(cur, *args)
+                conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            metrics.DB_QUERY_SECONDS.labels(statement).observe(time.perf_counter() - checked_out)
+    finally:
+        pool.putconn(conn)
+
+
+async def _run(fn: Callable, args: Sequence[Any], statement: str) -> Any:
+    get_pool()
+    loop = asyncio.get_running_loop()
+    # Executor threads do not inherit context variables, so carry the
+    # caller's context (and with it the current trace span) over
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, context.run, _run_sync, fn, args, statement)
+
+
+async def run(fn: Callable, *args) -> Any:
+    """
+    Run fn(cursor, *args) on a pooled connection without blocking the event loop
+
+    The call is committed if fn returns and rolled back if it raises.
+    """
+    return await _run(fn, args, f"{fn.__module__}.{fn.__name__}")
+
+
+async def fetch_all(query: str, params: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+    def _fetch_all(cur):
+        cur.execute(query, params)
+        return cur.fetchall()
+    return await _run(_fetch_all, (), metrics.statement_name(query))
+
+
+async def fetch_one(query: str, params: Optional[Sequence[Any]] = None) -> Optional[Dict[str, Any]]:
+    def _fetch_one(cur):
+        cur.execute(query, params)
+        return cur.fetchone()
+    return await _run(_fetch_one, (), metrics.statement_name(query))
+
+
+async def execute(query: str, params: Optional[Sequence[Any]] = None) -> int:
+    """
+    Execute a statement and return the number of affected rows
+    """
+    def _execute(cur):
+        cur.execute(query, params)
+        return cur.rowcount
+    return await _run(_execute, (), metrics.statement_name(query))
+
+
+def stream(query: str, params: Optional[Sequence[Any]] = None, itersize: int = 2000) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over a query's rows through a server-side (named) cursor
+
+    Rows arrive `itersize` at a time, so memory stays flat however many
+    match. The pooled connection is held until the iterator is exhausted
+    or closed. This blocks, so iterate it from a worker thread.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor(name="stream") as cur:
+            cur.itersize = itersize
+            cur.execute(query, params)
+            yield from cur
+        conn.commit()
+    finally:
+        pool.putconn(conn)
@@ -0,0 +1,320 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+import circuits
+import db
+import http_clients
+import metrics
+import payloads
+import subscriptions
+import tracing
+
+logger = logging.getLogger("webhook-delivery")
+
+# Outbound delivery limits
+MAX_IN_FLIGHT = int(os.environ.get("WEBHOOK_MAX_IN_FLIGHT", "50"))
+PER_TARGET_CONCURRENCY = int(os.environ.get("WEBHOOK_PER_TARGET_CONCURRENCY", "4"))
+DEFAULT_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", "10"))
+
+# Retry policy
+MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "8"))
+RETRY_BASE_DELAY = float(os.environ.get("WEBHOOK_RETRY_BASE_DELAY", "30"))
+RETRY_MAX_DELAY = float(os.environ.get("WEBHOOK_RETRY_MAX_DELAY", "21600"))
+
+# 4xx responses that mean "try again later" rather than "this will never work"
+RETRYABLE_STATUS_CODES = {408, 425, 429}
+
+_client: Optional[httpx.AsyncClient] = None
+_in_flight: Optional[asyncio.Semaphore] = None
+# webhook id -> (limit, semaphore)
+_target_slots: Dict[int, Tuple[int, asyncio.Semaphore]] = {}
+# host:port -> semaphore; many targets share a host such as hooks.zapier.com
+_host_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+def start() -> None:
+    """
+    Create the shared HTTP client and concurrency limits for this event loop
+    """
+    global _client, _in_flight
+    if _client is None:
+        _client = http_clients.new_async_client()
+    if _in_flight is None:
+        _in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+
+async def close() -> None:
+    global _client, _in_flight
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _in_flight = None
+    _target_slots.clear()
+    _host_slots.clear()
+
+
+def _target_semaphore(webhook: Dict[str, Any]) -> asyncio.Semaphore:
+    limit = webhook.get("max_concurrency") or PER_TARGET_CONCURRENCY
+    current = _target_slots.get(webhook["id"])
+    # Rebuild the semaphore if the target's limit changed since it was created
+    if current is None or current[0] != limit:
+        current = (limit, asyncio.Semaphore(limit))
+        _target_slots[webhook["id"]] = current
+    return current[1]
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    """
+    Limit on concurrent requests to one host, across all of its targets
+
+    httpx only caps the total pool size, so without this a burst of events
+    for many targets on the same host could take every connection.
+    """
+    host = urlsplit(url).netloc.lower()
+    semaphore = _host_slots.get(host)
+    if semaphore is None:
+        semaphore = _host_slots[host] = asyncio.Semaphore(http_clients.MAX_CONNECTIONS_PER_HOST)
+    return semaphore
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given either as seconds or as an HTTP date
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_delay(attempts: int, retry_after: Optional[float] = None) -> float:
+    """
+    Seconds to wait before the next attempt after `attempts` failures
+
+    Uses exponential backoff with jitter so deliveries that fail together
+    are not retried together. A Retry-After from the target wins when it
+    asks for a longer wait.
+    """
+    backoff = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0)))
+    delay = random.uniform(backoff / 2, backoff)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+    return delay
+
+
+def _build_headers(webhook: Dict[str, Any]) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+
+    if webhook.get("auth_header"):
+        # Parse the auth header (expected format: "Key: Value")
+        try:
+            key, value = webhook["auth_header"].split(":", 1)
+            headers[key.strip()] = value.strip()
+        except ValueError:
+            # If no colon, use as Bearer token
+            headers["Authorization"] = f"Bearer {webhook['auth_header'].strip()}"
+
+    return headers
+
+
+async def send_webhooks_for_event(event: str, payload: Dict[Any, Any]) -> None:
+    """
+    Send an event to all registered webhooks that are subscribed to the event type
+
+    Deliveries run concurrently, so the event takes as long as its slowest
+    target rather than the sum of all of them.
+    """
+    try:
+        # Get all active webhooks that are subscribed to this event
+        webhooks = await subscriptions.index.targets_for(event)
+        if not webhooks:
+            return
+
+        # Serialize and store the payload once for all targets
+        encoded = payloads.encode(payload)
+        await db.run(payloads.store, encoded)
+
+        await asyncio.gather(*(send_webhook(webhook, event, encoded) for webhook in webhooks))
+
+    except Exception as e:
+        logger.error("Error sending webhooks for event: %s", e,
+                     extra={"event": event, "tracking_id": payload.get("tracking_id")})
+
+
+async def send_webhook(webhook, event, payload: payloads.EncodedPayload, delivery_id=None) -> None:
+    """
+    Send a webhook notification and record the delivery
+
+    The payload must already be in event_payloads (see `payloads.store`).
+    Pass `delivery_id` to make another attempt at an existing delivery.
+    Failed attempts are scheduled for a retry with exponential backoff
+    until MAX_ATTEMPTS is reached, after which the delivery is dead-lettered.
+    While the target's circuit is open the delivery is deferred instead of
+    attempted, without using up an attempt.
+    """
+    start()
+    context = {"event": event, "webhook_id": webhook["id"], "delivery_id": delivery_id}
+
+    breaker = circuits.get(webhook["id"])
+    if not breaker.allow():
+        await _defer(webhook, event, payload, delivery_id, breaker.retry_delay(), context)
+        return
+
+    try:
+        # Record the delivery attempt
+        if delivery_id is None:
+            row = await db.fetch_one("""
+                INSERT INTO webhook_deliveries (webhook_id, event, payload_hash, attempts, status, last_attempt_at)
+                VALUES (%s, %s, %s, 1, 'pending', CURRENT_TIMESTAMP)
+                RETURNING id, attempts
+            """, (webhook["id"], event, payload.hash))
+
+            delivery_id = row["id"]
+            context["delivery_id"] = delivery_id
+        else:
+            # Update attempt count
+            row = await db.fetch_one("""
+                UPDATE webhook_deliveries
+                SET attempts = attempts + 1, last_attempt_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                RETURNING attempts
+            """, (delivery_id,))
+    except Exception as e:
+        logger.error("Error recording webhook delivery: %s", e, extra=context)
+        return
+
+    retry_after = None
+    elapsed = None
+
+    try:
+        timeout = webhook.get("timeout_seconds") or DEFAULT_TIMEOUT
+
+        # Take the per-target slot, then the per-host one, so a slow target
+        # queues behind itself without holding its host's or the global slots
+        async with _target_semaphore(webhook), _host_semaphore(webhook["url"]):
+            async with _in_flight:
+                started = time.perf_counter()
+                metrics.DELIVERIES_IN_FLIGHT.inc()
+                attributes = {"webhook.id": webhook["id"], "delivery.id": delivery_id, "delivery.attempt": row["attempts"]}
+                with tracing.span("webhook POST", attributes) as span:
+                    try:
+                        response = await _client.post(
+                            webhook["url"],
+                            content=payload.body,
+                            headers=tracing.inject(_build_headers(webhook)),
+                            timeout=http_clients.timeout(read=timeout)
+                        )
+                        span.set_attribute("http.status_code", response.status_code)
+                    finally:
+                        metrics.DELIVERIES_IN_FLIGHT.dec()
+                        elapsed = time.perf_counter() - started
+
+        status_code = response.status_code
+        response_body = response.text[:1000]  # Limit response text to 1000 chars
+        success = response.is_success
+        retryable = status_code >= 500 or status_code in RETRYABLE_STATUS_CODES
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        outcome = "success" if success else "http_error"
+
+        # Lazy %-formatting: sampled-out records are never formatted
+        logger.info("Webhook sent: url=%s, status=%s", webhook["url"], status_code, extra=context)
+
+        if not success:
+            logger.warning("Webhook error: status=%s, response=%s", status_code, response.text[:100], extra=context)
+    except Exception as e:
+        # Timeouts and connection errors are always worth another attempt
+        status_code = 0
+        response_body = str(e)[:1000] or type(e).__name__
+        success = False
+        retryable = True
+        outcome = "error"
+
+        logger.error("Error sending webhook: %r", e, extra=context)
+
+    if elapsed is not None:
+        metrics.DELIVERY_SECONDS.labels(
+            str(webhook["id"]), webhook.get("service_type") or "unknown", outcome
+        ).observe(elapsed)
+
+    if breaker.record(success, elapsed or 0.0):
+        await _circuit_changed(breaker, context)
+
+    # Record the result
+    if success:
+        status, delay = "succeeded", None
+    elif retryable and row["attempts"] < MAX_ATTEMPTS:
+        status, delay = "retrying", retry_delay(row["attempts"], retry_after)
+    else:
+        status, delay = "dead", None
+        logger.warning("Webhook delivery dead-lettered after %s attempts", row["attempts"], extra=context)
+
+    try:
+        await db.execute("""
+            UPDATE webhook_deliveries
+            SET response_status = %s, response_body = %s, success = %s,
+                status = %s, next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id = %s
+        """, (status_code, response_body, success, status, delay, delivery_id))
+    except Exception as e:
+        logger.error("Error updating webhook delivery: %s", e, extra=context)
+
+
+async def _defer(webhook, event, payload: payloads.EncodedPayload, delivery_id, delay: float,
+                 context: Dict[str, Any]) -> None:
+    """
+    Park a delivery until the target's circuit lets it through
+
+    Deferred rows are picked up by the retry scheduler when they come due.
+    """
+    metrics.DELIVERIES_DEFERRED.labels(str(webhook["id"])).inc()
+    try:
+        if delivery_id is None:
+            await db.execute("""
+                INSERT INTO webhook_deliveries (webhook_id, event, payload_hash, attempts, status, next_attempt_at)
+                VALUES (%s, %s, %s, 0, 'deferred', CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+            """, (webhook["id"], event, payload.hash, delay))
+        else:
+            await db.execute("""
+                UPDATE webhook_deliveries
+                SET status = 'deferred', next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                WHERE id = %s
+            """, (delay, delivery_id))
+    except Exception as e:
+        logger.error("Error deferring webhook delivery: %s", e, extra=context)
+
+
+async def _circuit_changed(breaker: circuits.Breaker, context: Dict[str, Any]) -> None:
+    if breaker.state == circuits.CLOSED:
+        logger.info("Webhook circuit closed", extra=context)
+    else:
+        logger.warning(
+            "Webhook circuit %s: error_rate=%.2f, slow_rate=%.2f, retry in %.0fs",
+            breaker.state, breaker.error_rate, breaker.slow_rate, breaker.retry_delay(), extra=context,
+        )
+
+    try:
+        await db.run(circuits.save, breaker)
+        if breaker.should_disable() and await db.run(circuits.disable_target, breaker.webhook_id):
+            logger.warning("Webhook target disabled after sustained failures", extra=context)
+    except Exception as e:
+        logger.error("Error saving webhook circuit state: %s", e, extra=context)
@@ -0,0 +1,72 @@
+import io
+import csv
+import json
+import zlib
+from typing import Dict, Any, Iterable, Iterator, List
+
+# Encoded rows are buffered up to about this many bytes per yielded chunk
+CHUNK_SIZE = 64 * 1024
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _json_default(value: Any) -> Any:
+    # Dates as ISO 8601, like the JSON API responses
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def ndjson_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, default=_json_default) + "\n"
+
+
+def csv_lines(rows: Iterable[Dict[str, Any]], columns: List[str]) -> Iterator[str]:
+    """
+    CSV with a header row; nested values such as payloads are JSON-encoded
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take() -> str:
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(columns)
+    yield take()
+    for row in rows:
+        writer.writerow([
+            json.dumps(value, default=_json_default) if isinstance(value, (dict, list)) else value
+            for value in (row.get(column) for column in columns)
+        ])
+        yield take()
+
+
+def chunked(lines: Iterable[str], size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Join encoded lines into chunks of roughly `size` bytes
+    """
+    parts: List[bytes] = []
+    buffered = 0
+    for line in lines:
+        data = line.encode()
+        parts.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b"".join(parts)
+            parts, buffered = [], 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzipped(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,71 @@
+import os
+import logging
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("http-clients")
+
+# Shared settings for outbound HTTP
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+
+def http2_available() -> bool:
+    """
+    HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+    """
+    if os.environ.get("HTTP2_ENABLED", "true").lower() in ("0", "false", "no"):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def timeout(read: float = READ_TIMEOUT) -> httpx.Timeout:
+    """
+    Separate connect and read timeouts, so a dead host fails fast while a
+    slow but live one still gets the full read timeout
+    """
+    return httpx.Timeout(read, connect=min(CONNECT_TIMEOUT, read))
+
+
+def new_async_client() -> httpx.AsyncClient:
+    """
+    Keep-alive async client used for webhook delivery
+
+    httpx has no per-host limit; delivery caps concurrent requests per
+    host at MAX_CONNECTIONS_PER_HOST itself.
+    """
+    http2 = http2_available()
+    logger.info(f"Creating async HTTP client (http2={http2}, max_connections={MAX_CONNECTIONS})")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=timeout(),
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def new_session() -> requests.Session:
+    """
+    Keep-alive requests session for synchronous API clients
+
+    Each host gets a pool of MAX_CONNECTIONS_PER_HOST connections, and
+    callers block for a free connection rather than opening extra ones.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=MAX_CONNECTIONS_PER_HOST, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+import outbox
+from cache import TTLCache, MISSING
+
+# How long an Idempotency-Key header is remembered
+KEY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_KEY_TTL", "86400"))
+
+# Without a header, identical submissions within this window count as one
+DEDUP_WINDOW_SECONDS = int(os.environ.get("IDEMPOTENCY_DEDUP_WINDOW", "300"))
+
+MAX_KEY_LENGTH = 255
+
+# Recently seen keys, so repeats are answered without a database round trip
+_recent = TTLCache(maxsize=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000")), ttl=DEDUP_WINDOW_SECONDS)
+
+
+class Claim(NamedTuple):
+    """
+    The idempotency keys for one submission and how long they are held
+    """
+    keys: List[str]
+    ttl: int
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def claim_for(event: str, data: Dict[str, Any], idempotency_key: Optional[str] = None) -> Claim:
+    """
+    Build the keys that identify a submission
+
+    An explicit Idempotency-Key wins. Otherwise the submission is keyed on
+    its event type, email and content within the current dedup window; the
+    previous window is checked too, so a double submit that straddles a
+    window boundary is still caught.
+    """
+    if idempotency_key:
+        return Claim([_digest("key", event, idempotency_key)], KEY_TTL_SECONDS)
+
+    # Fields set per request would make every submission look new
+    content = {k: v for k, v in data.items() if k not in ("created_at", "tracking_id")}
+    email = (data.get("email") or "").strip().lower()
+    window = int(time.time()) // DEDUP_WINDOW_SECONDS
+    return Claim(
+        [_digest("content", event, email, content, bucket) for bucket in (window, window - 1)],
+        2 * DEDUP_WINDOW_SECONDS,
+    )
+
+
+def recent(claim: Claim) -> Optional[str]:
+    """
+    Tracking ID of a matching submission seen by this process, if any
+    """
+    for key in claim.keys:
+        tracking_id = _recent.get(key)
+        if tracking_id is not MISSING:
+            return tracking_id
+    return None
+
+
+def remember(claim: Claim, tracking_id: str) -> None:
+    _recent.set(claim.keys[0], tracking_id, ttl=claim.ttl)
+
+
+def enqueue_once(cur, event: str, payload: Dict[str, Any], claim: Claim) -> Tuple[str, bool]:
+    """
+    Queue an event unless its keys were already claimed
+
+    Returns the tracking ID and whether the submission was a duplicate, in
+    which case the tracking ID is the original one and nothing is queued.
+    """
+    return enqueue_many(cur, [(event, payload, claim)])[0]
+
+
+def enqueue_many(cur, items: List[Tuple[str, Dict[str, Any], Claim]]) -> List[Tuple[str, bool]]:
+    """
+    Queue each (event, payload, claim) whose keys are not already claimed
+
+    Returns (tracking ID, duplicate) per item, in order. Items repeating an
+    earlier item in the same batch count as duplicates of it. A concurrent
+    submission with the same key waits on the key's row and then sees it
+    as taken, so only one of them is queued.
+    """
+    all_keys = [key for _, _, claim in items for key in claim.keys]
+    cur.execute("""
+        SELECT key, tracking_id FROM idempotency_keys
+        WHERE key = ANY(%s) AND expires_at > CURRENT_TIMESTAMP
+    """, (all_keys,))
+    seen = {row["key"]: row["tracking_id"] for row in cur.fetchall()}
+
+    results: List[Optional[Tuple[str, bool]]] = []
+    fresh = []
+    for index, (event, payload, claim) in enumerate(items):
+        tracking_id = next((seen[key] for key in claim.keys if key in seen), None)
+        if tracking_id is not None:
+            results.append((tracking_id, True))
+            continue
+
+        tracking_id = payload.get("tracking_id") or str(uuid.uuid4())
+        payload["tracking_id"] = tracking_id
+        for key in claim.keys:
+            seen[key] = tracking_id
+        results.append((tracking_id, False))
+        fresh.append(index)
+
+    if not fresh:
+        return results
+
+    claimed = execute_values(cur, """
+        INSERT INTO idempotency_keys (key, tracking_id, expires_at)
+        VALUES %s
+        ON CONFLICT (key) DO UPDATE
+            SET tracking_id = EXCLUDED.tracking_id,
+                created_at = CURRENT_TIMESTAMP,
+                expires_at = EXCLUDED.expires_at
+            WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+        RETURNING key
+    """, [(items[i][2].keys[0], results[i][0], items[i][2].ttl) for i in fresh],
+        template="(%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))", page_size=500, fetch=True)
+    claimed = {row["key"] for row in claimed}
+
+    # Keys a concurrent request claimed after our lookup
+    lost = [i for i in fresh if items[i][2].keys[0] not in claimed]
+    if lost:
+        cur.execute("SELECT key, tracking_id FROM idempotency_keys WHERE key = ANY(%s)",
+                    ([items[i][2].keys[0] for i in lost],))
+        winners = {row["key"]: row["tracking_id"] for row in cur.fetchall()}
+        for i in lost:
+            results[i] = (winners[items[i][2].keys[0]], True)
+
+    outbox.enqueue_many(cur, [(items[i][0], items[i][1]) for i in fresh if not results[i][1]])
+    return results
+
+
+def delete_expired(cur) -> int:
+    cur.execute("DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP")
+    return cur.rowcount
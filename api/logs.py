@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Optional
+
+import tracing
+
+# "json" for one JSON object per line, "text" for the classic format
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Per-logger limits for chatty loggers, e.g. "webhook-delivery=20,airtable-batch=20"
+# (records per second) and "webhook-delivery=0.1" (share of records kept).
+# Warnings and errors are never limited or sampled.
+LOG_RATE_LIMITS = os.environ.get("LOG_RATE_LIMITS", "")
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(process)d - %(levelname)s - %(message)s'
+
+# Record attributes passed through `extra` that JSON output includes
+CONTEXT_FIELDS = ("event", "webhook_id", "delivery_id", "tracking_id", "outbox_id", "trace_id")
+
+
+def _parse_limits(spec: str) -> Dict[str, float]:
+    limits = {}
+    for part in spec.split(","):
+        name, _, value = part.strip().partition("=")
+        if name and value:
+            limits[name] = float(value)
+    return limits
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, with the context fields passed via `extra`
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LimitFilter(logging.Filter):
+    """
+    Rate-limits and samples INFO and DEBUG records of selected loggers
+
+    Each limited logger gets a token bucket refilled at its rate. Records
+    dropped by the bucket are counted and reported in the next record that
+    gets through, so gaps in the log are visible.
+    """
+    def __init__(self, rate_limits: Dict[str, float], sample_rates: Dict[str, float]):
+        super().__init__()
+        self.rate_limits = rate_limits
+        self.sample_rates = sample_rates
+        self._buckets: Dict[str, tuple] = {}
+        self._dropped: Dict[str, int] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        name = record.name
+        sample = self.sample_rates.get(name)
+        rate = self.rate_limits.get(name)
+        if sample is None and rate is None:
+            return True
+
+        with self._lock:
+            if sample is not None:
+                # Deterministic 1-in-N sampling; cheaper than drawing random numbers
+                count = self._counts.get(name, 0) + 1
+                self._counts[name] = count
+                if sample <= 0 or count % max(1, round(1 / sample)):
+                    return False
+
+            if rate is not None:
+                now = time.monotonic()
+                tokens, updated_at = self._buckets.get(name, (rate, now))
+                tokens = min(rate, tokens + (now - updated_at) * rate)
+                if tokens < 1:
+                    self._buckets[name] = (tokens, now)
+                    self._dropped[name] = self._dropped.get(name, 0) + 1
+                    return False
+                self._buckets[name] = (tokens - 1, now)
+
+                dropped = self._dropped.pop(name, 0)
+                if dropped:
+                    record.suppressed = dropped
+        return True
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves formatting and output to the listener thread
+
+    The standard QueueHandler runs the full formatter on the logging thread.
+    This one only merges the message with its args (they may change once
+    the call returns), renders any traceback and captures the current trace
+    ID there. Building the JSON line and writing it happen on the listener
+    thread, so the caller never waits on output. Records a filter drops are
+    never formatted at all.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg = record.message
+        if getattr(record, "suppressed", None):
+            record.msg = f"{record.msg} ({record.suppressed} similar records suppressed)"
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if getattr(record, "trace_id", None) is None:
+            record.trace_id = tracing.current_trace_id()
+        return record
+
+
+_listener: Optional[QueueListener] = None
+_listener_pid: Optional[int] = None
+
+
+def setup() -> None:
+    """
+    Route all logging through a queue drained by a background thread
+
+    Call once per process, before anything logs. Worker processes started
+    by multiprocessing call it again and get their own listener.
+    """
+    global _listener, _listener_pid
+    # A forked child inherits the parent's handler but not its listener thread
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _ContextQueueHandler(log_queue)
+    handler.addFilter(LimitFilter(_parse_limits(LOG_RATE_LIMITS), _parse_limits(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """
+    Flush queued records and stop the listener thread
+    """
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
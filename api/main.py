@@ -1,22 +1,29 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Header
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional, Union
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Dict, Any, Literal, Optional, Union
 from datetime import datetime, date
 import uuid
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import json
-import requests
+import base64
 import logging
-from airtable_connector import AirtableConnector
+import circuits
+import db
+import export
+import metrics
+import idempotency
+import logs
+import payloads
+import schema
+import subscriptions
+import tracing
+from db import PoolTimeout
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-)
+logs.setup()
 logger = logging.getLogger("webhook-server")
 
 # Create FastAPI app
@@ -29,27 +36,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Database connection helper
-def get_db_connection():
-    """Get a connection to the PostgreSQL database"""
-    conn = psycopg2.connect(
-        os.environ.get("DATABASE_URL"),
-        cursor_factory=RealDictCursor
-    )
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-# Initialize Airtable connector
-try:
-    airtable = AirtableConnector()
-    logger.info("Airtable connector initialized successfully")
-except Exception as e:
-    logger.warning(f"Airtable connector initialization failed: {e}")
-    airtable = None
+app.add_middleware(metrics.PrometheusMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    logger.error(f"Database pool exhausted: {exc}")
+    return JSONResponse(status_code=503, content={"detail": "Database busy, please retry"})
 
 # Pydantic models for request validation
 
@@ -61,6 +57,8 @@ class WebhookTarget(BaseModel):
     auth_header: Optional[str] = None
     is_active: bool = True
     events: List[str] = Field(..., example=["lead.created", "booking.created", "guide.requested"])
+    timeout_seconds: Optional[float] = Field(None, gt=0, description="Per-delivery timeout, defaults to WEBHOOK_TIMEOUT")
+    max_concurrency: Optional[int] = Field(None, gt=0, description="Max concurrent deliveries, defaults to WEBHOOK_PER_TARGET_CONCURRENCY")
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
@@ -74,6 +72,8 @@ class WebhookDelivery(BaseModel):
     created_at: Optional[datetime] = None
     attempts: int = 0
     success: bool = False
+    status: Optional[str] = Field(None, example="pending, succeeded, retrying, deferred, dead")
+    next_attempt_at: Optional[datetime] = None
 
 class LeadEvent(BaseModel):
     first_name: str
@@ -183,154 +183,159 @@ async def autoblogger_webhook(
         logger.info(f"Received new blog post: {post.title}")
         
         # Save the blog post to the database
-        conn = await get_db_connection()
-        try:
-            status = "published" if post.publish else "draft"
-            
-            # Convert tags to JSON array if provided
-            tags_json = "[]"
-            if post.tags:
-                tags_json = json.dumps(post.tags)
-                
-            # Convert category to array for categories field
-            categories_json = json.dumps([post.category]) if post.category else "[]"
-            
-            # Insert the blog post into the database
-            cur = await conn.cursor()
-            await cur.execute(
-                """
-                INSERT INTO blog_posts (title, slug, content, excerpt, image_url, 
-                                      categories, tags, status, pub_date)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, slug
-                """,
-                (post.title, post.slug, post.content, post.excerpt, post.image_url,
-                 categories_json, tags_json, status, datetime.now())
-            )
-            
-            result = await cur.fetchone()
-            await cur.close()
-            
-            logger.info(f"Successfully saved blog post to database with ID: {result[0]}")
+        status = "published" if post.publish else "draft"
+        
+        # Convert tags to JSON array if provided
+        tags_json = "[]"
+        if post.tags:
+            tags_json = json.dumps(post.tags)
             
-            return {
-                "status": "success", 
-                "message": "Blog post saved to database",
-                "post_id": result[0],
-                "post_slug": result[1],
-                "callback_url": f"https://{os.environ.get('REPLIT_SLUG', 'localhost')}.replit.app/api/webhooks/autoblogger"
-            }
-        finally:
-            await conn.close()
+        # Convert category to array for categories field
+        categories_json = json.dumps([post.category]) if post.category else "[]"
+        
+        # Insert the blog post into the database
+        result = await db.fetch_one(
+            """
+            INSERT INTO blog_posts (title, slug, content, excerpt, image_url, 
+                                  categories, tags, status, pub_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, slug
+            """,
+            (post.title, post.slug, post.content, post.excerpt, post.image_url,
+             categories_json, tags_json, status, datetime.now())
+        )
+        
+        logger.info(f"Successfully saved blog post to database with ID: {result['id']}")
+        
+        return {
+            "status": "success", 
+            "message": "Blog post saved to database",
+            "post_id": result["id"],
+            "post_slug": result["slug"],
+            "callback_url": f"https://{os.environ.get('REPLIT_SLUG', 'localhost')}.replit.app/api/webhooks/autoblogger"
+        }
+    except PoolTimeout:
+        raise
     except Exception as e:
         logger.error(f"Error processing blog post from AutoBlogger: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing blog post: {str(e)}")
 
+def _decode_events(row: Dict[str, Any]) -> Dict[str, Any]:
+    # psycopg2 already decodes JSONB, but rows written as text still come back as strings
+    if isinstance(row.get("events"), str):
+        row["events"] = json.loads(row["events"])
+    return row
+
+def _upsert_webhook_target(cur, webhook: WebhookTarget):
+    # Insert or update webhook
+    if webhook.id:
+        cur.execute("""
+            UPDATE webhook_targets 
+            SET name = %s, url = %s, service_type = %s, auth_header = %s, 
+                is_active = %s, events = %s, timeout_seconds = %s, max_concurrency = %s,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            RETURNING id, name, url, service_type, auth_header, is_active, events,
+                      timeout_seconds, max_concurrency, created_at, updated_at
+        """, (
+            webhook.name, webhook.url, webhook.service_type, webhook.auth_header,
+            webhook.is_active, json.dumps(webhook.events), webhook.timeout_seconds,
+            webhook.max_concurrency, webhook.id
+        ))
+    else:
+        cur.execute("""
+            INSERT INTO webhook_targets (name, url, service_type, auth_header, is_active, events,
+                                         timeout_seconds, max_concurrency)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, name, url, service_type, auth_header, is_active, events,
+                      timeout_seconds, max_concurrency, created_at, updated_at
+        """, (
+            webhook.name, webhook.url, webhook.service_type, webhook.auth_header,
+            webhook.is_active, json.dumps(webhook.events), webhook.timeout_seconds,
+            webhook.max_concurrency
+        ))
+    
+    result = cur.fetchone()
+    if result:
+        subscriptions.notify_changed(cur, result["id"])
+    return result
+
 @app.post("/api/webhooks/setup", response_model=WebhookTarget)
-async def setup_webhook(webhook: WebhookTarget, conn=Depends(get_db_connection)):
+async def setup_webhook(webhook: WebhookTarget):
     """
     Create or update a webhook target configuration
     """
-    cur = conn.cursor()
-    
     try:
-        # Create webhook_targets table if it doesn't exist
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS webhook_targets (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                url TEXT NOT NULL,
-                service_type VARCHAR(100) NOT NULL,
-                auth_header TEXT,
-                is_active BOOLEAN DEFAULT TRUE,
-                events JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        result = await db.run(_upsert_webhook_target, webhook)
         
-        # Create webhook_deliveries table if it doesn't exist
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS webhook_deliveries (
-                id SERIAL PRIMARY KEY,
-                webhook_id INTEGER REFERENCES webhook_targets(id),
-                event VARCHAR(100) NOT NULL,
-                payload JSONB NOT NULL,
-                response_status INTEGER,
-                response_body TEXT,
-                attempts INTEGER DEFAULT 0,
-                success BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        if not result:
+            raise HTTPException(status_code=404, detail="Webhook target not found")
         
-        # Insert or update webhook
-        if webhook.id:
-            cur.execute("""
-                UPDATE webhook_targets 
-                SET name = %s, url = %s, service_type = %s, auth_header = %s, 
-                    is_active = %s, events = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-                RETURNING id, name, url, service_type, auth_header, is_active, events, created_at, updated_at
-            """, (
-                webhook.name, webhook.url, webhook.service_type, webhook.auth_header,
-                webhook.is_active, json.dumps(webhook.events), webhook.id
-            ))
-        else:
-            cur.execute("""
-                INSERT INTO webhook_targets (name, url, service_type, auth_header, is_active, events)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id, name, url, service_type, auth_header, is_active, events, created_at, updated_at
-            """, (
-                webhook.name, webhook.url, webhook.service_type, webhook.auth_header,
-                webhook.is_active, json.dumps(webhook.events)
-            ))
-        
-        result = cur.fetchone()
-        conn.commit()
-        
-        # Convert events from JSON string to list
-        result["events"] = json.loads(result["events"])
-        
-        return result
+        return _decode_events(result)
+    except (HTTPException, PoolTimeout):
+        raise
     except Exception as e:
-        conn.rollback()
         logger.error(f"Error setting up webhook: {e}")
         raise HTTPException(status_code=500, detail=f"Error setting up webhook: {str(e)}")
-    finally:
-        cur.close()
 
 @app.get("/api/webhooks", response_model=List[WebhookTarget])
-async def list_webhooks(conn=Depends(get_db_connection)):
+async def list_webhooks():
     """
     List all webhook targets
     """
-    cur = conn.cursor()
-    
     try:
-        cur.execute("""
-            SELECT id, name, url, service_type, auth_header, is_active, events, created_at, updated_at
+        results = await db.fetch_all("""
+            SELECT id, name, url, service_type, auth_header, is_active, events,
+                   timeout_seconds, max_concurrency, created_at, updated_at
             FROM webhook_targets
             ORDER BY created_at DESC
         """)
         
-        results = cur.fetchall()
-        
-        # Convert events from JSON string to list for each result
-        for result in results:
-            result["events"] = json.loads(result["events"])
-        
-        return results
+        return [_decode_events(result) for result in results]
+    except PoolTimeout:
+        raise
     except Exception as e:
         logger.error(f"Error listing webhooks: {e}")
         raise HTTPException(status_code=500, detail=f"Error listing webhooks: {str(e)}")
-    finally:
-        cur.close()
+
+async def _queue_event(event: str, event_dict: Dict[str, Any], idempotency_key: Optional[str]):
+    """
+    Queue an event for delivery unless it repeats an earlier submission
+
+    Returns the tracking ID and whether the event was a duplicate, in which
+    case the original submission's tracking ID is returned and nothing is
+    sent again.
+    """
+    if idempotency_key and len(idempotency_key) > idempotency.MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+    claim = idempotency.claim_for(event, event_dict, idempotency_key)
+    tracking_id = idempotency.recent(claim)
+    if tracking_id:
+        tracing.set_attribute("tracking_id", tracking_id)
+        tracing.set_attribute("duplicate", True)
+        return tracking_id, True
+
+    tracking_id, duplicate = await db.run(idempotency.enqueue_once, event, event_dict, claim)
+    idempotency.remember(claim, tracking_id)
+    tracing.set_attribute("tracking_id", tracking_id)
+    tracing.set_attribute("duplicate", duplicate)
+    return tracking_id, duplicate
+
+def _queued_response(tracking_id: str, duplicate: bool) -> Dict[str, Any]:
+    response = {"status": "success", "tracking_id": tracking_id}
+    if duplicate:
+        response["duplicate"] = True
+    return response
 
 @app.post("/api/leads/webhook")
-async def send_lead_webhook(lead: LeadEvent, background_tasks: BackgroundTasks, conn=Depends(get_db_connection)):
+async def send_lead_webhook(lead: LeadEvent, idempotency_key: Optional[str] = Header(None)):
     """
     Send a lead event to all registered webhooks
+    
+    Repeats of the same Idempotency-Key, or without one, identical
+    submissions a few minutes apart, return the original tracking ID
+    without being sent again.
     """
     # Add event type and tracking ID
     lead_dict = lead.dict()
@@ -341,31 +346,25 @@ async def send_lead_webhook(lead: LeadEvent, background_tasks: BackgroundTasks,
     if not lead_dict.get("created_at"):
         lead_dict["created_at"] = datetime.now().isoformat()
     
-    # Check if Airtable connector is available and send directly to Airtable
-    if airtable:
-        try:
-            background_tasks.add_task(
-                airtable.send_lead_to_airtable,
-                lead_dict
-            )
-            logger.info(f"Lead sent to Airtable. Tracking ID: {lead_dict['tracking_id']}")
-        except Exception as e:
-            logger.error(f"Error sending lead to Airtable: {e}")
-    
-    # Also send to any registered webhooks
-    background_tasks.add_task(
-        _send_webhooks_for_event,
-        "lead.created",
-        lead_dict,
-        conn
-    )
+    # Queue for the delivery worker, which sends to Airtable and all registered webhooks
+    tracking_id, duplicate = await _queue_event("lead.created", lead_dict, idempotency_key)
+    if duplicate:
+        logger.info("Duplicate lead ignored. Tracking ID: %s", tracking_id,
+                    extra={"event": "lead.created", "tracking_id": tracking_id})
+    else:
+        logger.info("Lead queued for delivery. Tracking ID: %s", tracking_id,
+                    extra={"event": "lead.created", "tracking_id": tracking_id})
     
-    return {"status": "success", "tracking_id": lead_dict["tracking_id"]}
+    return _queued_response(tracking_id, duplicate)
 
 @app.post("/api/bookings/webhook")
-async def send_booking_webhook(booking: BookingEvent, background_tasks: BackgroundTasks, conn=Depends(get_db_connection)):
+async def send_booking_webhook(booking: BookingEvent, idempotency_key: Optional[str] = Header(None)):
     """
     Send a booking event to all registered webhooks
+    
+    Repeats of the same Idempotency-Key, or without one, identical
+    submissions a few minutes apart, return the original tracking ID
+    without being sent again.
     """
     # Add event type and tracking ID
     booking_dict = booking.dict()
@@ -376,31 +375,25 @@ async def send_booking_webhook(booking: BookingEvent, background_tasks: Backgrou
     if not booking_dict.get("created_at"):
         booking_dict["created_at"] = datetime.now().isoformat()
     
-    # Check if Airtable connector is available and send directly to Airtable
-    if airtable:
-        try:
-            background_tasks.add_task(
-                airtable.send_booking_to_airtable,
-                booking_dict
-            )
-            logger.info(f"Booking sent to Airtable. Tracking ID: {booking_dict['tracking_id']}")
-        except Exception as e:
-            logger.error(f"Error sending booking to Airtable: {e}")
-    
-    # Also send to any registered webhooks
-    background_tasks.add_task(
-        _send_webhooks_for_event,
-        "booking.created",
-        booking_dict,
-        conn
-    )
+    # Queue for the delivery worker, which sends to Airtable and all registered webhooks
+    tracking_id, duplicate = await _queue_event("booking.created", booking_dict, idempotency_key)
+    if duplicate:
+        logger.info("Duplicate booking ignored. Tracking ID: %s", tracking_id,
+                    extra={"event": "booking.created", "tracking_id": tracking_id})
+    else:
+        logger.info("Booking queued for delivery. Tracking ID: %s", tracking_id,
+                    extra={"event": "booking.created", "tracking_id": tracking_id})
     
-    return {"status": "success", "tracking_id": booking_dict["tracking_id"]}
+    return _queued_response(tracking_id, duplicate)
 
 @app.post("/api/guides/webhook")
-async def send_guide_request_webhook(guide: GuideRequestEvent, background_tasks: BackgroundTasks, conn=Depends(get_db_connection)):
+async def send_guide_request_webhook(guide: GuideRequestEvent, idempotency_key: Optional[str] = Header(None)):
     """
     Send a guide request event to all registered webhooks
+    
+    Repeats of the same Idempotency-Key, or without one, identical
+    submissions a few minutes apart, return the original tracking ID
+    without being sent again.
     """
     # Add event type and tracking ID
     guide_dict = guide.dict()
@@ -411,282 +404,414 @@ async def send_guide_request_webhook(guide: GuideRequestEvent, background_tasks:
     if not guide_dict.get("created_at"):
         guide_dict["created_at"] = datetime.now().isoformat()
     
-    # Check if Airtable connector is available and send directly to Airtable
-    if airtable:
-        try:
-            background_tasks.add_task(
-                airtable.send_guide_request_to_airtable,
-                guide_dict
-            )
-            logger.info(f"Guide request sent to Airtable. Tracking ID: {guide_dict['tracking_id']}")
-        except Exception as e:
-            logger.error(f"Error sending guide request to Airtable: {e}")
-    
-    # Also send to any registered webhooks
-    background_tasks.add_task(
-        _send_webhooks_for_event,
-        "guide.requested",
-        guide_dict,
-        conn
-    )
+    # Queue for the delivery worker, which sends to Airtable and all registered webhooks
+    tracking_id, duplicate = await _queue_event("guide.requested", guide_dict, idempotency_key)
+    if duplicate:
+        logger.info("Duplicate guide request ignored. Tracking ID: %s", tracking_id,
+                    extra={"event": "guide.requested", "tracking_id": tracking_id})
+    else:
+        logger.info("Guide request queued for delivery. Tracking ID: %s", tracking_id,
+                    extra={"event": "guide.requested", "tracking_id": tracking_id})
+    
+    return _queued_response(tracking_id, duplicate)
+
+# Event types accepted by the batch endpoint and the model each must match
+EVENT_MODELS = {
+    "lead.created": LeadEvent,
+    "booking.created": BookingEvent,
+    "guide.requested": GuideRequestEvent,
+}
+
+MAX_EVENT_BATCH_SIZE = int(os.environ.get("MAX_EVENT_BATCH_SIZE", "1000"))
+
+class _InvalidLine:
+    """
+    An NDJSON line that is not valid JSON, reported as that item's error
+    """
+    def __init__(self, error: ValueError):
+        self.error = error
+
+def _parse_ndjson_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return _InvalidLine(e)
+
+def _parse_event_batch(body: bytes, content_type: str) -> List[Any]:
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return [_parse_ndjson_line(line) for line in body.splitlines() if line.strip()]
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+    return items
+
+def _validate_batch_item(item: Any):
+    """
+    Returns (event, event dict, idempotency key) or raises ValueError
+    """
+    if isinstance(item, _InvalidLine):
+        raise ValueError(f"Invalid JSON: {item.error}")
+    if not isinstance(item, dict):
+        raise ValueError("Each item must be an object")
+    event = item.get("event")
+    model = EVENT_MODELS.get(event) if isinstance(event, str) else None
+    if model is None:
+        raise ValueError(f"Unknown event {event!r}, expected one of {sorted(EVENT_MODELS)}")
+    data = item.get("data") or {}
+    if not isinstance(data, dict):
+        raise ValueError("data must be an object")
+    try:
+        event_dict = model(**data).dict()
+    except ValidationError as e:
+        raise ValueError("; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+        ))
+    idempotency_key = item.get("idempotency_key")
+    if idempotency_key is not None and (not isinstance(idempotency_key, str) or len(idempotency_key) > idempotency.MAX_KEY_LENGTH):
+        raise ValueError("idempotency_key must be a string of at most 255 characters")
+
+    event_dict["event_type"] = event
+    if not event_dict.get("created_at"):
+        event_dict["created_at"] = datetime.now().isoformat()
+    return event, event_dict, idempotency_key
+
+@app.post("/api/events/batch")
+async def send_event_batch(request: Request):
+    """
+    Queue many lead, booking and guide events in one request
+    
+    The body is a JSON array, or NDJSON with an `application/x-ndjson`
+    content type, of items like `{"event": "lead.created", "data": {...},
+    "idempotency_key": "optional"}`. Valid items are queued together in one
+    transaction; invalid ones are reported without failing the rest. The
+    response has a result per item, in order.
+    """
+    items = _parse_event_batch(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > MAX_EVENT_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_EVENT_BATCH_SIZE} events per batch")
+    
+    results: List[Dict[str, Any]] = []
+    valid = []
+    with tracing.span("validate", {"batch.size": len(items)}):
+        for index, item in enumerate(items):
+            try:
+                event, event_dict, idempotency_key = _validate_batch_item(item)
+            except ValueError as e:
+                results.append({"index": index, "status": "error", "error": str(e)})
+                continue
+            claim = idempotency.claim_for(event, event_dict, idempotency_key)
+            results.append({"index": index})
+            valid.append((index, (event, event_dict, claim)))
+    
+    if valid:
+        queued = await db.run(idempotency.enqueue_many, [entry for _, entry in valid])
+        for (index, (_, _, claim)), (tracking_id, duplicate) in zip(valid, queued):
+            idempotency.remember(claim, tracking_id)
+            results[index].update(status="duplicate" if duplicate else "queued", tracking_id=tracking_id)
     
-    return {"status": "success", "tracking_id": guide_dict["tracking_id"]}
+    counts = {status: sum(1 for r in results if r["status"] == status) for status in ("queued", "duplicate", "error")}
+    logger.info("Event batch processed: %s", counts)
+    
+    return {"status": "success", **counts, "results": results}
 
 # Admin routes
 
+# Columns returned by the delivery listing; payload only when asked for
+DELIVERY_COLUMNS = """
+    d.id, d.webhook_id, d.event, d.response_status, d.response_body, d.attempts,
+    d.success, d.status, d.next_attempt_at, d.last_attempt_at, d.created_at,
+    w.name as webhook_name, w.url as webhook_url
+"""
+
+MAX_DELIVERY_PAGE_SIZE = 1000
+
+def _encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([row["created_at"].isoformat(), row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, delivery_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(delivery_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _delivery_filters(event_type, webhook_id, success, status):
+    clauses = []
+    params = []
+    
+    if event_type:
+        clauses.append("d.event = %s")
+        params.append(event_type)
+    
+    if webhook_id:
+        clauses.append("d.webhook_id = %s")
+        params.append(webhook_id)
+    
+    if success is not None:
+        clauses.append("d.success = %s")
+        params.append(success)
+    
+    if status:
+        clauses.append("d.status = %s")
+        params.append(status)
+    
+    return clauses, params
+
 @app.get("/api/admin/webhook-deliveries")
 async def list_webhook_deliveries(
+    response: Response,
     limit: int = 100, 
     event_type: Optional[str] = None,
     webhook_id: Optional[int] = None,
     success: Optional[bool] = None,
-    conn=Depends(get_db_connection)
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include_payload: bool = False
 ):
     """
     List webhook delivery history with filtering options
+    
+    Results are newest first. When more rows exist, the X-Next-Cursor
+    response header holds a cursor; pass it back as `cursor` for the next
+    page. Payloads are left out unless `include_payload` is set.
     """
-    cur = conn.cursor()
+    limit = max(1, min(limit, MAX_DELIVERY_PAGE_SIZE))
+    clauses, params = _delivery_filters(event_type, webhook_id, success, status)
+    
+    # Keyset pagination: continue strictly after the last row of the
+    # previous page, so each page is an index range scan
+    if cursor:
+        clauses.append("(d.created_at, d.id) < (%s, %s)")
+        params.extend(_decode_cursor(cursor))
     
     try:
-        query = """
-            SELECT d.*, w.name as webhook_name, w.url as webhook_url
+        columns = DELIVERY_COLUMNS + (", " + payloads.PAYLOAD_COLUMNS if include_payload else "")
+        query = f"""
+            SELECT {columns}
             FROM webhook_deliveries d
             JOIN webhook_targets w ON d.webhook_id = w.id
-            WHERE 1=1
+            {payloads.PAYLOAD_JOIN if include_payload else ""}
+            {"WHERE " + " AND ".join(clauses) if clauses else ""}
+            ORDER BY d.created_at DESC, d.id DESC
+            LIMIT %s
         """
-        params = []
-        
-        if event_type:
-            query += " AND d.event = %s"
-            params.append(event_type)
-        
-        if webhook_id:
-            query += " AND d.webhook_id = %s"
-            params.append(webhook_id)
+        # One extra row tells us whether there is a next page
+        params.append(limit + 1)
         
-        if success is not None:
-            query += " AND d.success = %s"
-            params.append(success)
+        results = await db.fetch_all(query, tuple(params))
         
-        query += " ORDER BY d.created_at DESC LIMIT %s"
-        params.append(limit)
+        if len(results) > limit:
+            results = results[:limit]
+            response.headers["X-Next-Cursor"] = _encode_cursor(results[-1])
         
-        cur.execute(query, tuple(params))
-        
-        results = cur.fetchall()
+        if include_payload:
+            results = [payloads.resolve(row) for row in results]
         
         return results
+    except PoolTimeout:
+        raise
     except Exception as e:
         logger.error(f"Error listing webhook deliveries: {e}")
         raise HTTPException(status_code=500, detail=f"Error listing webhook deliveries: {str(e)}")
-    finally:
-        cur.close()
+
+# CSV column order for the delivery export, matching DELIVERY_COLUMNS
+EXPORT_COLUMNS = [
+    "id", "webhook_id", "webhook_name", "webhook_url", "event", "status", "success",
+    "attempts", "response_status", "response_body", "created_at", "last_attempt_at", "next_attempt_at",
+]
+
+@app.get("/api/admin/webhook-deliveries/export")
+async def export_webhook_deliveries(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    event_type: Optional[str] = None,
+    webhook_id: Optional[int] = None,
+    success: Optional[bool] = None,
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    include_payload: bool = False,
+    gzip: bool = False
+):
+    """
+    Stream webhook delivery history as NDJSON or CSV, oldest first
+    
+    Takes the same filters as the delivery listing plus a created_at range
+    (`created_from` inclusive, `created_to` exclusive). Rows are read from
+    a server-side cursor and streamed in chunks, so memory use does not
+    grow with the size of the export. Set `gzip` for a gzipped file.
+    """
+    clauses, params = _delivery_filters(event_type, webhook_id, success, status)
+    
+    if created_from:
+        clauses.append("d.created_at >= %s")
+        params.append(created_from)
+    
+    if created_to:
+        clauses.append("d.created_at < %s")
+        params.append(created_to)
+    
+    columns = DELIVERY_COLUMNS + (", " + payloads.PAYLOAD_COLUMNS if include_payload else "")
+    query = f"""
+        SELECT {columns}
+        FROM webhook_deliveries d
+        JOIN webhook_targets w ON d.webhook_id = w.id
+        {payloads.PAYLOAD_JOIN if include_payload else ""}
+        {"WHERE " + " AND ".join(clauses) if clauses else ""}
+        ORDER BY d.created_at, d.id
+    """
+    
+    rows = db.stream(query, tuple(params))
+    if include_payload:
+        rows = (payloads.resolve(row) for row in rows)
+    
+    if format == "csv":
+        lines = export.csv_lines(rows, EXPORT_COLUMNS + (["payload"] if include_payload else []))
+    else:
+        lines = export.ndjson_lines(rows)
+    
+    chunks = export.chunked(lines)
+    if gzip:
+        chunks = export.gzipped(chunks)
+    
+    # Pull the first chunk before responding, so a failed checkout or query
+    # is reported as an error status rather than a truncated download
+    try:
+        first = await run_in_threadpool(next, chunks, b"")
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting webhook deliveries: {e}")
+        raise HTTPException(status_code=500, detail=f"Error exporting webhook deliveries: {str(e)}")
+    
+    def body():
+        yield first
+        yield from chunks
+    
+    filename = f"webhook-deliveries.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if gzip else export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus metrics for this API process
+    """
+    return Response(content=metrics.latest(), media_type=metrics.CONTENT_TYPE_LATEST)
 
 @app.post("/api/admin/webhook-retry/{delivery_id}")
-async def retry_webhook(delivery_id: int, background_tasks: BackgroundTasks, conn=Depends(get_db_connection)):
+async def retry_webhook(delivery_id: int):
     """
     Retry a failed webhook delivery
-    """
-    cur = conn.cursor()
     
+    The delivery is made due immediately and picked up by the worker's retry
+    scheduler. Dead-lettered deliveries get a fresh set of attempts.
+    """
     try:
-        cur.execute("""
-            SELECT d.*, w.url, w.auth_header
-            FROM webhook_deliveries d
-            JOIN webhook_targets w ON d.webhook_id = w.id
-            WHERE d.id = %s
+        result = await db.fetch_one("""
+            UPDATE webhook_deliveries
+            SET status = 'retrying', next_attempt_at = CURRENT_TIMESTAMP,
+                attempts = CASE WHEN status = 'dead' THEN 0 ELSE attempts END
+            WHERE id = %s
+            RETURNING id
         """, (delivery_id,))
         
-        delivery = cur.fetchone()
-        
-        if not delivery:
+        if not result:
             raise HTTPException(status_code=404, detail="Webhook delivery not found")
         
-        # Retry the webhook in the background
-        background_tasks.add_task(
-            _send_webhook,
-            {
-                "id": delivery["webhook_id"],
-                "url": delivery["url"],
-                "auth_header": delivery["auth_header"]
-            },
-            delivery["event"],
-            delivery["payload"],
-            conn,
-            is_retry=True,
-            original_delivery_id=delivery_id
-        )
-        
         return {"status": "success", "message": "Webhook retry initiated"}
-    except HTTPException:
+    except (HTTPException, PoolTimeout):
         raise
     except Exception as e:
         logger.error(f"Error retrying webhook: {e}")
         raise HTTPException(status_code=500, detail=f"Error retrying webhook: {str(e)}")
-    finally:
-        cur.close()
 
-# Helper functions
+@app.get("/api/admin/webhook-circuits")
+async def list_webhook_circuits():
+    """
+    Circuit breaker state of every webhook target
+    
+    Targets whose circuit has never tripped are reported as closed.
+    `open_until` is when deferred deliveries are next offered to the target.
+    """
+    try:
+        return await db.fetch_all("""
+            SELECT w.id AS webhook_id, w.name, w.url, w.is_active,
+                   COALESCE(c.state, 'closed') AS state, COALESCE(c.trips, 0) AS trips,
+                   c.error_rate, c.slow_rate, c.open_until, c.failing_since, c.disabled_at, c.updated_at,
+                   (SELECT count(*) FROM webhook_deliveries d
+                    WHERE d.webhook_id = w.id AND d.status = 'deferred') AS deferred
+            FROM webhook_targets w
+            LEFT JOIN webhook_circuit_state c ON c.webhook_id = w.id
+            ORDER BY w.id
+        """)
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing webhook circuits: {e}")
+        raise HTTPException(status_code=500, detail=f"Error listing webhook circuits: {str(e)}")
 
-async def _send_webhooks_for_event(event: str, payload: Dict[Any, Any], conn):
+@app.post("/api/admin/webhook-circuits/{webhook_id}/reset")
+async def reset_webhook_circuit(webhook_id: int):
     """
-    Send an event to all registered webhooks that are subscribed to the event type
+    Close a target's circuit breaker
+    
+    A target the breaker disabled is reactivated. Workers pick the change up
+    within CIRCUIT_SYNC_INTERVAL seconds; deferred deliveries then go out as
+    they come due.
     """
     try:
-        cur = conn.cursor()
+        result = await db.run(circuits.reset, webhook_id)
         
-        # Get all active webhooks that are subscribed to this event
-        cur.execute("""
-            SELECT id, url, auth_header
-            FROM webhook_targets
-            WHERE is_active = TRUE AND events::jsonb ? %s
-        """, (event,))
+        if not result:
+            raise HTTPException(status_code=404, detail="Webhook target not found")
         
-        webhooks = cur.fetchall()
-        
-        for webhook in webhooks:
-            await _send_webhook(webhook, event, payload, conn)
-            
+        return result
+    except (HTTPException, PoolTimeout):
+        raise
     except Exception as e:
-        logger.error(f"Error sending webhooks for event {event}: {e}")
-    finally:
-        if 'cur' in locals():
-            cur.close()
+        logger.error(f"Error resetting webhook circuit: {e}")
+        raise HTTPException(status_code=500, detail=f"Error resetting webhook circuit: {str(e)}")
 
-async def _send_webhook(webhook, event, payload, conn, is_retry=False, original_delivery_id=None):
+@app.get("/api/admin/db-pool")
+async def db_pool_stats():
     """
-    Send a webhook notification and record the delivery
+    Report database connection pool usage
     """
-    cur = conn.cursor()
-    
     try:
-        # Record the delivery attempt
-        if not is_retry:
-            cur.execute("""
-                INSERT INTO webhook_deliveries (webhook_id, event, payload)
-                VALUES (%s, %s, %s)
-                RETURNING id
-            """, (webhook["id"], event, json.dumps(payload)))
-            
-            delivery_id = cur.fetchone()["id"]
-            conn.commit()
-        else:
-            delivery_id = original_delivery_id
-            
-            # Update attempt count
-            cur.execute("""
-                UPDATE webhook_deliveries 
-                SET attempts = attempts + 1
-                WHERE id = %s
-            """, (delivery_id,))
-            conn.commit()
-        
-        # Send the webhook
-        headers = {"Content-Type": "application/json"}
-        
-        if webhook.get("auth_header"):
-            # Parse the auth header (expected format: "Key: Value")
-            try:
-                key, value = webhook["auth_header"].split(":", 1)
-                headers[key.strip()] = value.strip()
-            except ValueError:
-                # If no colon, use as Bearer token
-                headers["Authorization"] = f"Bearer {webhook['auth_header'].strip()}"
-        
-        response = requests.post(
-            webhook["url"],
-            json=payload,
-            headers=headers,
-            timeout=10  # 10 second timeout
-        )
-        
-        # Record the result
-        cur.execute("""
-            UPDATE webhook_deliveries 
-            SET response_status = %s, response_body = %s, success = %s
-            WHERE id = %s
-        """, (
-            response.status_code,
-            response.text[:1000],  # Limit response text to 1000 chars
-            response.status_code >= 200 and response.status_code < 300,
-            delivery_id
-        ))
-        conn.commit()
-        
-        logger.info(f"Webhook sent: event={event}, url={webhook['url']}, status={response.status_code}")
-        
-        if response.status_code < 200 or response.status_code >= 300:
-            logger.warning(f"Webhook error: status={response.status_code}, response={response.text[:100]}")
-            
+        return db.get_pool().stats()
     except Exception as e:
-        conn.rollback()
-        
-        # Record the error
-        try:
-            cur.execute("""
-                UPDATE webhook_deliveries 
-                SET response_status = 0, response_body = %s, success = FALSE
-                WHERE id = %s
-            """, (str(e)[:1000], delivery_id))
-            conn.commit()
-        except Exception as inner_e:
-            logger.error(f"Error updating webhook delivery: {inner_e}")
-            
-        logger.error(f"Error sending webhook: {e}")
-    finally:
-        cur.close()
+        logger.error(f"Error reading database pool stats: {e}")
+        raise HTTPException(status_code=500, detail=f"Error reading database pool stats: {str(e)}")
 
 # Startup event handler
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting Cabo Webhook API...")
     
-    # Test database connection
+    tracing.setup("webhook-api")
+    
+    # Open the connection pool and test database connection
     try:
-        conn = next(get_db_connection())
-        cur = conn.cursor()
-        
-        # Create webhook tables if they don't exist
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS webhook_targets (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                url TEXT NOT NULL,
-                service_type VARCHAR(100) NOT NULL,
-                auth_header TEXT,
-                is_active BOOLEAN DEFAULT TRUE,
-                events JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS webhook_deliveries (
-                id SERIAL PRIMARY KEY,
-                webhook_id INTEGER REFERENCES webhook_targets(id),
-                event VARCHAR(100) NOT NULL,
-                payload JSONB NOT NULL,
-                response_status INTEGER,
-                response_body TEXT,
-                attempts INTEGER DEFAULT 0,
-                success BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
+        db.open_pool()
+        await db.run(schema.create_tables)
         logger.info("Database tables initialized")
     except Exception as e:
         logger.error(f"Database initialization error: {e}")
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
     
     logger.info("Cabo Webhook API started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    db.close_pool()
+
 # Run the app
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,112 @@
+import re
+import time
+from functools import lru_cache
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest, start_http_server
+
+# Buckets sized for calls that usually take milliseconds but can hit a
+# multi-second timeout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "API request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Time spent running a database call, including commit",
+    ["statement"], buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Pooled database connections by state", ["state"])
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting to check out a pooled connection",
+    buckets=LATENCY_BUCKETS,
+)
+
+DELIVERY_SECONDS = Histogram(
+    "webhook_delivery_duration_seconds", "Outbound webhook request latency",
+    ["target", "service_type", "outcome"], buckets=LATENCY_BUCKETS,
+)
+DELIVERIES_IN_FLIGHT = Gauge("webhook_deliveries_in_flight", "Webhook requests currently in flight")
+DELIVERIES_DEFERRED = Counter(
+    "webhook_deliveries_deferred_total", "Deliveries deferred because the target's circuit was open", ["target"],
+)
+CIRCUIT_STATE = Gauge("webhook_circuit_state", "Circuit breaker state per target: 0 closed, 1 half-open, 2 open", ["target"])
+
+AIRTABLE_SECONDS = Histogram(
+    "airtable_request_duration_seconds", "Airtable API request latency, excluding rate limit waits",
+    ["table", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+AIRTABLE_THROTTLE_SECONDS = Histogram(
+    "airtable_throttle_wait_seconds", "Time spent waiting for an Airtable rate limit token",
+    buckets=LATENCY_BUCKETS,
+)
+AIRTABLE_RATE_LIMITED = Counter("airtable_rate_limited_total", "Airtable 429 responses")
+AIRTABLE_CACHE_HITS = Counter("airtable_cache_hits_total", "find_record lookups answered from the cache", ["table"])
+AIRTABLE_CACHE_MISSES = Counter(
+    "airtable_cache_misses_total", "find_record lookups that missed the cache or found it expired", ["table"],
+)
+
+AIRTABLE_PENDING = Gauge("airtable_pending_records", "Records buffered for the next Airtable batch")
+AIRTABLE_WAITING = Gauge("airtable_rate_limit_waiting", "Callers waiting for an Airtable rate limit token")
+
+OUTBOX_DEPTH = Gauge("event_outbox_depth", "Outbox events waiting to be claimed")
+EVENTS_IN_PROGRESS = Gauge("worker_events_in_progress", "Outbox events this worker is processing")
+RETRIES_DUE = Gauge("webhook_retries_due", "Failed or deferred deliveries whose next attempt is due")
+
+
+@lru_cache(maxsize=512)
+def statement_name(query: str) -> str:
+    """
+    Short label for a SQL statement, e.g. "select webhook_targets"
+
+    Keeps the label set small however queries are formatted or filtered.
+    """
+    words = query.split(None, 1)
+    verb = words[0].lower() if words else "unknown"
+    match = re.search(r"\b(?:FROM|INTO|UPDATE)\s+([a-z_][a-z0-9_]*)", query, re.IGNORECASE)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware recording request latency per route template
+
+    Routes are labelled by their path template (/api/webhooks/{id}) rather
+    than the raw path, so the label set stays bounded.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(
+                scope["method"], route.path if route is not None else "unmatched", str(status)
+            ).observe(time.perf_counter() - started)
+
+
+def latest() -> bytes:
+    return generate_latest()
+
+
+def serve(port: int) -> None:
+    """
+    Expose /metrics on its own port, for processes without an API server
+    """
+    start_http_server(port)
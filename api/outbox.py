@@ -0,0 +1,128 @@
+import os
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+import tracing
+
+# A claimed row whose worker died is handed out again after this long
+LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", "300"))
+
+
+def enqueue_many(cur, events: List[Tuple[str, Dict[str, Any]]]) -> int:
+    """
+    Queue several (event, payload) pairs with one multi-row insert
+    """
+    if not events:
+        return 0
+    trace_context = tracing.serialize_context()
+    execute_values(cur, """
+        INSERT INTO event_outbox (event, tracking_id, payload, trace_context)
+        VALUES %s
+    """, [(event, payload["tracking_id"], json.dumps(payload, default=str), trace_context)
+          for event, payload in events],
+        page_size=500)
+    return len(events)
+
+
+def claim_batch(cur, limit: int, lease_seconds: int = LEASE_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Claim up to `limit` unprocessed events for this worker
+
+    SKIP LOCKED lets any number of workers poll the same table without
+    blocking on or double-claiming each other's rows. The claim is a lease
+    rather than a held lock, so no transaction stays open during delivery.
+    """
+    cur.execute("""
+        UPDATE event_outbox
+        SET status = 'processing', claimed_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+        WHERE id IN (
+            SELECT id
+            FROM event_outbox
+            WHERE status = 'pending'
+               OR (status = 'processing' AND claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, event, tracking_id, payload, trace_context
+    """, (lease_seconds, limit))
+    return cur.fetchall()
+
+
+def mark_processed(cur, outbox_id: int, airtable_status: Optional[str] = None,
+                   error: Optional[str] = None, retry_delay: Optional[float] = None) -> None:
+    """
+    Record that an event's webhooks went out, along with its Airtable write
+
+    `airtable_status` is None for events without an Airtable table. A
+    'retrying' write is picked up again after `retry_delay` seconds by
+    `claim_airtable_retries`, without the webhooks being sent again.
+    """
+    cur.execute("""
+        UPDATE event_outbox
+        SET status = 'done', processed_at = CURRENT_TIMESTAMP, last_error = %s,
+            airtable_status = %s, airtable_attempts = %s,
+            airtable_next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+        WHERE id = %s
+    """, (error[:1000] if error else None, airtable_status, 1 if airtable_status else 0, retry_delay, outbox_id))
+
+
+def claim_airtable_retries(cur, limit: int, lease_seconds: int = LEASE_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Claim processed events whose failed Airtable write is due for another attempt
+
+    Like the webhook retry scheduler, claiming pushes the next attempt out
+    by the lease, so a worker that dies mid-write only delays the retry.
+    """
+    cur.execute("""
+        UPDATE event_outbox
+        SET airtable_next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+            airtable_attempts = airtable_attempts + 1
+        WHERE id IN (
+            SELECT id
+            FROM event_outbox
+            WHERE airtable_status = 'retrying' AND airtable_next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY airtable_next_attempt_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, event, tracking_id, payload, trace_context, airtable_attempts
+    """, (lease_seconds, limit))
+    return cur.fetchall()
+
+
+def mark_airtable(cur, outbox_id: int, status: str, error: Optional[str] = None,
+                  retry_delay: Optional[float] = None) -> None:
+    cur.execute("""
+        UPDATE event_outbox
+        SET airtable_status = %s, last_error = %s,
+            airtable_next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+        WHERE id = %s
+    """, (status, error[:1000] if error else None, retry_delay, outbox_id))
+
+
+def purge_processed(cur, keep_days: int, batch_size: int = 10000) -> int:
+    """
+    Delete events processed more than `keep_days` ago, in batches
+
+    Events with an Airtable write still to retry, or dead-lettered for a
+    manual replay, are kept. Returns the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        cur.execute("""
+            DELETE FROM event_outbox
+            WHERE id IN (
+                SELECT id
+                FROM event_outbox
+                WHERE status = 'done'
+                  AND processed_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                  AND COALESCE(airtable_status, '') NOT IN ('retrying', 'dead')
+                LIMIT %s
+            )
+        """, (keep_days, batch_size))
+        deleted += cur.rowcount
+        if cur.rowcount < batch_size:
+            return deleted
@@ -0,0 +1,92 @@
+import os
+import json
+import zlib
+import hashlib
+from typing import Dict, Any, NamedTuple, Optional
+
+import psycopg2
+
+# Payloads at least this large (bytes of JSON) are stored zlib-compressed
+COMPRESS_THRESHOLD = int(os.environ.get("PAYLOAD_COMPRESS_THRESHOLD", "1024"))
+COMPRESS_LEVEL = 6
+
+
+class EncodedPayload(NamedTuple):
+    """
+    An event payload serialized once and shared by all of its deliveries
+
+    `body` is the exact JSON sent to webhook targets, and `hash` its
+    SHA-256, which keys the stored copy in event_payloads.
+    """
+    hash: str
+    body: bytes
+
+
+def encode(payload: Dict[str, Any]) -> EncodedPayload:
+    # Sorted keys and compact separators make equal payloads hash equally
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return EncodedPayload(hashlib.sha256(body).hexdigest(), body)
+
+
+def store(cur, encoded: EncodedPayload) -> None:
+    """
+    Save a payload unless an identical one is already stored
+    """
+    if len(encoded.body) >= COMPRESS_THRESHOLD:
+        encoding, data = "zlib", zlib.compress(encoded.body, COMPRESS_LEVEL)
+    else:
+        encoding, data = "identity", encoded.body
+
+    cur.execute("""
+        INSERT INTO event_payloads (hash, encoding, body, size)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (hash) DO NOTHING
+    """, (encoded.hash, encoding, psycopg2.Binary(data), len(encoded.body)))
+
+
+def decode_body(encoding: str, data) -> bytes:
+    data = bytes(data)
+    return zlib.decompress(data) if encoding == "zlib" else data
+
+
+def from_row(row: Dict[str, Any]) -> Optional[EncodedPayload]:
+    """
+    Rebuild a delivery's payload from a row joined to event_payloads
+
+    Expects `payload_hash`, `payload_encoding` and `payload_body` columns.
+    Deliveries written before payloads were stored separately still carry
+    their own `payload` and are re-encoded from that.
+    """
+    if row.get("payload_hash") and row.get("payload_body") is not None:
+        return EncodedPayload(row["payload_hash"], decode_body(row["payload_encoding"], row["payload_body"]))
+    if row.get("payload") is not None:
+        return encode(row["payload"])
+    return None
+
+
+def resolve(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace the stored-payload columns of a row with the decoded `payload`
+    """
+    encoded = from_row(row)
+    row["payload"] = json.loads(encoded.body) if encoded else None
+    for key in ("payload_hash", "payload_encoding", "payload_body"):
+        row.pop(key, None)
+    return row
+
+
+# Joins a delivery (aliased d) to its stored payload (aliased p)
+PAYLOAD_COLUMNS = "d.payload, d.payload_hash, p.encoding AS payload_encoding, p.body AS payload_body"
+PAYLOAD_JOIN = "LEFT JOIN event_payloads p ON p.hash = d.payload_hash"
+
+
+def delete_orphans(cur, older_than_days: int) -> int:
+    """
+    Delete stored payloads no delivery refers to any more
+    """
+    cur.execute("""
+        DELETE FROM event_payloads p
+        WHERE p.created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+          AND NOT EXISTS (SELECT 1 FROM webhook_deliveries d WHERE d.payload_hash = p.hash)
+    """, (older_than_days,))
+    return cur.rowcount
@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Any, Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every caller in this process
+
+    `acquire` blocks until a token is available instead of failing, and
+    `pause` stops handing out tokens for a while, e.g. after a 429.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+        self._waiting = 0
+        self._acquired = 0
+        self._throttled_seconds = 0.0
+
+    def acquire(self) -> float:
+        """
+        Take one token, sleeping as long as needed. Returns the time spent waiting.
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                delay = self._try_take()
+                if delay <= 0:
+                    break
+                time.sleep(delay)
+        finally:
+            waited = time.monotonic() - started
+            with self._lock:
+                self._waiting -= 1
+                self._acquired += 1
+                self._throttled_seconds += waited
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "queue_depth": self._waiting,
+                "acquired": self._acquired,
+                "throttled_seconds": round(self._throttled_seconds, 3),
+            }
+
+    def _try_take(self) -> float:
+        # Returns 0 when a token was taken, otherwise how long to sleep
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in a local SQLite file
+
+    Lets several worker processes on one host share a single Airtable
+    budget. Each take is one short IMMEDIATE transaction, which SQLite
+    serializes across processes.
+    """
+    def __init__(self, path: str, key: str, rate: float, capacity: Optional[float] = None):
+        super().__init__(rate, capacity)
+        self.path = path
+        self.key = key
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS token_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                paused_until REAL NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute(
+            "INSERT OR IGNORE INTO token_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+            (self.key, self.capacity, time.time())
+        )
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def pause(self, seconds: float) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE token_buckets SET tokens = 0, paused_until = MAX(paused_until, ?) WHERE key = ?",
+                (time.time() + seconds, self.key)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _try_take(self) -> float:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated_at, paused_until = conn.execute(
+                "SELECT tokens, updated_at, paused_until FROM token_buckets WHERE key = ?", (self.key,)
+            ).fetchone()
+            now = time.time()
+
+            if now < paused_until:
+                conn.execute("COMMIT")
+                return paused_until - now
+
+            tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+            delay = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                delay = (1 - tokens) / self.rate
+
+            conn.execute(
+                "UPDATE token_buckets SET tokens = ?, updated_at = ? WHERE key = ?",
+                (tokens, now, self.key)
+            )
+            conn.execute("COMMIT")
+            return delay
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(key: str, rate: float, path: Optional[str] = None) -> TokenBucket:
+    """
+    Return the process-wide bucket for `key`, creating it on first use
+
+    When `path` (or RATE_LIMIT_DB) is set the bucket is backed by that
+    SQLite file and shared with other processes using the same file.
+    """
+    path = path if path is not None else os.environ.get("RATE_LIMIT_DB")
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = SQLiteTokenBucket(path, key, rate) if path else TokenBucket(rate)
+            _buckets[key] = bucket
+        return bucket
@@ -0,0 +1,239 @@
+import os
+import json
+import gzip
+import logging
+import argparse
+from datetime import date
+from typing import Dict, List, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import idempotency
+import logs
+import outbox
+import payloads
+import schema
+
+logger = logging.getLogger("delivery-retention")
+
+# Rows fetched per round trip while archiving a partition
+ARCHIVE_FETCH_SIZE = 5000
+
+# Unreferenced stored payloads younger than this are kept, since a payload
+# is stored just before the deliveries that refer to it are written
+ORPHAN_PAYLOAD_GRACE_DAYS = 1
+
+
+def expired_partitions(cur, keep_months: int) -> List[Tuple[str, date]]:
+    """
+    Partitions whose rows are all older than the last `keep_months` months
+    """
+    cutoff = schema.month_start(date.today(), -keep_months)
+    return [(name, upper) for name, upper in schema.list_partitions(cur)
+            if upper is not None and upper <= cutoff]
+
+
+def _write_jsonl(rows, path: str) -> int:
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, default=str))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def partition_columns(cur, name: str) -> List[Tuple[str, str]]:
+    """
+    (column, Postgres type) pairs of a partition, in table order
+    """
+    cur.execute("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+    """, (name,))
+    return [(row["column_name"], row["data_type"]) for row in cur.fetchall()]
+
+
+def _arrow_schema(pa, columns: List[Tuple[str, str]]):
+    # Anything not listed here (text, varchar, JSON) is archived as a string
+    types: Dict[str, object] = {
+        "smallint": pa.int16(),
+        "integer": pa.int32(),
+        "bigint": pa.int64(),
+        "real": pa.float32(),
+        "double precision": pa.float64(),
+        "boolean": pa.bool_(),
+        "date": pa.date32(),
+        "timestamp without time zone": pa.timestamp("us"),
+        "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([
+        (column, types.get(data_type, pa.string()))
+        for column, data_type in columns
+        # Archived rows carry the decoded payload instead of its hash
+        if column != "payload_hash"
+    ])
+
+
+def _write_parquet(rows, path: str, columns: List[Tuple[str, str]]) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet archives need pyarrow (pip install pyarrow)")
+
+    # One schema for every chunk, taken from the table rather than inferred
+    # from the data, so a column that is all NULL in the first chunk does
+    # not end up typed as null
+    schema = _arrow_schema(pa, columns)
+    text_columns = [field.name for field in schema if pa.types.is_string(field.type)]
+
+    count = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        chunk = []
+        for row in rows:
+            row = dict(row)
+            for column in text_columns:
+                value = row.get(column)
+                if value is not None and not isinstance(value, str):
+                    row[column] = json.dumps(value, default=str)
+            chunk.append(row)
+            if len(chunk) >= ARCHIVE_FETCH_SIZE:
+                writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            count += len(chunk)
+    return count
+
+
+def archive_partition(conn, name: str, archive_dir: str, fmt: str) -> str:
+    """
+    Stream one partition to a file in `archive_dir` and return its path
+
+    Rows are read through a server-side cursor, so memory use stays flat
+    however large the partition is. The file is written under a temporary
+    name and only renamed into place once complete.
+    """
+    extension = "jsonl.gz" if fmt == "jsonl" else "parquet"
+    path = os.path.join(archive_dir, f"{name}.{extension}")
+    tmp_path = f"{path}.tmp"
+
+    with conn.cursor() as cur:
+        columns = partition_columns(cur, name)
+
+    with conn.cursor(name=f"archive_{name}", cursor_factory=RealDictCursor) as cur:
+        cur.itersize = ARCHIVE_FETCH_SIZE
+        cur.execute(f"""
+            SELECT d.*, p.encoding AS payload_encoding, p.body AS payload_body
+            FROM {name} d
+            {payloads.PAYLOAD_JOIN}
+            ORDER BY d.created_at, d.id
+        """)
+        rows = (payloads.resolve(dict(row)) for row in cur)
+        if fmt == "jsonl":
+            count = _write_jsonl(rows, tmp_path)
+        else:
+            count = _write_parquet(rows, tmp_path, columns)
+    conn.commit()
+
+    os.replace(tmp_path, path)
+    logger.info("Archived %s deliveries from %s to %s", count, name, path)
+    return path
+
+
+def drop_partition(conn, name: str) -> None:
+    """
+    Detach and drop a partition without blocking writes to the parent
+
+    On PostgreSQL 14 and later the partition is detached CONCURRENTLY, which
+    only takes a SHARE UPDATE EXCLUSIVE lock on webhook_deliveries, so the
+    API and worker keep inserting deliveries while it runs. That form
+    cannot run inside a transaction, and a detach interrupted half way is
+    finished with FINALIZE on the next run.
+    """
+    conn.commit()
+    if conn.server_version < 140000:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE webhook_deliveries DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+        conn.commit()
+        logger.info("Dropped partition %s", name)
+        return
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = %s::regclass", (name,))
+            row = cur.fetchone()
+            if row and row["inhdetachpending"]:
+                cur.execute(f"ALTER TABLE webhook_deliveries DETACH PARTITION {name} FINALIZE")
+            elif row:
+                cur.execute(f"ALTER TABLE webhook_deliveries DETACH PARTITION {name} CONCURRENTLY")
+            cur.execute(f"DROP TABLE {name}")
+    finally:
+        conn.autocommit = False
+    logger.info("Dropped partition %s", name)
+
+
+def run_retention(dsn: str, keep_months: int, archive_dir: str = None, fmt: str = "jsonl",
+                  dry_run: bool = False, outbox_keep_days: int = 7) -> None:
+    conn = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    try:
+        with conn.cursor() as cur:
+            schema.ensure_partitions(cur)
+            expired = expired_partitions(cur, keep_months)
+        conn.commit()
+
+        if not expired:
+            logger.info("No webhook delivery partitions older than %s months", keep_months)
+
+        for name, upper in expired:
+            if dry_run:
+                logger.info("Would archive and drop %s (rows before %s)", name, upper)
+                continue
+            if archive_dir:
+                archive_partition(conn, name, archive_dir, fmt)
+            drop_partition(conn, name)
+
+        if not dry_run:
+            with conn.cursor() as cur:
+                deleted = payloads.delete_orphans(cur, ORPHAN_PAYLOAD_GRACE_DAYS)
+                expired_keys = idempotency.delete_expired(cur)
+                purged = outbox.purge_processed(cur, outbox_keep_days)
+            conn.commit()
+            logger.info("Deleted %s stored payloads no longer referenced by any delivery", deleted)
+            logger.info("Deleted %s expired idempotency keys", expired_keys)
+            logger.info("Deleted %s outbox events processed more than %s days ago", purged, outbox_keep_days)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and drop old webhook delivery partitions")
+    parser.add_argument("--keep-months", type=int, default=int(os.environ.get("DELIVERY_RETENTION_MONTHS", "6")),
+                        help="Months of deliveries to keep in the database")
+    parser.add_argument("--archive-dir", default=os.environ.get("DELIVERY_ARCHIVE_DIR"),
+                        help="Write each expired partition here before dropping it (omit to drop without archiving)")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl",
+                        help="Archive format; parquet needs pyarrow")
+    parser.add_argument("--outbox-keep-days", type=int, default=int(os.environ.get("OUTBOX_RETENTION_DAYS", "7")),
+                        help="Days to keep processed outbox events (failed Airtable writes are kept)")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the partitions that would be dropped")
+    args = parser.parse_args()
+
+    dsn = os.environ.get("DATABASE_URL")
+    if not dsn:
+        parser.error("DATABASE_URL is not set")
+    if args.archive_dir:
+        os.makedirs(args.archive_dir, exist_ok=True)
+
+    logs.setup()
+    try:
+        run_retention(dsn, args.keep_months, args.archive_dir, args.format, args.dry_run, args.outbox_keep_days)
+    finally:
+        logs.shutdown()
@@ -0,0 +1,98 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Any, List
+
+import db
+import delivery
+import payloads
+
+logger = logging.getLogger("retry-scheduler")
+
+# A claimed retry whose worker died becomes due again after this long
+LEASE_SECONDS = int(os.environ.get("RETRY_LEASE_SECONDS", "300"))
+
+
+def claim_due_retries(cur, limit: int, lease_seconds: int = LEASE_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Claim deliveries whose next attempt is due, along with their target
+
+    Claiming pushes next_attempt_at out by the lease instead of holding a
+    lock, so other schedulers skip the rows while this one works on them.
+    """
+    cur.execute("""
+        WITH due AS (
+            SELECT id
+            FROM webhook_deliveries
+            WHERE status IN ('retrying', 'deferred') AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY next_attempt_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), claimed AS (
+            UPDATE webhook_deliveries d
+            SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            FROM due
+            WHERE d.id = due.id
+            RETURNING d.id, d.webhook_id, d.event, d.payload, d.payload_hash
+        )
+        SELECT c.id, c.webhook_id, c.event, c.payload, c.payload_hash,
+               p.encoding AS payload_encoding, p.body AS payload_body,
+               w.url, w.service_type, w.auth_header, w.timeout_seconds, w.max_concurrency, w.is_active
+        FROM claimed c
+        JOIN webhook_targets w ON c.webhook_id = w.id
+        LEFT JOIN event_payloads p ON p.hash = c.payload_hash
+    """, (limit, lease_seconds))
+    return cur.fetchall()
+
+
+def _dead_letter(cur, delivery_id: int, reason: str) -> None:
+    cur.execute("""
+        UPDATE webhook_deliveries
+        SET status = 'dead', next_attempt_at = NULL, response_body = %s
+        WHERE id = %s
+    """, (reason, delivery_id))
+
+
+async def _retry(row: Dict[str, Any]) -> None:
+    if not row["is_active"]:
+        await db.run(_dead_letter, row["id"], "Webhook target is inactive")
+        return
+
+    payload = payloads.from_row(row)
+    if payload is None:
+        await db.run(_dead_letter, row["id"], "Stored payload is missing")
+        return
+
+    webhook = {
+        "id": row["webhook_id"],
+        "url": row["url"],
+        "service_type": row["service_type"],
+        "auth_header": row["auth_header"],
+        "timeout_seconds": row["timeout_seconds"],
+        "max_concurrency": row["max_concurrency"],
+    }
+    await delivery.send_webhook(webhook, row["event"], payload, delivery_id=row["id"])
+
+
+async def run_retry_scheduler(stop: asyncio.Event, batch_size: int, poll_interval: float) -> None:
+    """
+    Re-attempt failed and deferred deliveries as they come due until `stop` is set
+    """
+    logger.info("Retry scheduler started (max_attempts=%s)", delivery.MAX_ATTEMPTS)
+
+    while not stop.is_set():
+        try:
+            rows = await db.run(claim_due_retries, batch_size)
+        except Exception as e:
+            logger.error("Error claiming due webhook retries: %s", e)
+            rows = []
+
+        if rows:
+            logger.info("Retrying %s webhook deliveries", len(rows))
+            await asyncio.gather(*(_retry(row) for row in rows), return_exceptions=True)
+            continue
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
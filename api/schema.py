@@ -0,0 +1,318 @@
+import os
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+
+# Months of webhook_deliveries partitions created ahead of the current one
+PARTITION_MONTHS_AHEAD = int(os.environ.get("DELIVERY_PARTITION_MONTHS_AHEAD", "3"))
+
+# Arbitrary key for the advisory lock that serializes schema changes
+# between the API and worker processes starting at the same time
+SCHEMA_LOCK_KEY = 727001
+
+
+def create_tables(cur) -> None:
+    """
+    Create the webhook tables and bring older installs up to date
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+
+    # Create webhook tables if they don't exist
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_targets (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            url TEXT NOT NULL,
+            service_type VARCHAR(100) NOT NULL,
+            auth_header TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            events JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Delivery limits added after the table was first created
+    cur.execute("""
+        ALTER TABLE webhook_targets
+            ADD COLUMN IF NOT EXISTS timeout_seconds REAL,
+            ADD COLUMN IF NOT EXISTS max_concurrency INTEGER
+    """)
+
+    # Range-partitioned by month on created_at, so hot queries and vacuum
+    # only touch recent partitions and old months can be detached whole
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_deliveries (
+            id SERIAL,
+            webhook_id INTEGER REFERENCES webhook_targets(id),
+            event VARCHAR(100) NOT NULL,
+            payload JSONB,
+            response_status INTEGER,
+            response_body TEXT,
+            attempts INTEGER DEFAULT 0,
+            success BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    # Retry scheduling. Rows from before this existed keep a NULL status
+    # so old failures are not all retried at once after an upgrade.
+    cur.execute("""
+        ALTER TABLE webhook_deliveries
+            ADD COLUMN IF NOT EXISTS status VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS last_attempt_at TIMESTAMP
+    """)
+    cur.execute("ALTER TABLE webhook_deliveries ALTER COLUMN status SET DEFAULT 'pending'")
+
+    # Event payloads stored once per distinct payload rather than once per
+    # delivery; the inline payload column is only set on older rows
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS event_payloads (
+            hash CHAR(64) PRIMARY KEY,
+            encoding VARCHAR(10) NOT NULL,
+            body BYTEA NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("ALTER TABLE webhook_deliveries ADD COLUMN IF NOT EXISTS payload_hash CHAR(64)")
+    cur.execute("ALTER TABLE webhook_deliveries ALTER COLUMN payload DROP NOT NULL")
+
+    _partition_deliveries(cur)
+    ensure_partitions(cur)
+
+    # Only rows waiting for a retry (or deferred by an open circuit) are
+    # indexed, so the scheduler's due-row lookup stays a short index range
+    # scan however large the table grows
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_deliveries_scheduled_idx
+        ON webhook_deliveries (next_attempt_at)
+        WHERE status IN ('retrying', 'deferred')
+    """)
+    cur.execute("DROP INDEX IF EXISTS webhook_deliveries_next_attempt_idx")
+
+    # Circuit breaker state per target, shared by the worker processes
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_circuit_state (
+            webhook_id INTEGER PRIMARY KEY REFERENCES webhook_targets(id) ON DELETE CASCADE,
+            state VARCHAR(20) NOT NULL,
+            trips INTEGER NOT NULL DEFAULT 0,
+            error_rate REAL,
+            slow_rate REAL,
+            open_until TIMESTAMP,
+            failing_since TIMESTAMP,
+            disabled_at TIMESTAMP,
+            version BIGINT NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Events waiting for the delivery worker
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS event_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            event VARCHAR(100) NOT NULL,
+            tracking_id VARCHAR(64) NOT NULL,
+            payload JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            processed_at TIMESTAMP
+        )
+    """)
+
+    # W3C trace context of the request that queued the event, so the
+    # worker's spans join the request's trace
+    cur.execute("ALTER TABLE event_outbox ADD COLUMN IF NOT EXISTS trace_context TEXT")
+
+    # Airtable writes are retried separately from the webhook fan-out
+    cur.execute("""
+        ALTER TABLE event_outbox
+            ADD COLUMN IF NOT EXISTS airtable_status VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS airtable_attempts INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS airtable_next_attempt_at TIMESTAMP
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS event_outbox_airtable_retry_idx
+        ON event_outbox (airtable_next_attempt_at)
+        WHERE airtable_status = 'retrying'
+    """)
+
+    # Lets the retention job find old processed events without a full scan
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS event_outbox_processed_idx
+        ON event_outbox (processed_at)
+        WHERE status = 'done'
+    """)
+
+    # Keeps the worker's claim query an index scan over unfinished rows only
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS event_outbox_unfinished_idx
+        ON event_outbox (id)
+        WHERE status IN ('pending', 'processing')
+    """)
+
+    # Submissions already accepted, so repeats return the original tracking ID
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key CHAR(64) PRIMARY KEY,
+            tracking_id VARCHAR(64) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idempotency_keys_expires_idx
+        ON idempotency_keys (expires_at)
+    """)
+
+    # Composite indexes for the admin delivery listing. Each matches one
+    # filter plus the (created_at, id) keyset order, so a page is a range
+    # scan instead of a full scan and sort.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_deliveries_created_idx
+        ON webhook_deliveries (created_at DESC, id DESC)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_deliveries_event_created_idx
+        ON webhook_deliveries (event, created_at DESC, id DESC)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_deliveries_webhook_created_idx
+        ON webhook_deliveries (webhook_id, created_at DESC, id DESC)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_deliveries_success_created_idx
+        ON webhook_deliveries (success, created_at DESC, id DESC)
+    """)
+
+    # Lets retention find stored payloads no delivery refers to
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_deliveries_payload_hash_idx
+        ON webhook_deliveries (payload_hash)
+    """)
+
+
+def month_start(day: date, months: int = 0) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"webhook_deliveries_p{month:%Y%m}"
+
+
+def ensure_partitions(cur, months_ahead: int = PARTITION_MONTHS_AHEAD) -> None:
+    """
+    Create monthly webhook_deliveries partitions from the current month
+    through `months_ahead` months from now
+    """
+    # Months already covered by a converted legacy table are skipped
+    cur.execute("""
+        SELECT max(upper_bound) AS covered_until FROM (
+            SELECT substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \\(''([^'']+)''\\)')::timestamp AS upper_bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'webhook_deliveries'::regclass
+        ) bounds
+    """)
+    covered_until = cur.fetchone()["covered_until"]
+
+    this_month = month_start(date.today())
+    for offset in range(months_ahead + 1):
+        start = month_start(this_month, offset)
+        end = month_start(this_month, offset + 1)
+        if covered_until is not None and end <= covered_until.date():
+            continue
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(start)}
+            PARTITION OF webhook_deliveries
+            FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+        """)
+
+
+def list_partitions(cur) -> List[Tuple[str, Optional[date]]]:
+    """
+    Return (name, exclusive upper bound) for each webhook_deliveries partition
+    """
+    cur.execute("""
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'webhook_deliveries'::regclass
+        ORDER BY c.relname
+    """)
+    partitions = []
+    for row in cur.fetchall():
+        match = re.search(r"TO \('([^']+)'\)", row["bound"])
+        partitions.append((row["name"], date.fromisoformat(match.group(1)[:10]) if match else None))
+    return partitions
+
+
+def _partition_deliveries(cur) -> None:
+    """
+    Convert a pre-partitioning webhook_deliveries table in place
+
+    The old table is attached as a single partition covering everything up
+    to the end of the current month, so no rows are copied. Monthly
+    partitions take over from there, and the retention job can later
+    archive the old table like any other partition.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('webhook_deliveries')")
+    if cur.fetchone()["relkind"] == "p":
+        return
+
+    cur.execute("ALTER TABLE webhook_deliveries RENAME TO webhook_deliveries_legacy")
+    # The id sequence must outlive the old table if it ends up dropped
+    cur.execute("ALTER SEQUENCE webhook_deliveries_id_seq OWNED BY NONE")
+
+    # The partitioned table's indexes are recreated on the old table when it
+    # is attached, so drop the old copies. The old PRIMARY KEY (id) has to
+    # go too: attaching adds the parent's (id, created_at) key, and a table
+    # cannot have two.
+    cur.execute("""
+        SELECT i.indexname, c.conname, c.contype
+        FROM pg_indexes i
+        LEFT JOIN pg_constraint c
+            ON c.conname = i.indexname AND c.conrelid = 'webhook_deliveries_legacy'::regclass
+        WHERE i.tablename = 'webhook_deliveries_legacy' AND i.schemaname = current_schema()
+    """)
+    for row in cur.fetchall():
+        if row["contype"] == "p":
+            cur.execute(f"ALTER TABLE webhook_deliveries_legacy DROP CONSTRAINT {row['conname']}")
+        elif row["conname"] is not None:
+            cur.execute(f"ALTER INDEX {row['indexname']} RENAME TO {row['indexname']}_legacy")
+        else:
+            cur.execute(f"DROP INDEX {row['indexname']}")
+
+    cur.execute("""
+        CREATE TABLE webhook_deliveries (LIKE webhook_deliveries_legacy INCLUDING DEFAULTS)
+        PARTITION BY RANGE (created_at)
+    """)
+    cur.execute("ALTER TABLE webhook_deliveries ALTER COLUMN created_at SET NOT NULL")
+    cur.execute("ALTER TABLE webhook_deliveries ADD PRIMARY KEY (id, created_at)")
+    cur.execute("""
+        ALTER TABLE webhook_deliveries
+        ADD FOREIGN KEY (webhook_id) REFERENCES webhook_targets(id)
+    """)
+    cur.execute("ALTER SEQUENCE webhook_deliveries_id_seq OWNED BY webhook_deliveries.id")
+
+    cur.execute("SELECT count(*) AS rows, max(created_at) AS newest FROM webhook_deliveries_legacy")
+    legacy = cur.fetchone()
+    if not legacy["rows"]:
+        cur.execute("DROP TABLE webhook_deliveries_legacy")
+        return
+
+    cur.execute("UPDATE webhook_deliveries_legacy SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    cur.execute("ALTER TABLE webhook_deliveries_legacy ALTER COLUMN created_at SET NOT NULL")
+
+    newest = legacy["newest"].date() if legacy["newest"] else date.today()
+    upper = month_start(max(newest, date.today()), 1)
+    cur.execute(f"""
+        ALTER TABLE webhook_deliveries ATTACH PARTITION webhook_deliveries_legacy
+        FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat()}')
+    """)
@@ -1,4 +1,10 @@
 #!/bin/bash
 
+# Start the delivery worker. Queued events only reach Airtable and the
+# registered webhooks while it runs, so stop it together with the server.
+python worker.py &
+WORKER_PID=$!
+trap 'kill $WORKER_PID 2>/dev/null; wait $WORKER_PID' EXIT
+
 # Start the FastAPI server with uvicorn
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
+uvicorn main:app --host 0.0.0.0 --port 8000 --reload
@@ -0,0 +1,136 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional
+
+import psycopg2
+
+import db
+
+logger = logging.getLogger("webhook-subscriptions")
+
+# Postgres channel notified whenever webhook_targets changes
+CHANNEL = "webhook_targets_changed"
+
+# Upper bound on staleness if a notification is ever missed
+TTL_SECONDS = float(os.environ.get("SUBSCRIPTION_CACHE_TTL", "60"))
+
+
+def notify_changed(cur, webhook_id: Optional[int] = None) -> None:
+    """
+    Tell every process holding a SubscriptionIndex to reload once this commits
+    """
+    cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, str(webhook_id or "")))
+
+
+class SubscriptionIndex:
+    """
+    In-process event type -> active webhook targets index
+
+    Routing an event is a dict lookup. The index reloads from
+    webhook_targets when it is invalidated by a NOTIFY on CHANNEL or when
+    it is older than the TTL.
+    """
+    def __init__(self, ttl: float = TTL_SECONDS):
+        self.ttl = ttl
+        self._by_event: Dict[str, List[Dict[str, Any]]] = {}
+        self._loaded_at: Optional[float] = None
+        self._generation = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+        self._generation += 1
+
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def targets_for(self, event: str) -> List[Dict[str, Any]]:
+        if not self.is_fresh():
+            await self.refresh()
+        return self._by_event.get(event, [])
+
+    async def refresh(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            # Another caller may have reloaded while we waited for the lock
+            if self.is_fresh():
+                return
+
+            generation = self._generation
+            loaded_at = time.monotonic()
+            rows = await db.fetch_all("""
+                SELECT id, url, service_type, auth_header, timeout_seconds, max_concurrency, events
+                FROM webhook_targets
+                WHERE is_active = TRUE
+            """)
+
+            by_event: Dict[str, List[Dict[str, Any]]] = {}
+            for row in rows:
+                events = row.pop("events") or []
+                for event in events:
+                    by_event.setdefault(event, []).append(row)
+
+            self._by_event = by_event
+            # A change notified mid-load may not be in this copy, so leave
+            # the index stale and let the next lookup load it again
+            if generation == self._generation:
+                self._loaded_at = loaded_at
+            logger.info("Subscription index loaded: %s targets, %s event types", len(rows), len(by_event))
+
+
+index = SubscriptionIndex()
+
+
+def _connect_listener(dsn: str):
+    conn = psycopg2.connect(dsn)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {CHANNEL}")
+    cur.close()
+    return conn
+
+
+async def listen_for_changes(stop: asyncio.Event, reconnect_delay: float = 5) -> None:
+    """
+    Invalidate the index whenever webhook_targets changes, until `stop` is set
+
+    Uses a dedicated connection outside the pool, since LISTEN only works
+    on a connection that stays open and idle.
+    """
+    loop = asyncio.get_running_loop()
+
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = await asyncio.to_thread(_connect_listener, db.get_pool().dsn)
+            ready = asyncio.Event()
+            loop.add_reader(conn.fileno(), ready.set)
+            # Anything may have changed while we were not listening
+            index.invalidate()
+            logger.info("Listening for %s notifications", CHANNEL)
+
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(ready.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+                ready.clear()
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    index.invalidate()
+        except Exception as e:
+            logger.warning("Subscription listener error, reconnecting: %s", e)
+            index.invalidate()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=reconnect_delay)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            if conn is not None and not conn.closed:
+                loop.remove_reader(conn.fileno())
+                conn.close()
@@ -0,0 +1,45 @@
+import pytest
+
+from airtable_connector import AirtableConnector
+
+
+@pytest.fixture
+def connector():
+    connector = AirtableConnector(api_key="key", base_id="appTest")
+    connector.lookups = 0
+
+    def get_records(table_name, formula=None, max_records=None):
+        connector.lookups += 1
+        return connector.records
+
+    connector.get_records = get_records
+    return connector
+
+
+def test_find_record_is_cached(connector):
+    connector.records = [{"id": "rec1"}]
+    assert connector.find_record("Leads", "Email", "ana@example.com") == {"id": "rec1"}
+    assert connector.find_record("Leads", "Email", "ana@example.com") == {"id": "rec1"}
+    assert connector.lookups == 1
+
+
+def test_write_invalidates_the_table(connector):
+    connector.records = []
+    assert connector.find_record("Leads", "Email", "ana@example.com") is None
+    connector._invalidate_find_cache("Leads")
+    connector.records = [{"id": "rec1"}]
+    assert connector.find_record("Leads", "Email", "ana@example.com") == {"id": "rec1"}
+
+
+def test_lookup_overlapping_a_write_is_not_cached(connector):
+    def get_records(table_name, formula=None, max_records=None):
+        connector.lookups += 1
+        if connector.lookups == 1:
+            # The record is created while the first lookup is in flight
+            connector._invalidate_find_cache("Leads")
+            return []
+        return [{"id": "rec1"}]
+
+    connector.get_records = get_records
+    assert connector.find_record("Leads", "Email", "ana@example.com") is None
+    assert connector.find_record("Leads", "Email", "ana@example.com") == {"id": "rec1"}
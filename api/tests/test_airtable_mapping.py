@@ -0,0 +1,42 @@
+import pytest
+
+from airtable_mapping import FieldMapper, MappingError, build_mappers
+
+
+def table(name, fields):
+    return {"name": name, "fields": [{"name": field} for field in fields]}
+
+
+@pytest.fixture
+def mapper():
+    return build_mappers()["lead.created"]
+
+
+def test_maps_and_transforms_fields(mapper):
+    fields = mapper({"email": "ana@example.com", "phone": None, "tags": ["villa", "golf"], "form_data": {}})
+    assert fields == {"Email": "ana@example.com", "Tags": "villa, golf"}
+
+
+def test_missing_table_raises(mapper):
+    mapper.validate([table("Bookings", ["Email"])])
+    with pytest.raises(MappingError, match="does not exist"):
+        mapper({"email": "ana@example.com"})
+
+
+def test_missing_fields_raise(mapper):
+    known = [name for name, _, _ in mapper.spec if name != "Budget"]
+    mapper.validate([table("Leads", known)])
+    assert mapper.unknown_fields == ["Budget"]
+    with pytest.raises(MappingError, match="Budget"):
+        mapper({"email": "ana@example.com"})
+
+
+def test_revalidating_a_fixed_table_recovers(mapper):
+    mapper.validate([table("Leads", ["Email"])])
+    mapper.validate([table("Leads", [name for name, _, _ in mapper.spec])])
+    assert mapper({"email": "ana@example.com"}) == {"Email": "ana@example.com"}
+
+
+def test_custom_spec():
+    mapper = FieldMapper("Contacts", [("Name", "name", str.upper)])
+    assert mapper({"name": "ana"}) == {"Name": "ANA"}
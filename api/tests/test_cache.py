@@ -0,0 +1,70 @@
+import pytest
+
+import cache
+from cache import TTLCache, MISSING
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(cache, "time", clock)
+
+
+def test_get_returns_missing_until_set():
+    c = TTLCache(maxsize=10, ttl=60)
+    assert c.get("a") is MISSING
+    c.set("a", None)
+    # None is a value like any other
+    assert c.get("a") is None
+
+
+def test_entries_expire_after_ttl(clock):
+    c = TTLCache(maxsize=10, ttl=60)
+    c.set("a", 1)
+    clock.advance(59)
+    assert c.get("a") == 1
+    clock.advance(1)
+    assert c.get("a") is MISSING
+    assert c.stats()["expirations"] == 1
+    assert c.stats()["size"] == 0
+
+
+def test_per_entry_ttl(clock):
+    c = TTLCache(maxsize=10, ttl=60)
+    c.set("short", 1, ttl=5)
+    c.set("long", 2)
+    clock.advance(5)
+    assert c.get("short") is MISSING
+    assert c.get("long") == 2
+
+
+def test_evicts_least_recently_used():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")
+    c.set("c", 3)
+    assert c.get("b") is MISSING
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    assert c.stats()["evictions"] == 1
+
+
+def test_invalidate_drops_matching_keys():
+    c = TTLCache(maxsize=10, ttl=60)
+    c.set(("Leads", "Email", "a"), 1)
+    c.set(("Leads", "Email", "b"), 2)
+    c.set(("Bookings", "Email", "a"), 3)
+    assert c.invalidate(lambda key: key[0] == "Leads") == 2
+    assert c.get(("Bookings", "Email", "a")) == 3
+
+
+def test_stats_count_hits_and_misses():
+    c = TTLCache(maxsize=10, ttl=60)
+    assert c.stats()["hit_rate"] is None
+    c.set("a", 1)
+    c.get("a")
+    c.get("a")
+    c.get("b")
+    stats = c.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hit_rate"] == 0.6667
@@ -0,0 +1,188 @@
+import pytest
+
+import circuits
+
+
+@pytest.fixture(autouse=True)
+def policy(monkeypatch, clock):
+    monkeypatch.setattr(circuits, "time", clock)
+    monkeypatch.setattr(circuits, "WINDOW_SECONDS", 60.0)
+    monkeypatch.setattr(circuits, "MIN_REQUESTS", 4)
+    monkeypatch.setattr(circuits, "ERROR_RATE", 0.5)
+    monkeypatch.setattr(circuits, "SLOW_SECONDS", 5.0)
+    monkeypatch.setattr(circuits, "SLOW_RATE", 0.8)
+    monkeypatch.setattr(circuits, "OPEN_SECONDS", 30.0)
+    monkeypatch.setattr(circuits, "MAX_OPEN_SECONDS", 100.0)
+    monkeypatch.setattr(circuits, "PROBE_TIMEOUT", 60.0)
+    monkeypatch.setattr(circuits, "AUTO_DISABLE_SECONDS", 0.0)
+
+
+def trip(breaker):
+    for _ in range(circuits.MIN_REQUESTS):
+        breaker.record(False, 0.1)
+    assert breaker.state == circuits.OPEN
+
+
+def test_stays_closed_below_min_requests():
+    breaker = circuits.Breaker(1)
+    for _ in range(circuits.MIN_REQUESTS - 1):
+        assert breaker.record(False, 0.1) is False
+    assert breaker.state == circuits.CLOSED
+    assert breaker.allow()
+
+
+def test_opens_on_error_rate():
+    breaker = circuits.Breaker(1)
+    breaker.record(True, 0.1)
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.record(False, 0.1) is True
+    assert breaker.state == circuits.OPEN
+    assert breaker.error_rate == 0.5
+    assert breaker.trips == 1
+    assert not breaker.allow()
+
+
+def test_opens_on_slow_rate_even_when_calls_succeed():
+    breaker = circuits.Breaker(1)
+    for _ in range(circuits.MIN_REQUESTS):
+        breaker.record(True, 6.0)
+    assert breaker.state == circuits.OPEN
+    assert breaker.slow_rate == 1.0
+
+
+def test_old_outcomes_leave_the_window(clock):
+    breaker = circuits.Breaker(1)
+    for _ in range(3):
+        breaker.record(False, 0.1)
+    clock.advance(61)
+    for _ in range(3):
+        breaker.record(True, 0.1)
+    # Only the three recent successes count; still short of MIN_REQUESTS
+    assert breaker.state == circuits.CLOSED
+    assert breaker.record(False, 0.1) is False
+    assert breaker.error_rate == 0.25
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = circuits.Breaker(1)
+    trip(breaker)
+    assert breaker.retry_delay() == 30.0
+
+    clock.advance(30)
+    assert breaker.allow()
+    assert breaker.state == circuits.HALF_OPEN
+    assert not breaker.allow()
+
+    # A probe that never reports back is given up on
+    clock.advance(60)
+    assert breaker.allow()
+
+
+def test_successful_probe_closes(clock):
+    breaker = circuits.Breaker(1)
+    trip(breaker)
+    clock.advance(30)
+    assert breaker.allow()
+
+    assert breaker.record(True, 0.1) is True
+    assert breaker.state == circuits.CLOSED
+    assert breaker.trips == 0
+    assert breaker.failing_since is None
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_for_twice_as_long(clock):
+    breaker = circuits.Breaker(1)
+    trip(breaker)
+    clock.advance(30)
+    breaker.allow()
+
+    assert breaker.record(False, 0.1) is True
+    assert breaker.state == circuits.OPEN
+    assert breaker.trips == 2
+    assert breaker.retry_delay() == 60.0
+
+    clock.advance(60)
+    breaker.allow()
+    breaker.record(False, 0.1)
+    # Capped at MAX_OPEN_SECONDS
+    assert breaker.retry_delay() == 100.0
+
+
+def test_slow_probe_counts_as_failure(clock):
+    breaker = circuits.Breaker(1)
+    trip(breaker)
+    clock.advance(30)
+    breaker.allow()
+    breaker.record(True, 6.0)
+    assert breaker.state == circuits.OPEN
+
+
+def test_outcomes_from_before_the_probe_are_ignored(clock):
+    breaker = circuits.Breaker(1)
+    trip(breaker)
+    assert breaker.record(True, 0.1) is False
+
+    clock.advance(30)
+    breaker.allow()
+    breaker.record(True, 0.1)
+    # The half-open probe has already reported
+    assert breaker.state == circuits.CLOSED
+    assert breaker.record(False, 0.1) is False
+
+
+def test_auto_disable_after_failing_long_enough(monkeypatch, clock):
+    breaker = circuits.Breaker(1)
+    trip(breaker)
+    assert not breaker.should_disable()
+
+    monkeypatch.setattr(circuits, "AUTO_DISABLE_SECONDS", 120.0)
+    clock.advance(119)
+    assert not breaker.should_disable()
+
+    # Failing probes keep the original failing_since
+    breaker.allow()
+    breaker.record(False, 0.1)
+    clock.advance(1)
+    assert breaker.should_disable()
+
+
+def test_auto_disable_resets_when_circuit_closes(monkeypatch, clock):
+    monkeypatch.setattr(circuits, "AUTO_DISABLE_SECONDS", 120.0)
+    breaker = circuits.Breaker(1)
+    trip(breaker)
+    clock.advance(30)
+    breaker.allow()
+    breaker.record(True, 0.1)
+
+    clock.advance(200)
+    assert not breaker.should_disable()
+
+
+def test_adopt_takes_over_saved_state(clock):
+    breaker = circuits.Breaker(1)
+    breaker.adopt({
+        "state": circuits.OPEN, "trips": 3, "version": 7, "open_seconds": 45,
+        "failing_seconds": 300, "error_rate": 0.9, "slow_rate": None,
+    })
+    assert breaker.state == circuits.OPEN
+    assert breaker.version == 7
+    assert breaker.retry_delay() == 45
+    assert breaker.failing_since == clock.now - 300
+    assert not breaker.allow()
+
+
+def test_apply_only_adopts_newer_versions(monkeypatch):
+    monkeypatch.setattr(circuits, "_breakers", {})
+    breaker = circuits.get(424242)
+    breaker.version = 5
+    row = {
+        "webhook_id": 424242, "state": circuits.OPEN, "trips": 1, "version": 5, "open_seconds": 30,
+        "failing_seconds": 0, "error_rate": 1.0, "slow_rate": 0.0,
+    }
+    circuits.apply([row])
+    assert breaker.state == circuits.CLOSED
+
+    circuits.apply([{**row, "version": 6}])
+    assert breaker.state == circuits.OPEN
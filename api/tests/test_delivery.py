@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import delivery
+
+
+@pytest.fixture(autouse=True)
+def policy(monkeypatch):
+    monkeypatch.setattr(delivery, "RETRY_BASE_DELAY", 30.0)
+    monkeypatch.setattr(delivery, "RETRY_MAX_DELAY", 600.0)
+
+
+@pytest.mark.parametrize("attempts, backoff", [(0, 30), (1, 30), (2, 60), (3, 120), (5, 480), (6, 600), (20, 600)])
+def test_retry_delay_is_jittered_exponential_backoff(attempts, backoff):
+    delays = [delivery.retry_delay(attempts) for _ in range(200)]
+    assert all(backoff / 2 <= delay <= backoff for delay in delays)
+    # Jitter spreads retries out rather than landing them together
+    assert len(set(delays)) > 1
+
+
+def test_retry_after_wins_when_longer():
+    assert delivery.retry_delay(1, retry_after=300) == 300
+
+
+def test_retry_after_shorter_than_backoff_is_ignored():
+    assert 15 <= delivery.retry_delay(1, retry_after=1) <= 30
+
+
+def test_retry_after_is_capped_at_max_delay():
+    assert delivery.retry_delay(1, retry_after=86400) == 600
+
+
+def test_parse_retry_after_seconds():
+    assert delivery.parse_retry_after("120") == 120
+    assert delivery.parse_retry_after("1.5") == 1.5
+    assert delivery.parse_retry_after("-5") == 0
+
+
+def test_parse_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=90)
+    seconds = delivery.parse_retry_after(format_datetime(retry_at, usegmt=True))
+    assert 85 <= seconds <= 90
+
+
+def test_parse_retry_after_past_http_date_is_zero():
+    retry_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    assert delivery.parse_retry_after(format_datetime(retry_at, usegmt=True)) == 0
+
+
+@pytest.mark.parametrize("value", [None, "", "soon", "Mon, 99 Foo 2024"])
+def test_parse_retry_after_invalid(value):
+    assert delivery.parse_retry_after(value) is None
+
+
+def test_http_date_retry_after_sets_the_delay():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=400)
+    retry_after = delivery.parse_retry_after(format_datetime(retry_at, usegmt=True))
+    assert 395 <= delivery.retry_delay(1, retry_after) <= 400
+
+
+def test_targets_on_one_host_share_a_slot(monkeypatch):
+    monkeypatch.setattr(delivery, "_host_slots", {})
+    zapier = delivery._host_semaphore("https://hooks.zapier.com/hooks/catch/1/")
+    assert delivery._host_semaphore("https://HOOKS.zapier.com/hooks/catch/2/") is zapier
+    assert delivery._host_semaphore("https://hook.eu1.make.com/abc") is not zapier
+    assert delivery._host_semaphore("https://hooks.zapier.com:8443/x") is not zapier
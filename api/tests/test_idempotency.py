@@ -0,0 +1,106 @@
+import pytest
+
+import idempotency
+
+
+class FakeCursor:
+    """
+    Answers the idempotency_keys lookup with `existing` rows
+    """
+    def __init__(self, existing=None):
+        self.existing = existing or {}
+
+    def execute(self, query, params=None):
+        self._rows = [{"key": key, "tracking_id": self.existing[key]} for key in params[0] if key in self.existing]
+
+    def fetchall(self):
+        return self._rows
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    """
+    Events passed to outbox.enqueue_many; every new key is claimed
+    """
+    events = []
+
+    def execute_values(cur, query, rows, **kwargs):
+        return [{"key": row[0]} for row in rows]
+
+    monkeypatch.setattr(idempotency, "execute_values", execute_values)
+    monkeypatch.setattr(idempotency.outbox, "enqueue_many", lambda cur, items: events.extend(items))
+    return events
+
+
+LEAD = {"first_name": "Ana", "email": "ana@example.com", "interest_type": "villas"}
+
+
+def test_explicit_key_wins_over_content():
+    a = idempotency.claim_for("lead.created", LEAD, "key-1")
+    b = idempotency.claim_for("lead.created", {**LEAD, "first_name": "Bea"}, "key-1")
+    assert a == b
+    assert len(a.keys) == 1
+    assert a.ttl == idempotency.KEY_TTL_SECONDS
+
+
+def test_explicit_key_is_scoped_to_the_event():
+    assert idempotency.claim_for("lead.created", LEAD, "key-1") != idempotency.claim_for("booking.created", LEAD, "key-1")
+
+
+def test_content_key_ignores_per_request_fields():
+    a = idempotency.claim_for("lead.created", {**LEAD, "tracking_id": "t1", "created_at": "2025-01-01"})
+    b = idempotency.claim_for("lead.created", {**LEAD, "tracking_id": "t2", "created_at": "2025-01-02"})
+    assert a.keys == b.keys
+
+    c = idempotency.claim_for("lead.created", {**LEAD, "interest_type": "yachts"})
+    assert c.keys[0] != a.keys[0]
+
+
+def test_content_key_covers_current_and_previous_window(monkeypatch):
+    window = idempotency.DEDUP_WINDOW_SECONDS
+    monkeypatch.setattr(idempotency.time, "time", lambda: 100 * window + 1)
+    early = idempotency.claim_for("lead.created", LEAD)
+    monkeypatch.setattr(idempotency.time, "time", lambda: 101 * window + 1)
+    late = idempotency.claim_for("lead.created", LEAD)
+
+    assert len(late.keys) == 2
+    assert late.keys[1] == early.keys[0]
+    assert late.ttl == 2 * window
+
+
+def test_duplicates_within_one_batch(queued):
+    items = [
+        ("lead.created", dict(LEAD), idempotency.claim_for("lead.created", LEAD, "key-1")),
+        ("lead.created", dict(LEAD), idempotency.claim_for("lead.created", LEAD, "key-2")),
+        ("lead.created", dict(LEAD), idempotency.claim_for("lead.created", LEAD, "key-1")),
+    ]
+    results = idempotency.enqueue_many(FakeCursor(), items)
+
+    assert [duplicate for _, duplicate in results] == [False, False, True]
+    assert results[2][0] == results[0][0]
+    assert results[1][0] != results[0][0]
+    assert len(queued) == 2
+    assert [payload["tracking_id"] for _, payload in queued] == [results[0][0], results[1][0]]
+
+
+def test_identical_content_within_one_batch(queued):
+    items = [("lead.created", dict(LEAD), idempotency.claim_for("lead.created", LEAD)) for _ in range(2)]
+    results = idempotency.enqueue_many(FakeCursor(), items)
+
+    assert results[1] == (results[0][0], True)
+    assert len(queued) == 1
+
+
+def test_duplicate_of_an_earlier_request(queued):
+    claim = idempotency.claim_for("lead.created", LEAD, "key-1")
+    cursor = FakeCursor({claim.keys[0]: "original"})
+    results = idempotency.enqueue_many(cursor, [("lead.created", dict(LEAD), claim)])
+
+    assert results == [("original", True)]
+    assert queued == []
+
+
+def test_previous_window_key_counts_as_duplicate(queued):
+    claim = idempotency.claim_for("lead.created", LEAD)
+    cursor = FakeCursor({claim.keys[1]: "original"})
+    assert idempotency.enqueue_once(cursor, "lead.created", dict(LEAD), claim) == ("original", True)
@@ -0,0 +1,58 @@
+import json
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+
+LEAD = {"first_name": "Ana", "email": "ana@example.com", "interest_type": "villas"}
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 3, 14, 9, 26, 53, 589793)
+    cursor = main._encode_cursor({"created_at": created_at, "id": 42})
+    assert "=" not in cursor
+    assert main._decode_cursor(cursor) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not base64!",
+    "bm90IGpzb24",  # "not json"
+    "WzFd",  # [1]
+    "WyJub3QgYSBkYXRlIiwgMV0",  # ["not a date", 1]
+    "WyIyMDI1LTAxLTAxIiwgImEiXQ",  # ["2025-01-01", "a"]
+])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as raised:
+        main._decode_cursor(cursor)
+    assert raised.value.status_code == 400
+
+
+def test_ndjson_batch_reports_bad_lines_per_item(monkeypatch):
+    async def run(fn, items):
+        return [(f"t{i}", False) for i, _ in enumerate(items)]
+
+    monkeypatch.setattr(main.db, "run", run)
+    body = "\n".join([
+        json.dumps({"event": "lead.created", "data": LEAD}),
+        '{"event": "lead.created", "data": ',
+        '',
+        json.dumps({"event": "lead.created", "data": {**LEAD, "email": "bea@example.com"}}),
+    ])
+    response = TestClient(main.app).post(
+        "/api/events/batch", content=body, headers={"Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["queued", "error", "queued"]
+    assert results[1]["index"] == 1
+    assert results[1]["error"].startswith("Invalid JSON")
+
+
+def test_malformed_json_array_is_a_400():
+    response = TestClient(main.app).post("/api/events/batch", content="[{", headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
@@ -0,0 +1,62 @@
+import pytest
+
+import rate_limit
+from rate_limit import TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(rate_limit, "time", clock)
+
+
+def test_starts_full_and_drains():
+    bucket = TokenBucket(rate=5)
+    for _ in range(5):
+        assert bucket._try_take() == 0
+    assert bucket._try_take() == pytest.approx(0.2)
+
+
+def test_refills_at_rate(clock):
+    bucket = TokenBucket(rate=5)
+    for _ in range(5):
+        bucket._try_take()
+    clock.advance(0.5)
+    assert bucket._try_take() == 0
+    assert bucket._try_take() == 0
+    assert bucket._try_take() > 0
+
+
+def test_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(rate=5, capacity=2)
+    clock.advance(60)
+    assert bucket._try_take() == 0
+    assert bucket._try_take() == 0
+    assert bucket._try_take() > 0
+
+
+def test_acquire_waits_for_a_token(clock):
+    bucket = TokenBucket(rate=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert bucket.acquire() == pytest.approx(0.5)
+    stats = bucket.stats()
+    assert stats["acquired"] == 3
+    assert stats["queue_depth"] == 0
+    assert stats["throttled_seconds"] == 0.5
+
+
+def test_pause_empties_the_bucket(clock):
+    bucket = TokenBucket(rate=5)
+    bucket.pause(30)
+    assert bucket._try_take() == 30
+    clock.advance(10)
+    assert bucket._try_take() == 20
+    clock.advance(20)
+    assert bucket._try_take() == 0
+
+
+def test_later_pause_does_not_shorten_an_earlier_one():
+    bucket = TokenBucket(rate=5)
+    bucket.pause(30)
+    bucket.pause(5)
+    assert bucket._try_take() == 30
@@ -0,0 +1,117 @@
+import os
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+from psycopg2.extras import RealDictCursor
+
+import schema
+
+# Schema changes need a real Postgres; the tests run in a throwaway schema
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+
+@pytest.fixture
+def cur():
+    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {name}")
+            cur.execute(f"SET search_path TO {name}")
+            yield cur
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {name} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def create_legacy_tables(cur):
+    # The tables as created before webhook_deliveries was partitioned
+    cur.execute("""
+        CREATE TABLE webhook_targets (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            url TEXT NOT NULL,
+            service_type VARCHAR(100) NOT NULL,
+            auth_header TEXT,
+            is_active BOOLEAN DEFAULT TRUE,
+            events JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE webhook_deliveries (
+            id SERIAL PRIMARY KEY,
+            webhook_id INTEGER REFERENCES webhook_targets(id),
+            event VARCHAR(100) NOT NULL,
+            payload JSONB NOT NULL,
+            response_status INTEGER,
+            response_body TEXT,
+            attempts INTEGER DEFAULT 0,
+            success BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        INSERT INTO webhook_targets (name, url, service_type, events)
+        VALUES ('zapier', 'https://hooks.zapier.com/x', 'zapier', '["lead.created"]')
+    """)
+
+
+def test_create_tables_on_empty_database(cur):
+    schema.create_tables(cur)
+    schema.create_tables(cur)
+
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('webhook_deliveries')")
+    assert cur.fetchone()["relkind"] == "p"
+    assert len(schema.list_partitions(cur)) == schema.PARTITION_MONTHS_AHEAD + 1
+
+
+def test_converts_pre_partitioning_table(cur):
+    create_legacy_tables(cur)
+    cur.execute("""
+        INSERT INTO webhook_deliveries (webhook_id, event, payload, success, created_at)
+        VALUES (1, 'lead.created', '{"n": 1}', TRUE, '2024-01-15'),
+               (1, 'lead.created', '{"n": 2}', FALSE, NULL)
+    """)
+
+    schema.create_tables(cur)
+
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('webhook_deliveries')")
+    assert cur.fetchone()["relkind"] == "p"
+    partitions = dict(schema.list_partitions(cur))
+    assert "webhook_deliveries_legacy" in partitions
+
+    cur.execute("SELECT id, payload FROM webhook_deliveries ORDER BY id")
+    assert [row["payload"] for row in cur.fetchall()] == [{"n": 1}, {"n": 2}]
+
+    # New rows keep numbering after the old ones and land in a monthly partition
+    cur.execute("""
+        INSERT INTO webhook_deliveries (webhook_id, event)
+        VALUES (1, 'lead.created')
+        RETURNING id, tableoid::regclass::text AS partition
+    """)
+    row = cur.fetchone()
+    assert row["id"] == 3
+    assert row["partition"] in partitions
+
+    # Running again on a converted install changes nothing
+    schema.create_tables(cur)
+    assert dict(schema.list_partitions(cur)) == partitions
+
+
+def test_converts_empty_pre_partitioning_table(cur):
+    create_legacy_tables(cur)
+
+    schema.create_tables(cur)
+
+    cur.execute("SELECT to_regclass('webhook_deliveries_legacy') AS legacy")
+    assert cur.fetchone()["legacy"] is None
+    cur.execute("INSERT INTO webhook_deliveries (webhook_id, event) VALUES (1, 'lead.created') RETURNING id")
+    assert cur.fetchone()["id"] == 1
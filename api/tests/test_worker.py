@@ -0,0 +1,34 @@
+import asyncio
+
+import db
+import delivery
+import worker
+
+
+def test_webhooks_do_not_wait_for_airtable(monkeypatch):
+    order = []
+
+    async def write_airtable(row, attempts):
+        order.append("airtable started")
+        await asyncio.sleep(0.05)
+        order.append("airtable done")
+        return "retrying", "Airtable: 503", 30.0
+
+    async def send_webhooks(event, payload):
+        order.append("webhooks started")
+
+    async def run(fn, *args):
+        order.append(("processed",) + args)
+
+    monkeypatch.setattr(worker, "_write_airtable", write_airtable)
+    monkeypatch.setattr(delivery, "send_webhooks_for_event", send_webhooks)
+    monkeypatch.setattr(db, "run", run)
+
+    asyncio.run(worker._process_event({"id": 7, "event": "lead.created", "tracking_id": "t", "payload": {}}))
+
+    assert order == [
+        "airtable started",
+        "webhooks started",
+        "airtable done",
+        ("processed", 7, "retrying", "Airtable: 503", 30.0),
+    ]
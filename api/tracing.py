@@ -0,0 +1,204 @@
+import os
+import json
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional
+
+logger = logging.getLogger("tracing")
+
+# Tracing is off unless an exporter is chosen: "otlp", "file" or "console"
+EXPORTER = os.environ.get("TRACING_EXPORTER", "none").lower()
+# Share of new traces recorded; traces continued from a parent follow the parent
+SAMPLE_RATIO = float(os.environ.get("TRACING_SAMPLE_RATIO", "0.1"))
+FILE_PATH = os.environ.get("TRACING_FILE", "traces.jsonl")
+
+try:
+    from opentelemetry import trace, propagate
+except ImportError:
+    # The API package is optional; without it every span is a no-op
+    trace = None
+    propagate = None
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def update_name(self, name: str) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_tracer = None
+
+# Until setup succeeds every helper returns immediately, so disabled
+# tracing costs one flag check per call
+_enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def setup(service_name: str) -> bool:
+    """
+    Install the exporter chosen by TRACING_EXPORTER for this process
+
+    Needs the optional opentelemetry-sdk package (and the OTLP exporter
+    package for "otlp"). Spans are exported from a background thread in
+    batches, so request handling never waits on the exporter.
+    """
+    if EXPORTER in ("", "none") or trace is None:
+        return False
+
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+        if EXPORTER == "otlp":
+            # Endpoint and headers come from the standard OTEL_EXPORTER_OTLP_* variables
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter()
+        elif EXPORTER == "file":
+            exporter = ConsoleSpanExporter(
+                out=open(FILE_PATH, "a"),
+                formatter=lambda span: span.to_json(indent=None) + "\n",
+            )
+        elif EXPORTER == "console":
+            exporter = ConsoleSpanExporter()
+        else:
+            logger.warning(f"Unknown TRACING_EXPORTER '{EXPORTER}', tracing disabled")
+            return False
+    except ImportError as e:
+        logger.warning(f"Tracing disabled, OpenTelemetry SDK not installed: {e}")
+        return False
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    global _tracer, _enabled
+    _tracer = trace.get_tracer("cabo-webhook-api")
+    _enabled = True
+    logger.info(f"Tracing enabled (exporter={EXPORTER}, sample_ratio={SAMPLE_RATIO})")
+    return True
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None, context=None) -> Iterator[Any]:
+    """
+    Run the block in a child span of the current one (or of `context`)
+    """
+    if not _enabled:
+        yield _NOOP_SPAN
+        return
+    with _tracer.start_as_current_span(name, context=context, attributes=attributes) as current:
+        yield current
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """
+    Tag the current span, e.g. with the event's tracking_id
+    """
+    if _enabled:
+        trace.get_current_span().set_attribute(key, value)
+
+
+def current_trace_id() -> Optional[str]:
+    """
+    Hex trace ID of the current span, for correlating logs with traces
+    """
+    if not _enabled:
+        return None
+    context = trace.get_current_span().get_span_context()
+    return format(context.trace_id, "032x") if context.is_valid else None
+
+
+def inject(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Add the current trace context (traceparent) to `headers`
+    """
+    headers = headers if headers is not None else {}
+    if _enabled:
+        propagate.inject(headers)
+    return headers
+
+
+def serialize_context() -> Optional[str]:
+    """
+    The current trace context as a string to store alongside queued work
+    """
+    carrier = inject()
+    return json.dumps(carrier) if carrier else None
+
+
+def restore_context(serialized: Optional[str]):
+    """
+    Context to pass to `span` so queued work continues its original trace
+    """
+    if not _enabled or not serialized:
+        return None
+    try:
+        return propagate.extract(json.loads(serialized))
+    except ValueError:
+        return None
+
+
+def _framework_traces_requests() -> bool:
+    # Newer FastAPI releases open their own OpenTelemetry server span per
+    # request once a tracer provider is installed
+    try:
+        import fastapi.telemetry  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a server span per request, named by route template
+
+    Does nothing on FastAPI versions that already trace requests natively.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.native = _framework_traces_requests()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _enabled or self.native:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        context = propagate.extract(headers)
+
+        with _tracer.start_as_current_span(
+            scope["method"], context=context, kind=trace.SpanKind.SERVER,
+            attributes={"http.method": scope["method"], "http.target": scope.get("path", "")},
+        ) as current:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    current.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    current.update_name(f"{scope['method']} {route.path}")
+                    current.set_attribute("http.route", route.path)
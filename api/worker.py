@@ -0,0 +1,344 @@
+import os
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from typing import Dict, Any, Optional, Set, Tuple
+
+import requests
+
+from airtable_connector import AirtableConnector
+from airtable_batch import AirtableBatchWriter
+from airtable_mapping import MappingError
+import circuits
+import db
+import delivery
+import logs
+import metrics
+import outbox
+import retries
+import schema
+import subscriptions
+import tracing
+
+# Setup logging
+logs.setup()
+logger = logging.getLogger("delivery-worker")
+
+# How often queue depth gauges are refreshed from the database
+QUEUE_DEPTH_INTERVAL = float(os.environ.get("QUEUE_DEPTH_INTERVAL", "15"))
+
+# How often the worker makes sure upcoming delivery partitions exist
+PARTITION_CHECK_INTERVAL = float(os.environ.get("DELIVERY_PARTITION_CHECK_INTERVAL", "21600"))
+
+# How often circuit states saved by other processes (or reset by an admin) are picked up
+CIRCUIT_SYNC_INTERVAL = float(os.environ.get("CIRCUIT_SYNC_INTERVAL", "10"))
+
+# Failed Airtable writes are retried with the webhook backoff until this many attempts
+AIRTABLE_MAX_ATTEMPTS = int(os.environ.get("AIRTABLE_MAX_ATTEMPTS", "8"))
+
+airtable = None
+airtable_writer = None
+
+# Fire-and-forget startup tasks, kept referenced until they finish
+_background: Set[asyncio.Task] = set()
+
+
+def _init_airtable() -> None:
+    global airtable, airtable_writer
+    try:
+        airtable = AirtableConnector()
+        airtable_writer = AirtableBatchWriter(airtable)
+        metrics.AIRTABLE_PENDING.set_function(airtable_writer.pending)
+        metrics.AIRTABLE_WAITING.set_function(lambda: airtable.rate_limiter.stats()["queue_depth"])
+        logger.info("Airtable connector initialized successfully")
+        # Checking the tables talks to Airtable, so never hold up startup for it
+        task = asyncio.create_task(asyncio.to_thread(airtable.verify_tables))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    except Exception as e:
+        logger.warning("Airtable connector initialization failed: %s", e)
+        airtable = None
+        airtable_writer = None
+
+
+async def process_event(row: Dict[str, Any]) -> None:
+    """
+    Deliver one outbox event to Airtable and every subscribed webhook
+    """
+    # Continue the trace of the request that queued the event
+    attributes = {"event": row["event"], "tracking_id": row["tracking_id"], "outbox.id": row["id"]}
+    with tracing.span("process_event", attributes, context=tracing.restore_context(row.get("trace_context"))):
+        await _process_event(row)
+
+
+async def _process_event(row: Dict[str, Any]) -> None:
+    # The Airtable write can wait on the batch linger, the rate limit or a
+    # 429 pause, so the webhooks go out alongside it rather than after it.
+    # Webhook failures are recorded per target in webhook_deliveries.
+    (airtable_status, error, retry_delay), _ = await asyncio.gather(
+        _write_airtable(row, attempts=1),
+        delivery.send_webhooks_for_event(row["event"], row["payload"]),
+    )
+
+    try:
+        await db.run(outbox.mark_processed, row["id"], airtable_status, error, retry_delay)
+    except Exception as e:
+        # The lease expires and another worker picks the event up again
+        logger.error("Error marking outbox event processed: %s", e, extra=_log_context(row))
+
+
+def _log_context(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {"event": row["event"], "tracking_id": row["tracking_id"], "outbox_id": row["id"]}
+
+
+def _airtable_retryable(error: Exception) -> bool:
+    # A record Airtable rejects, or one that cannot be mapped, fails the same way every time
+    if isinstance(error, MappingError):
+        return False
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in delivery.RETRYABLE_STATUS_CODES
+    return True
+
+
+async def _write_airtable(row: Dict[str, Any], attempts: int) -> Tuple[Optional[str], Optional[str], Optional[float]]:
+    """
+    Create the event's Airtable record
+
+    Returns the Airtable status to store ('succeeded', 'retrying' or
+    'dead', or None when the event has no Airtable table), the error and
+    the delay before the next attempt.
+    """
+    mapper = airtable.mappers.get(row["event"]) if airtable else None
+    if not (airtable_writer and mapper):
+        return None, None, None
+
+    try:
+        await airtable_writer.submit(mapper.table_name, mapper(row["payload"]), row["tracking_id"])
+        return "succeeded", None, None
+    except Exception as e:
+        error = f"Airtable: {e}"
+        if _airtable_retryable(e) and attempts < AIRTABLE_MAX_ATTEMPTS:
+            logger.warning("Error sending event to Airtable (attempt %s), will retry: %s", attempts, e,
+                           extra=_log_context(row))
+            return "retrying", error, delivery.retry_delay(attempts)
+        logger.error("Error sending event to Airtable, giving up after %s attempts: %s", attempts, e,
+                     extra=_log_context(row))
+        return "dead", error, None
+
+
+async def _retry_airtable(row: Dict[str, Any]) -> None:
+    context = tracing.restore_context(row.get("trace_context"))
+    with tracing.span("airtable_retry", {"event": row["event"], "tracking_id": row["tracking_id"]}, context=context):
+        status, error, retry_delay = await _write_airtable(row, row["airtable_attempts"])
+    try:
+        await db.run(outbox.mark_airtable, row["id"], status, error, retry_delay)
+    except Exception as e:
+        # The claim lease runs out and the write is retried again
+        logger.error("Error recording Airtable retry: %s", e, extra=_log_context(row))
+
+
+async def retry_airtable_writes(stop: asyncio.Event, batch_size: int, poll_interval: float) -> None:
+    """
+    Re-attempt failed Airtable writes as they come due until `stop` is set
+
+    Only the Airtable record is written again; the event's webhooks were
+    already delivered when it was first processed.
+    """
+    while not stop.is_set():
+        rows = []
+        if airtable_writer:
+            try:
+                rows = await db.run(outbox.claim_airtable_retries, batch_size)
+            except Exception as e:
+                logger.error("Error claiming Airtable retries: %s", e)
+
+        if rows:
+            logger.info("Retrying %s Airtable writes", len(rows))
+            await asyncio.gather(*(_retry_airtable(row) for row in rows), return_exceptions=True)
+            continue
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _queue_depth(cur) -> Dict[str, int]:
+    # Both counts are answered from the partial indexes on unfinished rows
+    cur.execute("""
+        SELECT
+            (SELECT count(*) FROM event_outbox WHERE status = 'pending') AS outbox,
+            (SELECT count(*) FROM webhook_deliveries
+             WHERE status IN ('retrying', 'deferred') AND next_attempt_at <= CURRENT_TIMESTAMP) AS retries_due
+    """)
+    return cur.fetchone()
+
+
+async def report_queue_depth(stop: asyncio.Event, interval: float = QUEUE_DEPTH_INTERVAL) -> None:
+    """
+    Keep the outbox and retry queue depth gauges current
+    """
+    while not stop.is_set():
+        try:
+            depth = await db.run(_queue_depth)
+            metrics.OUTBOX_DEPTH.set(depth["outbox"])
+            metrics.RETRIES_DUE.set(depth["retries_due"])
+        except Exception as e:
+            logger.error("Error reading queue depth: %s", e)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def maintain_partitions(stop: asyncio.Event, interval: float = PARTITION_CHECK_INTERVAL) -> None:
+    """
+    Keep future webhook_deliveries partitions created while the worker runs
+    """
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        if stop.is_set():
+            break
+        try:
+            await db.run(schema.ensure_partitions)
+        except Exception as e:
+            logger.error("Error creating webhook delivery partitions: %s", e)
+
+
+async def sync_circuits(stop: asyncio.Event, interval: float = CIRCUIT_SYNC_INTERVAL) -> None:
+    """
+    Keep this process's circuit breakers in step with webhook_circuit_state
+    """
+    while not stop.is_set():
+        try:
+            circuits.apply(await db.run(circuits.load))
+        except Exception as e:
+            logger.error("Error loading webhook circuit states: %s", e)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_worker(concurrency: int, batch_size: int, poll_interval: float,
+                     retry_batch_size: int, retry_poll_interval: float) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tracing.setup("delivery-worker")
+    db.open_pool()
+    await db.run(schema.create_tables)
+    delivery.start()
+    _init_airtable()
+    await subscriptions.index.refresh()
+
+    running: Set[asyncio.Task] = set()
+    metrics.EVENTS_IN_PROGRESS.set_function(lambda: len(running))
+    listener = asyncio.create_task(subscriptions.listen_for_changes(stop))
+    scheduler = asyncio.create_task(retries.run_retry_scheduler(stop, retry_batch_size, retry_poll_interval))
+    partitions = asyncio.create_task(maintain_partitions(stop))
+    depth = asyncio.create_task(report_queue_depth(stop))
+    circuit_sync = asyncio.create_task(sync_circuits(stop))
+    airtable_retries = asyncio.create_task(retry_airtable_writes(stop, retry_batch_size, retry_poll_interval))
+    logger.info("Delivery worker started (concurrency=%s, batch_size=%s)", concurrency, batch_size)
+
+    try:
+        while not stop.is_set():
+            free = concurrency - len(running)
+            if free <= 0:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            try:
+                rows = await db.run(outbox.claim_batch, min(batch_size, free))
+            except Exception as e:
+                logger.error("Error claiming outbox events: %s", e)
+                rows = []
+
+            for row in rows:
+                task = asyncio.create_task(process_event(row))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+            if not rows:
+                # Idle: sleep until the next poll or until asked to stop
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        logger.info("Delivery worker stopping, finishing %s in-flight events", len(running))
+        stop.set()
+        await asyncio.gather(listener, scheduler, partitions, depth, circuit_sync, airtable_retries, *running, return_exceptions=True)
+        if airtable_writer:
+            await airtable_writer.close()
+        if airtable:
+            airtable.close()
+        await delivery.close()
+        db.close_pool()
+
+
+def _run_process(metrics_port: int, *worker_args) -> None:
+    logs.setup()
+    if metrics_port:
+        metrics.serve(metrics_port)
+    try:
+        asyncio.run(run_worker(*worker_args))
+    finally:
+        # multiprocessing children exit without running atexit handlers
+        logs.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Deliver queued events from the event_outbox table")
+    parser.add_argument("--processes", type=int, default=int(os.environ.get("WORKER_PROCESSES", "1")),
+                        help="Number of worker processes to run")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("WORKER_CONCURRENCY", "20")),
+                        help="Events delivered concurrently per process")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("WORKER_BATCH_SIZE", "20")),
+                        help="Maximum events claimed per poll")
+    parser.add_argument("--poll-interval", type=float, default=float(os.environ.get("WORKER_POLL_INTERVAL", "1")),
+                        help="Seconds to wait between polls when the outbox is empty")
+    parser.add_argument("--retry-batch-size", type=int, default=int(os.environ.get("RETRY_BATCH_SIZE", "50")),
+                        help="Maximum due retries claimed per poll")
+    parser.add_argument("--retry-poll-interval", type=float, default=float(os.environ.get("RETRY_POLL_INTERVAL", "5")),
+                        help="Seconds to wait between polls when no retries are due")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("WORKER_METRICS_PORT", "0")),
+                        help="Serve Prometheus metrics on this port (process N uses port + N); 0 disables")
+    args = parser.parse_args()
+
+    worker_args = (args.concurrency, args.batch_size, args.poll_interval,
+                   args.retry_batch_size, args.retry_poll_interval)
+
+    if args.processes <= 1:
+        _run_process(args.metrics_port, *worker_args)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=_run_process,
+            args=(args.metrics_port + i if args.metrics_port else 0, *worker_args),
+            name=f"delivery-worker-{i}",
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    # Children get SIGINT from the terminal themselves; forward SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in processes])
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -31,8 +31,14 @@ fi
 echo "All required packages found. Starting server..."
 echo ""
 
-# Go to the API directory and start the server
+# Go to the API directory and start the delivery worker and the server.
+# Queued events only reach Airtable and the registered webhooks while the
+# worker runs, so it is stopped together with the server.
 cd api
+python3 worker.py &
+WORKER_PID=$!
+trap 'kill $WORKER_PID 2>/dev/null; wait $WORKER_PID' EXIT
+
 uvicorn main:app --host 0.0.0.0 --port 8000 --reload
 
 # Note: The --reload flag will automatically restart the server when files change